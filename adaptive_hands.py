@@ -0,0 +1,176 @@
+import time
+
+import cv2
+import numpy as np
+
+from gestures import hands_to_array
+from stage_timer import timings
+
+# (model complexity, input scale) from the best quality to the cheapest
+QUALITY_LEVELS = ((1, 1.0), (1, 0.75), (1, 0.5), (0, 0.5), (0, 0.35))
+
+# Mediapipe's palm detector looks at 192x192, scaling the input below that only loses detail
+MIN_INPUT_SIDE = 192
+
+
+# Runs Mediapipe only on the part of the frame around the hands, at the input scale and model
+# complexity that keep inference under target_ms. It has the same process() as a Hands object,
+# and results always use full frame coordinates.
+# The region is the box around every landmark of the previous result, grown by margin on each side.
+# It only moves when a hand gets near its edge, because moving it resets Mediapipe's tracking.
+# It goes back to the full frame when the hands are lost, and every full_frame_every frames while
+# fewer than max_num_hands are tracked, so a new hand coming in is found.
+# make_hands(model_complexity) returns a new Mediapipe Hands object.
+class AdaptiveHands:
+    def __init__(self, make_hands, target_ms=30.0, model_complexity=1, max_num_hands=2,
+                 margin=0.5, full_frame_every=30, adjust_every=15):
+        self.make_hands = make_hands
+        self.target_ms = target_ms
+        self.max_num_hands = max_num_hands
+        self.margin = margin
+        self.full_frame_every = full_frame_every
+        self.adjust_every = adjust_every
+
+        self.levels = [level for level in QUALITY_LEVELS if level[0] <= model_complexity]
+        self.level = 0
+        self.models = {}
+        self.model = self.get_model(self.levels[0][0])
+
+        self.roi = None  # (x0, y0, x1, y1) in pixels, None for the full frame
+        self.model_roi = None  # Region the model's tracking state belongs to
+        self.hands_found = 0
+        self.frames_since_full = 0
+        self.latency_ms = None  # Moving average of process() time
+        self.frames = 0
+        self.roi_frames = 0
+        self.roi_moves = 0
+        self.level_changes = 0
+
+    def get_model(self, complexity):
+        model = self.models.get(complexity)
+        if model is None:
+            model = self.models[complexity] = self.make_hands(complexity)
+        return model
+
+    # Region of the frame to run the model on this frame
+    def region(self):
+        if self.roi is None:
+            return None
+        self.frames_since_full += 1
+        if self.hands_found < self.max_num_hands and self.frames_since_full >= self.full_frame_every:
+            return None
+        return self.roi
+
+    def process(self, image):
+        start = time.perf_counter()
+        complexity, scale = self.levels[self.level]
+        height, width = image.shape[:2]
+        region = self.region()
+        if region is None:
+            self.frames_since_full = 0
+            x0, y0, x1, y1 = 0, 0, width, height
+        else:
+            x0, y0, x1, y1 = region
+            self.roi_frames += 1
+
+        # Mediapipe tracks the hand from the last frame, which is wrong once the crop moves
+        if region != self.model_roi:
+            self.model.reset()
+            self.model_roi = region
+
+        crop = image[y0:y1, x0:x1]
+        crop_width, crop_height = x1 - x0, y1 - y0
+        scale = min(1.0, max(scale, MIN_INPUT_SIDE / max(crop_width, crop_height)))
+        if scale < 1.0:
+            crop = cv2.resize(crop, (round(crop_width * scale), round(crop_height * scale)),
+                              interpolation=cv2.INTER_AREA)
+        elif region is not None:
+            crop = np.ascontiguousarray(crop)
+        timings.count("inference_pixels", crop.shape[0] * crop.shape[1])
+
+        results = self.model.process(crop)
+        if region is not None and results.multi_hand_landmarks:
+            self.to_full_frame(results.multi_hand_landmarks, x0, y0, crop_width, crop_height, width, height)
+        self.track(results, width, height)
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.latency_ms = elapsed_ms if self.latency_ms is None else 0.9 * self.latency_ms + 0.1 * elapsed_ms
+        self.frames += 1
+        if self.frames % self.adjust_every == 0:
+            self.adjust()
+        return results
+
+    # Landmarks come back relative to the crop, move them to the full frame (z scales like x)
+    def to_full_frame(self, multi_hand_landmarks, x0, y0, crop_width, crop_height, width, height):
+        for hand in multi_hand_landmarks:
+            for point in hand.landmark:
+                point.x = (x0 + point.x * crop_width) / width
+                point.y = (y0 + point.y * crop_height) / height
+                point.z = point.z * crop_width / width
+
+    # Function to pick the region for the next frame from this frame's landmarks
+    def track(self, results, width, height):
+        landmarks = hands_to_array(results.multi_hand_landmarks)
+        self.hands_found = len(landmarks)
+        if self.hands_found == 0:
+            self.roi = None
+            return
+
+        x = landmarks[..., 0] * width
+        y = landmarks[..., 1] * height
+        left, top, right, bottom = x.min(), y.min(), x.max(), y.max()
+        if self.roi is not None:
+            x0, y0, x1, y1 = self.roi
+            edge_x, edge_y = (x1 - x0) * 0.1, (y1 - y0) * 0.1
+            if left > x0 + edge_x and right < x1 - edge_x and top > y0 + edge_y and bottom < y1 - edge_y:
+                return
+
+        # Square around the hands, grown by margin on each side and kept inside the frame
+        side = max(right - left, bottom - top) * (1 + 2 * self.margin)
+        side = min(max(side, MIN_INPUT_SIDE), width, height)
+        center_x = min(max((left + right) / 2, side / 2), width - side / 2)
+        center_y = min(max((top + bottom) / 2, side / 2), height - side / 2)
+        roi = (int(center_x - side / 2), int(center_y - side / 2), int(center_x + side / 2), int(center_y + side / 2))
+        if side * side > 0.8 * width * height:
+            roi = None
+        if roi != self.roi:
+            self.roi_moves += 1
+        self.roi = roi
+
+    # Function to step down (or back up) the quality levels to stay around the target latency
+    def adjust(self):
+        level = self.level
+        if self.latency_ms > self.target_ms and level < len(self.levels) - 1:
+            level += 1
+        elif self.latency_ms < 0.6 * self.target_ms and level > 0:
+            level -= 1
+        if level == self.level:
+            return
+
+        self.level = level
+        self.level_changes += 1
+        self.latency_ms = None
+        model = self.get_model(self.levels[level][0])
+        if model is not self.model:
+            self.model = model
+            self.model_roi = False  # Unknown, reset before the next frame
+
+    def stats(self):
+        complexity, scale = self.levels[self.level]
+        return {
+            "model_complexity": complexity,
+            "input_scale": scale,
+            "latency_ms": self.latency_ms,
+            "roi_frames": self.roi_frames,
+            "roi_moves": self.roi_moves,
+            "level_changes": self.level_changes,
+        }
+
+    def report(self):
+        return ("Adaptive inference: model complexity {model_complexity}, input scale {input_scale}, "
+                "{roi_frames} frames cropped to the hands, region moved {roi_moves} times, "
+                "quality changed {level_changes} times".format(**self.stats()))
+
+    def close(self):
+        for model in self.models.values():
+            model.close()
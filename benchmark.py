@@ -0,0 +1,149 @@
+import argparse
+import json
+import math
+import os
+import platform
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+
+GAMES = ("game1", "game2", "game3")
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Stages in the order they happen in a frame
+STAGE_ORDER = ("capture", "frame_prep", "hands_process", "is_fist", "process_wrist_movement",
+               "detect_thumb_movement", "simulation", "draw", "draw_hud", "preview", "display_flip", "imshow", "frame")
+
+
+# Function to script a synthetic session that clicks through the menus and keeps the hand moving
+def synthetic_session(game, frames):
+    from synthetic_hands import hand_pose
+
+    if game == "game1":
+        # Open and close the fist every 20 frames, press Start and then Restart whenever it shows
+        poses = [hand_pose(fist=float((i // 20) % 2)) for i in range(frames)]
+        clicks = {0: (300, 300)}
+        clicks.update({i: (300, 380) for i in range(45, frames, 45)})
+    elif game == "game2":
+        # Tilt the hand left and right to walk under the tacos
+        poses = [hand_pose(angle=math.pi / 2 + 1.2 * math.sin(i / 15)) for i in range(frames)]
+        clicks = {-1: (400, 300)}
+    else:
+        # Point the thumb left and right, click to restart after a game over
+        poses = [hand_pose(thumb=0.03 * math.sin(i / 10)) for i in range(frames)]
+        clicks = {i: (400, 300) for i in range(60, frames, 60)}
+    return poses, clicks
+
+
+# Runs inside the child process: start the game as if it was run directly
+def run_game(script):
+    sys.path.insert(0, HERE)
+    if os.environ.get("NEROFLEX_STUB_IMSHOW"):
+        # No display for OpenCV windows here, so the preview window calls do nothing
+        import cv2
+        cv2.imshow = lambda *args, **kwargs: None
+        cv2.waitKey = lambda *args, **kwargs: -1
+        cv2.destroyAllWindows = lambda *args, **kwargs: None
+    runpy.run_path(script, run_name="__main__")
+
+
+def benchmark_game(game, args, workdir):
+    from synthetic_hands import write_recording
+
+    if args.replay:
+        replay_path = args.replay
+    else:
+        replay_path = os.path.join(workdir, f"{game}.nflm")
+        poses, clicks = synthetic_session(game, args.frames)
+        write_recording(replay_path, poses, clicks)
+
+    timings_path = os.path.join(workdir, f"{game}.json")
+    env = dict(os.environ,
+               SDL_VIDEODRIVER="dummy",
+               SDL_AUDIODRIVER="dummy",
+               NEROFLEX_REPLAY=replay_path,
+               NEROFLEX_MAX_FRAMES=str(args.frames),
+               NEROFLEX_TIMINGS=timings_path)
+    if args.model:
+        env["NEROFLEX_REPLAY_MODEL"] = "1"
+    if args.stub_imshow:
+        env["NEROFLEX_STUB_IMSHOW"] = "1"
+
+    script = os.path.join(HERE, f"{game}.py")
+    subprocess.run([sys.executable, os.path.abspath(__file__), "--run-game", script],
+                   env=env, check=True, stdout=subprocess.DEVNULL)
+    with open(timings_path) as f:
+        return json.load(f)
+
+
+def print_table(game, summary):
+    print(f"\n{game}")
+    print(f"  {'stage':<24}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    stages = summary["stages"]
+    for name in sorted(stages, key=lambda n: STAGE_ORDER.index(n) if n in STAGE_ORDER else len(STAGE_ORDER)):
+        stage = stages[name]
+        print(f"  {name:<24}{stage['count']:>7}{stage['p50_ms']:>10.3f}{stage['p95_ms']:>10.3f}{stage['p99_ms']:>10.3f}")
+    for name, counter in summary["counters"].items():
+        print(f"  {name:<24}{counter['count']:>7}{counter['p50']:>10.0f}{counter['p95']:>10.0f}{counter['max']:>10.0f}")
+
+
+# Function to print how the p95 of each stage changed against an earlier results file
+def print_comparison(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\np95 change against {baseline_path}")
+    for game, summary in results["games"].items():
+        old_stages = baseline.get("games", {}).get(game, {}).get("stages", {})
+        for name, stage in summary["stages"].items():
+            if name not in old_stages:
+                continue
+            old = old_stages[name]["p95_ms"]
+            change = (stage["p95_ms"] - old) / old * 100 if old else 0.0
+            print(f"  {game:<8}{name:<24}{old:>10.3f} -> {stage['p95_ms']:>8.3f} ms ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each stage of the games' main loops without a camera or window")
+    parser.add_argument("--games", nargs="+", choices=GAMES, default=list(GAMES))
+    parser.add_argument("--frames", type=int, default=300, help="frames to run per game")
+    parser.add_argument("--replay", help="recorded session to use instead of synthetic hands")
+    parser.add_argument("--model", action="store_true", help="also run the Mediapipe model on every frame")
+    parser.add_argument("--stub-imshow", action="store_true",
+                        default=sys.platform.startswith("linux") and not os.environ.get("DISPLAY"),
+                        help="skip the OpenCV window (default when there is no display)")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--run-game", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_game:
+        run_game(args.run_game)
+        return
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "frames": args.frames,
+        "source": args.replay or "synthetic",
+        "model": args.model,
+        "imshow_stubbed": args.stub_imshow,
+        "games": {},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for game in args.games:
+            results["games"][game] = benchmark_game(game, args, workdir)
+            print_table(game, results["games"][game])
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from game_rules import AsteroidBatch, AsteroidSettings, LockGame, LockSettings, TacoBatch, TacoSettings
+
+GAMES = ("game1", "game2", "game3")
+
+# Steps per second of each game, the same as the SimClock of the game
+RATES = {"game1": 30, "game2": 30, "game3": 60}
+SETTINGS = {"game1": LockSettings, "game2": TacoSettings, "game3": AsteroidSettings}
+
+# Recorded sessions already turned into gestures in this process
+recordings = {}
+
+
+# Gestures of a recorded session (.nflm), worked out once with the same engine and thresholds as
+# the games: whether any hand makes a fist (game1), the walking direction (game2) and the steering
+# direction (game3) of every camera frame
+class RecordedGestures:
+    def __init__(self, path):
+        from gestures import standard_engine
+        from landmark_replay import LandmarkReplay
+
+        replay = LandmarkReplay(path)
+        if len(replay) < 2:
+            raise ValueError(f"{path} has too few frames to play")
+        engine = standard_engine()
+        fist, walk, steer = [], [], []
+        for results, capture_time in zip(replay.results, replay.capture_times):
+            if not results.multi_hand_landmarks:
+                # The games do not look at frames without hands either
+                fist.append(False)
+                walk.append(0)
+                steer.append(0)
+                continue
+            values = engine.evaluate(results, capture_time)
+            fist.append(bool(values["fist"].any()))
+            walk.append(int(values["walk"][0]))
+            steer.append(int(values["steer"].sum()))
+
+        times = np.array(replay.timestamps)
+        self.times = times - times[0]
+        # The recording is played in a loop, one frame interval after its last frame comes the first again
+        self.length = self.times[-1] + float(np.median(np.diff(self.times)))
+        self.fist_times = self.times[np.array(fist)]
+        self.walk = np.array(walk, dtype=np.int8)
+        self.steer = np.array(steer, dtype=np.int8)
+
+
+def load_recording(path):
+    if path not in recordings:
+        recordings[path] = RecordedGestures(path)
+    return recordings[path]
+
+
+# Scripted game1 player: waits for the next pass of the bar over the target zone and closes the
+# fist at its middle, off by a normal timing error of timing_sd seconds
+class ScriptedLockPlayer:
+    def __init__(self, rng, timing_sd):
+        self.rng = rng
+        self.timing_sd = timing_sd
+
+    # Capture time of the next fist after time `after`
+    def next_fist(self, lock, after, step_time):
+        start, end = lock.hit_window(after, step_time)
+        if start < after:
+            turn = 2 * math.pi / (lock.bar_speed / lock.step_seconds)
+            start, end = start + turn, end + turn
+        return (start + end) / 2 + self.rng.gauss(0, self.timing_sd)
+
+
+# Scripted game2 and game3 players of a whole batch of sessions. They decide where to go from
+# what they see, but act reaction seconds later. aim_sd is how far off (in pixels) they line up
+# with a new target. rng is a NumPy Generator.
+class ScriptedPlayers:
+    def __init__(self, rng, sessions, rate, reaction, aim_sd):
+        self.rng = rng
+        self.aim_sd = aim_sd
+        # Decisions on their way to the hands, the oldest is acted on next
+        self.decisions = np.zeros((max(1, round(reaction * rate)), sessions), dtype=np.int64)
+        self.next_decision = 0
+        self.target = np.full(sessions, -1, dtype=np.int64)
+        self.aim_error = np.zeros(sessions)
+
+    # Function to get each session's aim error for its target, a new one when the target changed.
+    # Only sessions in `aiming` take their target.
+    def aim(self, target, aiming):
+        changed = aiming & (target != self.target)
+        self.aim_error[changed] = self.rng.normal(0, self.aim_sd, changed.sum())
+        self.target[aiming] = target[aiming]
+        return self.aim_error
+
+    def keep(self, rows):
+        self.decisions = self.decisions[:, rows]
+        self.target = self.target[rows]
+        self.aim_error = self.aim_error[rows]
+
+    def direction(self, game):
+        acted = self.decisions[self.next_decision].copy()
+        self.decisions[self.next_decision] = self.decide(game)
+        self.next_decision = (self.next_decision + 1) % len(self.decisions)
+        return acted
+
+    # Function to walk towards x, staying put once within one step of it
+    @staticmethod
+    def towards(position, x, speed):
+        return np.where(np.abs(x - position) <= speed, 0, np.sign(x - position)).astype(np.int64)
+
+
+# Walk under the lowest taco they can still get to before the taco passes the mouth
+class ScriptedTacoPlayers(ScriptedPlayers):
+    def decide(self, game):
+        settings = game.settings
+        mouth = (game.player_x + settings.player_width / 2)[:, None]
+        steps_left = (game.player_y - 15 - game.y) / settings.obstacle_speed
+        distance = np.abs(game.x + settings.obstacle_width / 2 - mouth)
+        reachable = game.alive & (steps_left > 0) & (distance <= steps_left * settings.player_speed)
+        aiming = reachable.any(axis=1)
+        lowest = np.where(reachable, game.y, np.iinfo(np.int64).min).argmax(axis=1)
+        rows = np.arange(len(lowest))
+        aim = self.aim(game.serial[rows, lowest], aiming)
+        x = game.x[rows, lowest] + settings.obstacle_width / 2 + aim
+        return np.where(aiming, self.towards(mouth[:, 0], x, settings.player_speed), 0)
+
+
+# Get out from under asteroids about to hit the ship, otherwise line up with the lowest one that can
+# still be shot down before it gets to the ship. Both are judged by where the ship and the asteroids
+# will be once the decision reaches the hands, after the moves already on their way.
+class ScriptedAsteroidPlayers(ScriptedPlayers):
+    def decide(self, game):
+        settings = game.settings
+        x, alive = game.asteroid_x, game.asteroid_alive
+        ahead = len(self.decisions)
+        player_x = np.clip(game.player_x + settings.player_speed * self.decisions.sum(axis=0),
+                           0, settings.screen_width - settings.player_width)
+        y = game.asteroid_y + settings.asteroid_speed * ahead
+        column = player_x[:, None]
+
+        # Asteroids within three ship heights that would land on the ship
+        danger = alive & (y > game.player_y - 3 * settings.player_height) & \
+                 (x > column - settings.asteroid_size) & (x < column + settings.player_width + settings.asteroid_size)
+        dangers = danger.sum(axis=1)
+        middle = (x * danger).sum(axis=1) / np.maximum(dangers, 1) + settings.asteroid_size / 2
+        escape = np.where(middle > player_x + settings.player_width / 2, -1, 1)
+        moved = player_x + escape * settings.player_speed
+        escape[~((0 < moved) & (moved < settings.screen_width - settings.player_width))] *= -1
+
+        # About the steps the ship needs to fire the bullets that destroy an asteroid, with the last bullet's flight
+        shots = -(-settings.asteroid_health // (settings.damage_per_bullet + 1))
+        kill_steps = shots * (settings.shoot_delay + 1) + game.player_y / settings.bullet_speed
+        shootable = alive & (y + settings.asteroid_speed * kill_steps < game.player_y - settings.asteroid_size)
+        aiming = shootable.any(axis=1) & (dangers == 0)
+        lowest = np.where(shootable, y, -np.inf).argmax(axis=1)
+        rows = np.arange(len(lowest))
+        aim = self.aim(game.asteroid_serial[rows, lowest], aiming)
+        target = x[rows, lowest] + settings.asteroid_size / 2 + aim
+        lineup = self.towards(player_x + settings.player_width / 2, target, settings.player_speed)
+        return np.where(dangers > 0, escape, np.where(aiming, lineup, 0))
+
+
+# Plays a recorded session from a random point, as the camera would have delivered it:
+# each frame reaches the game latency seconds after it was taken
+class RecordedPlayer:
+    def __init__(self, recording, rng, latency):
+        self.recording = recording
+        self.offset = rng.uniform(0, recording.length)
+        self.latency = latency
+
+    # Capture time of the next recorded fist after time `after`
+    def next_fist(self, lock, after, step_time):
+        recording = self.recording
+        if not len(recording.fist_times):
+            return math.inf
+        lap, position = divmod(self.offset + after, recording.length)
+        index = int(np.searchsorted(recording.fist_times, position))
+        if index == len(recording.fist_times):
+            lap, index = lap + 1, 0
+        return recording.fist_times[index] + lap * recording.length - self.offset
+
+
+# A recorded session played from a random point in each session of a batch, like RecordedPlayer.
+# directions has the recording's walking (game2) or steering (game3) direction of every frame.
+# It is asked once per game step, rate times a second.
+class RecordedPlayers:
+    def __init__(self, recording, rng, sessions, rate, latency, directions):
+        self.recording = recording
+        self.offset = rng.uniform(0, recording.length, sessions)
+        self.step = 1.0 / rate
+        self.steps = 0
+        self.latency = latency
+        self.directions = directions.astype(np.int64)
+
+    def keep(self, rows):
+        self.offset = self.offset[rows]
+
+    # Directions from the newest frame that has reached the game by this step
+    def direction(self, game):
+        t = self.steps * self.step
+        self.steps += 1
+        if t < self.latency:
+            return np.zeros(len(self.offset), dtype=np.int64)
+        position = (self.offset + t - self.latency) % self.recording.length
+        return self.directions[np.searchsorted(self.recording.times, position, side="right") - 1]
+
+
+# Function to play game1 from fist to fist instead of step by step, with the bar moved on in
+# one go to the step the fist's camera frame reaches the game. Judged the same way as the game.
+def play_lock(settings, rng, player, latency, duration):
+    step = 1.0 / RATES["game1"]
+    lock = LockGame(settings, rng, step)
+    lock.start(0.0)
+    steps = 0
+    after = 0.0
+    end = duration
+    while not lock.game_over:
+        capture_time = player.next_fist(lock, max(after, lock.grace_until), steps * step)
+        now = capture_time + latency
+        if now > duration:
+            break
+        target_steps = int(now / step + 1e-6)
+        if target_steps > steps:
+            lock.advance(target_steps - steps)
+            steps = target_steps
+        lock.judge_fist(capture_time, steps * step, now)
+        after = capture_time + 1e-6
+        end = now
+    return {"score": lock.score, "hits": lock.hits, "misses": lock.misses,
+            "game_over": lock.game_over, "seconds": end if lock.game_over else duration}
+
+
+# Function to play a batch of game2 sessions together, step by step
+def play_taco(settings, rng, players, sessions, duration):
+    game = TacoBatch(settings, rng, sessions)
+    for _ in range(int(duration * RATES["game2"])):
+        game.step(players.direction(game))
+    return [{"score": score, "hits": hits, "misses": misses, "game_over": False, "seconds": duration}
+            for score, hits, misses in zip(game.score.tolist(), game.tacos_eaten.tolist(), game.tacos_missed.tolist())]
+
+
+# Function to play a batch of game3 sessions together until every one is lost or duration is up.
+# Once half the sessions still in the batch are lost they are taken out, so the last long
+# sessions do not drag the lost ones along.
+def play_asteroids(settings, rng, players, sessions, duration):
+    game = AsteroidBatch(settings, rng, sessions)
+    step = 1.0 / RATES["game3"]
+    results = [None] * sessions
+    rows = np.arange(sessions)  # Session of each row of the batch
+
+    def collect(finished):
+        for row in np.flatnonzero(finished).tolist():
+            results[rows[row]] = {"score": int(game.score[row]), "hits": int(game.asteroids_destroyed[row]),
+                                  "misses": int(game.asteroids_taken[row]), "game_over": bool(game.game_over[row]),
+                                  "seconds": int(game.steps_played[row]) * step}
+
+    for _ in range(int(duration * RATES["game3"])):
+        game.step(players.direction(game))
+        if game.game_over.sum() * 2 >= len(rows):
+            collect(game.game_over)
+            playing = np.flatnonzero(~game.game_over)
+            rows = rows[playing]
+            if not len(rows):
+                break
+            game.keep(playing)
+            players.keep(playing)
+    collect(np.ones(len(rows), dtype=bool))
+    return results
+
+
+# Function to play one game1 session from its seed
+def run_lock_session(settings, options, seed, duration):
+    # The game and the player draw from separate generators, so a change to the player does
+    # not change where the targets come
+    game_rng = random.Random(seed * 2)
+    player_rng = random.Random(seed * 2 + 1)
+    if options["recording"]:
+        player = RecordedPlayer(load_recording(options["recording"]), player_rng, options["latency"])
+    else:
+        player = ScriptedLockPlayer(player_rng, options["timing_sd"])
+    return play_lock(settings, game_rng, player, options["latency"], duration)
+
+
+# Function to play a batch of sessions. Runs in the worker processes, so it only takes plain values:
+# (game, settings overrides, player options, session seeds, duration in seconds).
+# game1 jumps from fist to fist one session at a time, game2 and game3 step all sessions together.
+def run_batch(task):
+    game, overrides, options, seeds, duration = task
+    settings = SETTINGS[game](**overrides)
+    if game == "game1":
+        return [run_lock_session(settings, options, seed, duration) for seed in seeds]
+
+    # One generator for the games and one for the players of the batch, so a change to the players
+    # does not change where the tacos and asteroids come
+    game_rng, player_rng = (np.random.default_rng(sequence) for sequence in np.random.SeedSequence(seeds).spawn(2))
+    sessions = len(seeds)
+    if options["recording"]:
+        recording = load_recording(options["recording"])
+        directions = recording.walk if game == "game2" else recording.steer
+        players = RecordedPlayers(recording, player_rng, sessions, RATES[game], options["latency"], directions)
+    elif game == "game2":
+        players = ScriptedTacoPlayers(player_rng, sessions, RATES[game], options["reaction"], options["aim_sd"])
+    else:
+        players = ScriptedAsteroidPlayers(player_rng, sessions, RATES[game], options["reaction"], options["aim_sd"])
+
+    if game == "game2":
+        return play_taco(settings, game_rng, players, sessions, duration)
+    return play_asteroids(settings, game_rng, players, sessions, duration)
+
+
+# Function to turn "name=1,2,3" into (name, [1, 2, 3]), whole numbers stay ints
+def parse_sweep(text):
+    name, _, values = text.partition("=")
+    if not name or not values:
+        raise argparse.ArgumentTypeError(f"expected name=value[,value...], got {text!r}")
+    parsed = []
+    for value in values.split(","):
+        try:
+            parsed.append(int(value))
+        except ValueError:
+            try:
+                parsed.append(float(value))
+            except ValueError:
+                raise argparse.ArgumentTypeError(f"{value!r} is not a number") from None
+    return name, parsed
+
+
+# Score and failure distributions of the sessions played with one setting
+def summarize(sessions, duration):
+    scores = np.array([session["score"] for session in sessions])
+    hits = np.array([session["hits"] for session in sessions])
+    misses = np.array([session["misses"] for session in sessions])
+    seconds = np.array([session["seconds"] for session in sessions])
+    game_over = np.array([session["game_over"] for session in sessions])
+    attempts = hits + misses
+    p10, p50, p90 = np.percentile(scores, [10, 50, 90])
+    values, counts = np.unique(scores, return_counts=True)
+    return {
+        "sessions": len(sessions),
+        "score_mean": float(scores.mean()),
+        "score_p10": float(p10),
+        "score_p50": float(p50),
+        "score_p90": float(p90),
+        "score_histogram": {str(value): int(count) for value, count in zip(values.tolist(), counts.tolist())},
+        # Share of sessions lost before duration, and of fists, tacos or asteroids that went wrong
+        "game_over_rate": float(game_over.mean()),
+        "miss_rate": float(misses.sum() / attempts.sum()) if attempts.sum() else 0.0,
+        "seconds_mean": float(seconds.mean()),
+        "seconds_p10": float(np.percentile(seconds, 10)),
+        "survived_rate": float((seconds >= duration).mean()),
+    }
+
+
+def print_table(game, results):
+    print(f"\n{game}: {results['sessions_per_setting']} sessions per setting, "
+          f"{results['duration']:.0f} s each, player {results['player']}")
+    print(f"  {'setting':<40}{'mean':>7}{'p10':>6}{'p50':>6}{'p90':>6}{'lost':>7}{'miss':>7}{'secs':>7}")
+    for entry in results["settings"]:
+        name = " ".join(f"{key}={value}" for key, value in entry["overrides"].items()) or "defaults"
+        print(f"  {name:<40}{entry['score_mean']:>7.1f}{entry['score_p10']:>6.0f}{entry['score_p50']:>6.0f}"
+              f"{entry['score_p90']:>6.0f}{entry['game_over_rate']:>7.0%}{entry['miss_rate']:>7.0%}"
+              f"{entry['seconds_mean']:>7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play many headless sessions of a game with a simulated player, "
+                                                 "to see how settings change scores and failures")
+    parser.add_argument("game", choices=GAMES)
+    parser.add_argument("--set", dest="sweeps", action="append", type=parse_sweep, default=[],
+                        metavar="NAME=V1,V2", help="setting to try at each value, repeat to try every combination")
+    parser.add_argument("--sessions", type=int, default=1000, help="sessions per setting")
+    parser.add_argument("--duration", type=float, default=120.0, help="longest session in seconds of game time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--batch", type=int, default=1000, help="game2 and game3 sessions stepped together")
+    parser.add_argument("--recording", help="recorded session (.nflm) to play instead of the scripted player")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds from the camera to the game (game1 and recordings)")
+    parser.add_argument("--timing-sd", type=float, default=0.08, help="spread of the game1 player's fist timing in seconds")
+    parser.add_argument("--reaction", type=float, default=0.25, help="reaction time of the game2 and game3 players in seconds")
+    parser.add_argument("--aim-sd", type=float, default=15.0, help="spread of the game2 and game3 players' aim in pixels")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    names = [name for name, _ in args.sweeps]
+    grid = [dict(zip(names, values)) for values in itertools.product(*(values for _, values in args.sweeps))]
+    try:
+        for overrides in grid:
+            SETTINGS[args.game](**overrides)
+    except ValueError as error:
+        parser.error(f"{error}, the settings are {', '.join(SETTINGS[args.game].DEFAULTS)}")
+    if args.recording:
+        load_recording(args.recording)
+
+    options = {"recording": args.recording, "latency": args.latency, "timing_sd": args.timing_sd,
+               "reaction": args.reaction, "aim_sd": args.aim_sd}
+    # Session i gets the same seed under every setting and the batches are cut the same way, so
+    # settings are compared on the same games
+    seeds = [int(seed) for seed in np.random.SeedSequence(args.seed).generate_state(args.sessions, dtype=np.uint32)]
+    batch = max(1, min(args.batch, math.ceil(args.sessions / max(1, args.workers))))
+    tasks = [(args.game, overrides, options, seeds[i:i + batch], args.duration)
+             for overrides in grid for i in range(0, len(seeds), batch)]
+    total = len(grid) * args.sessions
+
+    start = time.perf_counter()
+    if args.workers > 1:
+        with Pool(args.workers) as pool:
+            batches = pool.map(run_batch, tasks, chunksize=1)
+    else:
+        batches = [run_batch(task) for task in tasks]
+    sessions = [session for played in batches for session in played]
+    elapsed = time.perf_counter() - start
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "game": args.game,
+        "player": args.recording or "scripted",
+        "player_options": options,
+        "defaults": SETTINGS[args.game]().values(),
+        "sessions_per_setting": args.sessions,
+        "duration": args.duration,
+        "seed": args.seed,
+        "workers": args.workers,
+        "seconds": elapsed,
+        "sessions_per_second": total / elapsed if elapsed else 0.0,
+        "settings": [],
+    }
+    for i, overrides in enumerate(grid):
+        entry = {"overrides": overrides}
+        entry.update(summarize(sessions[i * args.sessions:(i + 1) * args.sessions], args.duration))
+        results["settings"].append(entry)
+
+    print_table(args.game, results)
+    print(f"\n{total} sessions in {elapsed:.1f} s ({results['sessions_per_second']:.0f} sessions/s, "
+          f"{args.workers} workers)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+import argparse
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from stage_timer import timings
+
+# Capture format asked of the camera as WIDTHxHEIGHT@FPS/FOURCC, overridden with NEROFLEX_CAMERA_MODE.
+# The hand models work on much smaller pictures, so 640x480 is plenty, and MJPG lets USB cameras
+# deliver it at full frame rate where raw YUYV often cannot.
+DEFAULT_MODE = "640x480@30/MJPG"
+
+# Failed reads in a row before the camera is closed and opened again
+FAILURES_BEFORE_RECONNECT = 5
+
+
+# Function to turn "640x480@30/MJPG" into a dict. Every part is optional ("@60", "/YUYV", "1280x720"),
+# the missing ones are left to the driver.
+def parse_mode(text):
+    mode = {"width": None, "height": None, "fps": None, "fourcc": None}
+    text, _, fourcc = text.partition("/")
+    text, _, fps = text.partition("@")
+    try:
+        if text:
+            width, height = text.lower().split("x")
+            mode["width"], mode["height"] = int(width), int(height)
+        if fps:
+            mode["fps"] = float(fps)
+    except ValueError:
+        raise ValueError(f"camera mode {text!r} is not WIDTHxHEIGHT@FPS/FOURCC") from None
+    if fourcc:
+        if len(fourcc) != 4:
+            raise ValueError(f"FOURCC {fourcc!r} is not four characters")
+        mode["fourcc"] = fourcc.upper()
+    return mode
+
+
+# Waits longer after each failure in a row: first, then twice that, up to longest seconds
+class Backoff:
+    def __init__(self, first=0.05, longest=5.0):
+        self.first = first
+        self.longest = longest
+        self.delay = first
+
+    def reset(self):
+        self.delay = self.first
+
+    # Function to wait the current delay, returns early (True) if stop_event is set meanwhile
+    def wait(self, stop_event):
+        stopped = stop_event.wait(self.delay)
+        self.delay = min(self.delay * 2, self.longest)
+        return stopped
+
+
+# A cv2.VideoCapture with the format, size and frame rate negotiated up front and the driver's
+# frame queue kept to one frame, so every read gets the newest picture instead of one that sat
+# in the queue. Drivers that ignore the buffer size get their queue drained instead: grabs that
+# return much faster than a frame interval were already waiting, so they are dropped.
+# capture_time is when the newest frame was taken, from the driver's timestamp when it is on
+# the same clock as time.perf_counter() (V4L2) and otherwise when grab() returned.
+# A camera that stops delivering (unplugged, taken by another program) is closed and opened again
+# with a growing delay, reads fail in the meantime. isOpened() stays True until release().
+class Camera:
+    def __init__(self, index=0, mode=DEFAULT_MODE, drain_limit=4):
+        self.index = index
+        self.mode = parse_mode(mode) if isinstance(mode, str) else mode
+        self.drain_limit = drain_limit
+        self.stop_event = threading.Event()
+        self.backoff = Backoff()
+        self.failures = 0
+        self.reconnects = 0
+        self.stale_dropped = 0  # Frames drained from the driver queue unread
+        self.capture_time = None
+        self.clock = "grab"  # Where capture_time comes from, "driver" or "grab"
+        self.negotiated = {}
+        self.frame_interval = 1.0 / 30
+        self.drain = False
+        self.lost = False  # True from a failed read until the next frame
+        self.cap = self.open()
+
+    def open(self):
+        cap = cv2.VideoCapture(self.index)
+        if cap.isOpened():
+            self.negotiate(cap)
+        return cap
+
+    # Function to ask for the configured mode and read back what the driver actually gave.
+    # The FOURCC has to come first, many drivers only offer the larger sizes compressed.
+    def negotiate(self, cap):
+        mode = self.mode
+        if mode["fourcc"]:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*mode["fourcc"]))
+        if mode["width"]:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, mode["width"])
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, mode["height"])
+        if mode["fps"]:
+            cap.set(cv2.CAP_PROP_FPS, mode["fps"])
+        buffer_set = cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+        self.negotiated = {
+            "backend": cap.getBackendName(),
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": cap.get(cv2.CAP_PROP_FPS),
+            "fourcc": fourcc.to_bytes(4, "little").decode("ascii", "replace") if fourcc > 0 else "?",
+            "buffer_size": int(cap.get(cv2.CAP_PROP_BUFFERSIZE)) if buffer_set else None,
+        }
+        self.frame_interval = 1.0 / self.negotiated["fps"] if self.negotiated["fps"] > 0 else 1.0 / 30
+        self.drain = self.negotiated["buffer_size"] != 1
+
+    def describe(self):
+        n = self.negotiated
+        if not n:
+            return f"Camera {self.index}: not opened"
+        buffer = "driver queue 1 frame" if not self.drain else "driver queue drained on read"
+        return (f"Camera {self.index}: {n['width']}x{n['height']} {n['fourcc']} at {n['fps']:.0f} fps "
+                f"({n['backend']}), {buffer}, frame times from {self.clock}")
+
+    # Function to grab the newest frame without decoding it
+    def grab(self):
+        start = time.perf_counter()
+        if not self.cap.grab():
+            self.failed()
+            return False
+        grabbed = time.perf_counter()
+        if self.drain:
+            # A frame the driver had waiting comes back at once, the live one takes up to a frame interval
+            drained = 0
+            while grabbed - start < self.frame_interval / 4 and drained < self.drain_limit:
+                start = grabbed
+                if not self.cap.grab():
+                    self.failed()
+                    return False
+                grabbed = time.perf_counter()
+                drained += 1
+            self.stale_dropped += drained
+        self.capture_time = self.frame_timestamp(grabbed)
+        if self.lost:
+            print(f"Camera {self.index}: frames again")
+            self.lost = False
+        self.failures = 0
+        self.backoff.reset()
+        return True
+
+    # Driver timestamp of the frame when it is believable on our clock, the grab time otherwise
+    def frame_timestamp(self, grabbed):
+        driver_time = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        if 0 <= grabbed - driver_time < 1.0:
+            self.clock = "driver"
+            return driver_time
+        self.clock = "grab"
+        return grabbed
+
+    # Same as cv2.VideoCapture.read(), image is a buffer to decode into
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        success, image = self.cap.retrieve(image)
+        if not success:
+            self.failed()
+            return False, None
+        return True, image
+
+    # Function to wait before the next read after a failure, and open the camera again once
+    # enough reads in a row failed
+    def failed(self):
+        self.failures += 1
+        if not self.lost:
+            print(f"Camera {self.index}: no frame, retrying")
+            self.lost = True
+        if self.backoff.wait(self.stop_event):
+            return
+        if self.failures >= FAILURES_BEFORE_RECONNECT or not self.cap.isOpened():
+            print(f"Camera {self.index}: reconnecting, next try in {self.backoff.delay:.1f} s")
+            self.cap.release()
+            self.cap = self.open()
+            self.reconnects += 1
+            timings.count("camera_reconnects", 1)
+            self.failures = 0
+            if self.cap.isOpened():
+                print(self.describe())
+
+    def isOpened(self):
+        return not self.stop_event.is_set()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def stats(self):
+        return {"reconnects": self.reconnects, "stale_dropped": self.stale_dropped, "clock": self.clock}
+
+    # Function to stop reading without freeing the camera yet: a read waiting to reconnect
+    # returns straight away and isOpened() turns False
+    def close(self):
+        self.stop_event.set()
+
+    def release(self):
+        self.stop_event.set()
+        self.cap.release()
+
+
+# Function to open the game camera. NEROFLEX_CAMERA=<n> picks another camera than the first and
+# NEROFLEX_CAMERA_MODE=<WIDTHxHEIGHT@FPS/FOURCC> another format (DEFAULT_MODE otherwise).
+def open_camera(index=None):
+    if index is None:
+        index = int(os.environ.get("NEROFLEX_CAMERA", 0))
+    camera = Camera(index, os.environ.get("NEROFLEX_CAMERA_MODE", DEFAULT_MODE))
+    print(camera.describe())
+    return camera
+
+
+# Rows of the picture that carry the time stamp, one bit per band of STAMP_ROWS rows. Whole rows
+# survive the mirroring and the BGR to RGB conversion of the pipeline unchanged.
+STAMP_BITS = 64
+STAMP_ROWS = 4
+
+
+# Function to write a time (float seconds) into the top rows of a picture
+def write_stamp(image, seconds):
+    bits = np.unpackbits(np.array([seconds], dtype="<f8").view(np.uint8))
+    stamp = image[:STAMP_BITS * STAMP_ROWS].reshape(STAMP_BITS, STAMP_ROWS, -1)
+    stamp[:] = bits[:, None, None] * 255
+
+
+# Function to read the time written by write_stamp()
+def read_stamp(image):
+    bits = image[STAMP_ROWS // 2:STAMP_BITS * STAMP_ROWS:STAMP_ROWS].mean(axis=(1, 2)) > 127
+    return float(np.packbits(bits).view("<f8")[0])
+
+
+# Stand-in for a camera that delivers frames at a steady rate with the time each frame was "taken"
+# stamped into the picture, so measured latencies can be checked against the true ones.
+# Every frame reaches read() delay seconds after its stamp, like the exposure and USB transfer
+# of a real camera, which the grab time cannot see.
+class StampedCamera:
+    def __init__(self, fps=30, size=(640, 480), delay=0.0):
+        self.frame_interval = 1.0 / fps
+        self.size = size
+        self.delay = delay
+        self.start = time.perf_counter()
+        self.frames = 0
+        self.opened = True
+        self.capture_time = None
+
+    def isOpened(self):
+        return self.opened
+
+    def get(self, prop):
+        return {cv2.CAP_PROP_FRAME_WIDTH: self.size[0], cv2.CAP_PROP_FRAME_HEIGHT: self.size[1]}.get(prop, 0)
+
+    def read(self, image=None):
+        if not self.opened:
+            return False, None
+        # The newest frame taken, waiting for the next one if it has not arrived yet
+        now = time.perf_counter()
+        frame = max(self.frames, int((now - self.start - self.delay) / self.frame_interval))
+        taken = self.start + frame * self.frame_interval
+        if taken + self.delay > now:
+            time.sleep(taken + self.delay - now)
+        self.frames = frame + 1
+
+        if image is None:
+            image = np.empty((self.size[1], self.size[0], 3), dtype=np.uint8)
+        image[STAMP_BITS * STAMP_ROWS:] = 96
+        write_stamp(image, taken)
+        self.capture_time = time.perf_counter()
+        return True, image
+
+    def grab(self):
+        return self.read()[0]
+
+    def release(self):
+        self.opened = False
+
+
+# Does nothing with the picture, for timing the capture side on its own
+class NoHands:
+    def process(self, image):
+        from hand_pipeline import NO_HANDS
+        return NO_HANDS
+
+
+# Function to run a camera through the hand pipeline and measure how old each frame is when the
+# game gets it (capture to gesture). With a StampedCamera the measured capture times are also
+# checked against the stamped ones.
+def measure(cap, hands, seconds):
+    from hand_pipeline import HandPipeline
+
+    pipeline = HandPipeline(cap, hands).start()
+    latencies, errors = [], []
+    last_id = -1
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        frame = pipeline.latest()
+        now = time.perf_counter()
+        if frame.frame_id != last_id and frame.image is not None:
+            last_id = frame.frame_id
+            latencies.append((now - frame.capture_time) * 1000)
+            if isinstance(cap, StampedCamera):
+                taken = read_stamp(frame.image)
+                errors.append((frame.capture_time - taken) * 1000)
+                latencies[-1] = (now - taken) * 1000
+        time.sleep(1 / 60)
+    pipeline.stop()
+
+    print(pipeline.report())
+    if hasattr(cap, "stats"):
+        print(f"Camera: {cap.stats()}")
+    if latencies:
+        print(f"{len(latencies)} frames in {seconds:.0f} s ({len(latencies) / seconds:.1f} fps seen by the game), "
+              f"capture to gesture p50 {np.percentile(latencies, 50):.1f} ms, p95 {np.percentile(latencies, 95):.1f} ms")
+    if errors:
+        print(f"Measured capture time minus stamped time: p50 {np.percentile(errors, 50):.1f} ms, "
+              f"p95 {np.percentile(errors, 95):.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open the camera the way the games do and measure frame latency")
+    parser.add_argument("--camera", type=int, default=int(os.environ.get("NEROFLEX_CAMERA", 0)))
+    parser.add_argument("--mode", default=os.environ.get("NEROFLEX_CAMERA_MODE", DEFAULT_MODE),
+                        help="WIDTHxHEIGHT@FPS/FOURCC to ask for")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--model", action="store_true", help="run Mediapipe Hands on the frames as the games do")
+    parser.add_argument("--game", choices=["game1", "game2", "game3"], default="game3",
+                        help="game whose Mediapipe Hands options --model uses")
+    parser.add_argument("--stamped", action="store_true", help="use a synthetic camera with time stamped frames")
+    parser.add_argument("--delay", type=float, default=0.0,
+                        help="seconds from stamp to delivery of the synthetic camera's frames")
+    args = parser.parse_args()
+
+    if args.stamped:
+        mode = parse_mode(args.mode)
+        cap = StampedCamera(mode["fps"] or 30, (mode["width"] or 640, mode["height"] or 480), args.delay)
+    else:
+        cap = Camera(args.camera, args.mode)
+        print(cap.describe())
+    if args.model:
+        from hand_pipeline import GAME_HANDS_OPTIONS, make_hands
+        hands = make_hands(GAME_HANDS_OPTIONS[args.game])
+    else:
+        hands = NoHands()
+    measure(cap, hands, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
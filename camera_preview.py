@@ -0,0 +1,67 @@
+import os
+
+import cv2
+import numpy as np
+import pygame
+
+from gestures import hands_to_array
+
+# Mediapipe's hand connections as connected runs of landmarks: palm, thumb, then the four fingers
+HAND_CHAINS = (
+    (0, 5, 9, 13, 17, 0),
+    (0, 1, 2, 3, 4),
+    (5, 6, 7, 8),
+    (9, 10, 11, 12),
+    (13, 14, 15, 16),
+    (17, 18, 19, 20),
+)
+CONNECTION_COLOR = (255, 255, 255)
+LANDMARK_COLOR = (255, 0, 0)
+
+
+# Small camera picture with the hand landmarks, drawn inside the pygame window instead of a
+# second OpenCV window. The frame is scaled down into a buffer allocated once, and the pygame
+# surface reads straight from that buffer (pygame.image.frombuffer), so showing it copies nothing more.
+# It is only refreshed fps times a second (camera time), in between the same picture is reused.
+# NEROFLEX_PREVIEW picks the mode: "pip" (default), "window" for the old cv2.imshow window
+# with the full frame (for debugging) or "off".
+class CameraPreview:
+    def __init__(self, position, size=(160, 120), fps=15, mode=None):
+        self.mode = mode or os.environ.get("NEROFLEX_PREVIEW", "pip")
+        self.window = self.mode == "window"
+        self.position = position
+        self.size = size
+        self.refresh_interval = 1.0 / fps
+        self.buffer = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+        self.surface = pygame.image.frombuffer(self.buffer, size, "RGB")
+        self.last_refresh = None
+        self.last_frame_id = None
+        self.rect = None
+
+    # Function to refresh the picture if it is due, returns True when it changed
+    def refresh(self, frame):
+        if frame.image is None or frame.frame_id == self.last_frame_id:
+            return False
+        if self.last_refresh is not None and frame.capture_time - self.last_refresh < self.refresh_interval:
+            return False
+        self.last_refresh = frame.capture_time
+        self.last_frame_id = frame.frame_id
+
+        # Linear is plenty for a thumbnail and several times faster than INTER_AREA
+        cv2.resize(frame.image, self.size, dst=self.buffer, interpolation=cv2.INTER_LINEAR)
+        landmarks = hands_to_array(frame.results.multi_hand_landmarks)
+        if len(landmarks):
+            points = np.rint(landmarks[..., :2] * self.size).astype(int).tolist()
+            for hand in points:
+                for chain in HAND_CHAINS:
+                    pygame.draw.lines(self.surface, CONNECTION_COLOR, False, [hand[i] for i in chain])
+                for point in hand:
+                    pygame.draw.circle(self.surface, LANDMARK_COLOR, point, 2)
+        return True
+
+    # Draw the preview with the renderer, once per game frame before renderer.present()
+    def draw(self, renderer, frame):
+        if self.mode != "pip":
+            return
+        changed = self.refresh(frame)
+        self.rect = renderer.draw_overlay(self.surface, self.position, changed, self.rect)
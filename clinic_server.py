@@ -0,0 +1,438 @@
+import argparse
+import collections
+import multiprocessing
+import os
+import queue
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener
+
+import cv2
+import numpy as np
+
+from camera_capture import open_camera
+from hand_pipeline import GAME_HANDS_OPTIONS, NO_HANDS, HandPipeline
+from landmark_replay import LandmarkReplay, play_at_recorded_pace, recorded_event, results_from_arrays, results_to_arrays
+
+GAMES = ("game1", "game2", "game3")
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Size of the camera picture sent to a game for its preview
+THUMBNAIL_SIZE = (160, 120)
+
+# Seconds between checks that a station's inference process is still running while it waits
+# for a result, and how long it waits in all before it gives up on the frame
+RESULT_POLL = 0.5
+RESULT_TIMEOUT = 30.0
+
+
+# Function run by each inference process. It keeps one Mediapipe model per station, so the
+# model's tracking from one frame to the next is not mixed up between patients.
+# Frames are read from the station's shared memory buffer, the task only names it.
+def inference_worker(tasks, results, station_options):
+    import mediapipe as mp
+    models = {}
+    buffers = {}
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        station, frame_id, name, shape = task
+        memory = buffers.get(station)
+        if memory is None or memory.name != name:
+            if memory is not None:
+                memory.close()
+            try:
+                memory = buffers[station] = shared_memory.SharedMemory(name)
+            except FileNotFoundError:
+                # The station stopped and removed its buffer after submitting, it gets no landmarks
+                buffers.pop(station, None)
+                now = time.perf_counter()
+                results[station].put((frame_id, None, None, None, now, now))
+                continue
+        model = models.get(station)
+        if model is None:
+            model = models[station] = mp.solutions.hands.Hands(**station_options[station])
+        start = time.perf_counter()
+        landmarks, labels, scores = results_to_arrays(model.process(np.ndarray(shape, dtype=np.uint8, buffer=memory.buf)))
+        results[station].put((frame_id, np.array(landmarks), labels, scores, start, time.perf_counter()))
+    for model in models.values():
+        model.close()
+    for memory in buffers.values():
+        memory.close()
+
+
+# Mediapipe inference for every station in a pool of processes.
+# Each station always goes to the same process (stations are dealt out to processes in turn) and
+# has at most one frame waiting or in inference, because its pipeline waits for the result before
+# it takes the next frame. Every process works through its queue in order, so when inference
+# can't keep up each station still gets its turn and only its own older frames are dropped.
+class InferencePool:
+    def __init__(self, workers, station_options):
+        context = multiprocessing.get_context("spawn")
+        self.tasks = [context.Queue() for _ in range(workers)]
+        self.results = [context.Queue() for _ in station_options]
+        self.processes = [context.Process(target=inference_worker, args=(tasks, self.results, station_options),
+                                          name=f"inference-{i}", daemon=True)
+                          for i, tasks in enumerate(self.tasks)]
+        for process in self.processes:
+            process.start()
+
+    def submit(self, station, frame_id, name, shape):
+        self.tasks[station % len(self.tasks)].put((station, frame_id, name, shape))
+
+    def result(self, station, timeout=None):
+        return self.results[station].get(timeout=timeout)
+
+    # True while the process the station's frames go to is running
+    def alive(self, station):
+        return self.processes[station % len(self.processes)].is_alive()
+
+    def close(self):
+        for tasks in self.tasks:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+
+
+# Stands in for a Mediapipe Hands object in a station's pipeline and runs it in the pool instead.
+# The frame is copied into a shared memory buffer of the station instead of being pickled, the
+# buffer is only replaced when a bigger frame comes. Results are matched to frames by frame_id,
+# so a late result of an earlier frame is never taken for the current one. If the station's
+# inference process dies or the result doesn't come, process() raises and error says why.
+class PoolHands:
+    def __init__(self, pool, station, session_stats):
+        self.pool = pool
+        self.station = station
+        self.session_stats = session_stats
+        self.memory = None
+        self.frame_id = 0
+        self.error = None
+
+    def process(self, image):
+        if self.memory is None or self.memory.size < image.nbytes:
+            self.close()
+            self.memory = shared_memory.SharedMemory(create=True, size=image.nbytes)
+        np.copyto(np.ndarray(image.shape, dtype=np.uint8, buffer=self.memory.buf), image)
+        self.frame_id += 1
+
+        submitted = time.perf_counter()
+        self.pool.submit(self.station, self.frame_id, self.memory.name, image.shape)
+        while True:
+            try:
+                frame_id, landmarks, labels, scores, started, finished = self.pool.result(self.station, RESULT_POLL)
+            except queue.Empty:
+                if self.memory is None:
+                    # Closed while waiting, the station is stopping
+                    return NO_HANDS
+                if not self.pool.alive(self.station):
+                    self.fail("its inference process has stopped")
+                if time.perf_counter() - submitted > RESULT_TIMEOUT:
+                    self.fail(f"no result from inference in {RESULT_TIMEOUT:.0f} s")
+                continue
+            if frame_id == self.frame_id:
+                break
+        if landmarks is None:
+            # The buffer was gone by the time the worker got to the frame
+            return NO_HANDS
+        self.session_stats.add(started - submitted, finished - started, time.perf_counter() - submitted)
+        return results_from_arrays(landmarks, labels, scores)
+
+    def fail(self, error):
+        self.error = f"station {self.station}: {error}"
+        raise RuntimeError(self.error)
+
+    def close(self):
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+
+# Frame rate and latency of one station over the last `window` seconds
+class SessionStats:
+    def __init__(self, window=5.0):
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples = collections.deque()  # (done time, queue wait, inference, total) in seconds
+        self.frames = 0
+
+    def add(self, wait, inference, total):
+        now = time.perf_counter()
+        with self.lock:
+            self.samples.append((now, wait, inference, total))
+            self.frames += 1
+            self.prune(now)
+
+    # Drops the samples older than the window, called with the lock held
+    def prune(self, now):
+        while self.samples and self.samples[0][0] < now - self.window:
+            self.samples.popleft()
+
+    # A station whose source stopped reports 0 fps once its last samples leave the window
+    def summary(self):
+        with self.lock:
+            self.prune(time.perf_counter())
+            samples = np.array([sample[1:] for sample in self.samples]).reshape(-1, 3) * 1000
+        if len(samples) == 0:
+            return {"fps": 0.0, "frames": self.frames}
+        wait, inference, total = samples.T
+        return {
+            "fps": len(samples) / self.window,
+            "frames": self.frames,
+            "wait_p50_ms": float(np.percentile(wait, 50)),
+            "wait_p95_ms": float(np.percentile(wait, 95)),
+            "inference_p50_ms": float(np.percentile(inference, 50)),
+            "total_p95_ms": float(np.percentile(total, 95)),
+        }
+
+
+# One patient station: a camera (or a recorded session played back at its recorded speed),
+# its hand pipeline with inference in the pool, and the game process the results go to
+class Station:
+    def __init__(self, number, game, source, pool):
+        self.number = number
+        self.game = game
+        self.source = source
+        self.stats = SessionStats()
+        self.connection = None
+        self.process = None
+        self.sent = 0
+        self.replay = None
+        self.events_from = 0  # First replay frame whose recorded events were not sent yet
+        self.driver = None
+
+        self.hands = PoolHands(pool, number, self.stats)
+        if source.isdigit():
+            cap = open_camera(int(source))
+            self.pipeline = HandPipeline(cap, self.hands, on_result=self.send)
+        else:
+            # The model still runs in the pool on the replayed frames, but the recorded landmarks are sent
+            self.replay = LandmarkReplay(source, model=self.hands)
+            self.pipeline = HandPipeline(self.replay, self.replay, threaded=False, on_result=self.send)
+
+    def start(self):
+        if self.replay is None:
+            self.pipeline.start()
+        else:
+            self.driver = threading.Thread(target=self.play_replay, name=f"station-{self.number}", daemon=True)
+            self.driver.start()
+
+    # Function to feed the recorded frames at the pace they were recorded
+    def play_replay(self):
+        try:
+            play_at_recorded_pace(self.replay, self.pipeline.process_next, self.pipeline.stop_event.is_set)
+        finally:
+            self.pipeline.finished = True
+
+    # Function to send a processed frame to the game, called from the pipeline
+    def send(self, frame):
+        connection = self.connection
+        if connection is None:
+            return
+        # Only a small picture is sent, the game only needs it for its preview
+        thumbnail = cv2.resize(frame.image, THUMBNAIL_SIZE, interpolation=cv2.INTER_LINEAR)
+        landmarks, labels, scores = results_to_arrays(frame.results)
+        events = self.recorded_events()
+        try:
+            connection.send((frame.frame_id, frame.capture_time, thumbnail, np.array(landmarks), labels, scores, events))
+            self.sent += 1
+        except (OSError, EOFError):
+            self.connection = None
+
+    # Clicks and key presses recorded with the replay frames since the last one sent, as
+    # (type, code, x, y), so the game plays the session as it was recorded even when frames were
+    # skipped while idle. The ones from before the first camera frame (e.g. the start screen
+    # click) go with the first frame the game gets.
+    def recorded_events(self):
+        if self.replay is None:
+            return []
+        index = self.replay.index
+        if self.sent == 0:
+            events = self.replay.prelude_events + self.replay.events[index]
+        else:
+            events = [event for frame_events in self.replay.events[self.events_from:index + 1] for event in frame_events]
+        self.events_from = index + 1
+        return [event[1:] for event in events]
+
+    # Function to hand the station the connection of its game, which sends the hand tracking
+    # rate it wants while idle (see StationClient.set_idle) on a thread of its own
+    def attach(self, connection):
+        self.connection = connection
+        threading.Thread(target=self.follow_game, args=(connection,), name=f"station-{self.number}-game",
+                         daemon=True).start()
+
+    def follow_game(self, connection):
+        while True:
+            try:
+                idle_fps = connection.recv()
+            except (EOFError, OSError):
+                return
+            self.pipeline.set_idle(idle_fps)
+
+    def launch_game(self, address, authkey, max_frames=None):
+        env = dict(os.environ,
+                   NEROFLEX_STATION=f"{address[0]}:{address[1]}:{self.number}",
+                   NEROFLEX_STATION_KEY=authkey.hex())
+        if max_frames:
+            env["NEROFLEX_MAX_FRAMES"] = str(max_frames)
+        self.process = subprocess.Popen([sys.executable, os.path.join(HERE, f"{self.game}.py")], env=env)
+
+    # True once the station has nothing left to do: its game has exited or, without a game, its
+    # frames have run out. When its inference failed the station is done as well and its game
+    # is disconnected, so the game ends as if the camera had gone away.
+    def done(self):
+        if self.hands.error is not None:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            return self.process is None or self.process.poll() is not None
+        if self.process is None:
+            return self.pipeline.finished
+        return self.process.poll() is not None
+
+    def stop(self):
+        self.pipeline.stop()
+        if self.driver is not None:
+            self.driver.join(timeout=1.0)
+        self.hands.close()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def report(self):
+        summary = self.stats.summary()
+        line = f"  station {self.number} {self.game:<6}{summary['fps']:>6.1f} fps"
+        if "wait_p50_ms" in summary:
+            line += (f"  queue wait p50 {summary['wait_p50_ms']:.1f} ms p95 {summary['wait_p95_ms']:.1f} ms"
+                     f"  inference p50 {summary['inference_p50_ms']:.1f} ms  total p95 {summary['total_p95_ms']:.1f} ms")
+        stats = self.pipeline.stats()
+        line += f"  {summary['frames']} processed, {stats['capture_dropped']} dropped, {self.sent} sent"
+        if self.hands.error is not None:
+            line += f"  FAILED, {self.hands.error}"
+        return line
+
+
+# Used by open_pipeline() in a game started by the server, as both the camera and the hand tracker.
+# Frames arrive mirrored and in RGB with their landmarks already found. read() keeps the frame's
+# number and capture time from the server for the pipeline, frame_results() returns its landmarks.
+class StationClient:
+    def __init__(self, address, authkey):
+        host, port, station = address.rsplit(":", 2)
+        self.connection = Client((host, int(port)), authkey=authkey)
+        self.connection.send(int(station))
+        self.pending = collections.OrderedDict()  # frame_id: results, of the frames not processed yet
+        self.events = collections.deque()
+        self.frame_id = None
+        self.capture_time = None
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self, image=None):
+        try:
+            frame_id, capture_time, thumbnail, landmarks, labels, scores, events = self.connection.recv()
+        except (EOFError, OSError):
+            self.opened = False
+            return False, None
+        self.events.extend(recorded_event(*event) for event in events)
+        self.frame_id = frame_id
+        self.capture_time = capture_time
+        self.pending[frame_id] = results_from_arrays(landmarks, labels, scores)
+        while len(self.pending) > 8:
+            self.pending.popitem(last=False)
+        return True, thumbnail
+
+    def frame_results(self, frame):
+        return self.pending.pop(frame.frame_id, NO_HANDS)
+
+    # Function to pass the game's idle rate on to the server, which runs the camera and inference
+    def set_idle(self, idle_fps):
+        try:
+            self.connection.send(idle_fps)
+        except OSError:
+            pass
+
+    # Recorded events that came with the frames since the last call, called by HandPipeline.events()
+    def take_events(self):
+        events = []
+        while self.events:
+            events.append(self.events.popleft())
+        return events
+
+    def release(self):
+        self.opened = False
+        self.connection.close()
+
+
+# Function to accept the game processes as they connect and hand each one to its station
+def accept_games(listener, stations):
+    while True:
+        try:
+            connection = listener.accept()
+            number = connection.recv()
+        except (OSError, EOFError):
+            return
+        if 0 <= number < len(stations):
+            stations[number].attach(connection)
+        else:
+            connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several patient stations from one workstation")
+    parser.add_argument("--station", action="append", required=True, metavar="GAME:SOURCE",
+                        help="game and camera number or recorded session, e.g. game1:0 or game3:session.nflm")
+    parser.add_argument("--workers", type=int, help="inference processes (default: one per core, at most one per station)")
+    parser.add_argument("--stats-every", type=float, default=5.0, help="seconds between stats lines")
+    parser.add_argument("--frames", type=int, help="end each game after this many frames")
+    parser.add_argument("--no-games", action="store_true", help="only run the cameras and inference")
+    args = parser.parse_args()
+
+    specs = []
+    for spec in args.station:
+        game, _, source = spec.partition(":")
+        if game not in GAMES or not source:
+            parser.error(f"bad station {spec!r}, expected GAME:SOURCE with GAME one of {', '.join(GAMES)}")
+        specs.append((game, source))
+
+    workers = args.workers or max(1, min(len(specs), os.cpu_count() or 1))
+    pool = InferencePool(workers, [GAME_HANDS_OPTIONS[game] for game, _ in specs])
+    stations = [Station(number, game, source, pool) for number, (game, source) in enumerate(specs)]
+    print(f"{len(stations)} stations, {workers} inference processes")
+
+    authkey = secrets.token_bytes(16)
+    listener = Listener(("127.0.0.1", 0), authkey=authkey)
+    threading.Thread(target=accept_games, args=(listener, stations), name="accept-games", daemon=True).start()
+
+    for station in stations:
+        station.start()
+        if not args.no_games:
+            station.launch_game(listener.address, authkey, args.frames)
+
+    try:
+        while True:
+            time.sleep(args.stats_every)
+            print(time.strftime("%H:%M:%S"))
+            for station in stations:
+                print(station.report())
+            if all(station.done() for station in stations):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for station in stations:
+            station.stop()
+        listener.close()
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
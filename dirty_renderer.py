@@ -0,0 +1,104 @@
+import os
+
+import pygame
+
+from stage_timer import timings
+
+
+# Function to pre-render a static layer (background, lock body, menu buttons...) once.
+# draw is called with the new surface and draws everything that never moves.
+def bake_layer(size, draw):
+    layer = pygame.Surface(size).convert()
+    draw(layer)
+    return layer
+
+
+# Only pushes the parts of the screen that changed to the display.
+# Each frame: begin() with the static layer for the current screen, draw moving things with
+# sprites(), draw HUD labels with draw_label() (or other overlays with draw_overlay()), then present().
+# Sprites are erased from the layer at the start of the next frame, overlays are only pushed when they change.
+# Set NEROFLEX_FULL_FLIP=1 (or full_flip=True) to redraw and flip the whole screen every frame instead.
+class DirtyRenderer:
+    def __init__(self, screen, full_flip=None):
+        if full_flip is None:
+            full_flip = bool(os.environ.get("NEROFLEX_FULL_FLIP"))
+        self.screen = screen
+        self.screen_rect = screen.get_rect()
+        self.full_flip = full_flip
+        self.full_redraw = True
+        self.layer = None
+        self.erased = []
+        self.sprite_rects = []
+        self.overlay_rects = []
+        self.update_rects = []
+
+    # Start a frame on the given layer. With layer=None nothing is erased and the screen is kept
+    # as it is (e.g. a game over message drawn over the last frame).
+    def begin(self, layer):
+        self.sprite_rects, previous = [], self.sprite_rects
+        self.overlay_rects, overlays = [], self.overlay_rects
+        self.update_rects = []
+        if layer is None:
+            self.erased = []
+            return
+
+        if layer is not self.layer or self.full_redraw or self.full_flip:
+            self.layer = layer
+            self.full_redraw = True
+            self.erased = []
+            self.screen.blit(layer, (0, 0))
+        else:
+            self.erased = previous
+            # Overlays are cleared too so they can be drawn again on top of this frame's sprites
+            for rect in previous + overlays:
+                self.screen.blit(layer, rect, rect)
+
+    # Draw a batch of moving things in one Surface.blits() call (see SpriteAtlas.place()) and mark them
+    def sprites(self, blits):
+        rects = self.screen.blits(blits)
+        self.sprite_rects.extend(rects)
+        return rects
+
+    # Draw something that stays put and mark it to be pushed this frame only
+    def draw_static(self, surface, position):
+        rect = self.screen.blit(surface, position)
+        self.update_rects.append(rect)
+        return rect
+
+    # True when rect was touched by an erased or newly drawn sprite this frame
+    def needs_redraw(self, rect):
+        return (self.full_redraw or rect.collidelist(self.erased) != -1
+                or rect.collidelist(self.sprite_rects) != -1)
+
+    # Draw something that stays put over the sprites (HUD text, the camera preview). It is drawn every
+    # frame but only pushed to the display when changed is True or a sprite went over it.
+    # old_rect is where it was drawn last time, None if it was not drawn before.
+    def draw_overlay(self, surface, position, changed, old_rect):
+        rect = self.screen.blit(surface, position)
+        self.overlay_rects.append(rect)
+        if old_rect is None or changed:
+            self.update_rects.extend((old_rect or rect, rect))
+        elif self.needs_redraw(rect):
+            self.update_rects.append(rect)
+        return rect
+
+    # Draw a HudLabel, it is only pushed to the display when its value changed or a sprite went over it
+    def draw_label(self, label, value):
+        changed = label.update(value)
+        label.rect = self.draw_overlay(label.surface, label.position, changed, label.rect)
+        return label.rect
+
+    # Redraw and flip the whole screen on the next frame
+    def invalidate(self):
+        self.full_redraw = True
+
+    def present(self):
+        if self.full_redraw:
+            pygame.display.flip()
+            pixels = self.screen_rect.width * self.screen_rect.height
+            self.full_redraw = self.full_flip
+        else:
+            rects = [rect.clip(self.screen_rect) for rect in self.erased + self.sprite_rects + self.update_rects]
+            pygame.display.update(rects)
+            pixels = sum(rect.width * rect.height for rect in rects)
+        timings.count("pixels_pushed", pixels)
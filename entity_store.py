@@ -0,0 +1,98 @@
+import numpy as np
+
+
+# Keeps entities as NumPy columns (one array per field) instead of a list of lists.
+# Slots of removed entities go on a free list and are reused by the next spawn. When every slot
+# is taken the columns double in size, or with fixed=True spawn() returns None instead.
+class EntityStore:
+    def __init__(self, capacity, fixed=False, **columns):
+        self.capacity = capacity
+        self.fixed = fixed
+        self.dtypes = columns
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in columns.items()}
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.free = list(range(capacity - 1, -1, -1))
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def grow(self):
+        old_capacity = self.capacity
+        self.capacity *= 2
+        for name, column in self.columns.items():
+            self.columns[name] = np.concatenate([column, np.zeros(old_capacity, dtype=column.dtype)])
+        self.alive = np.concatenate([self.alive, np.zeros(old_capacity, dtype=bool)])
+        self.free.extend(range(self.capacity - 1, old_capacity - 1, -1))
+
+    def spawn(self, **values):
+        if not self.free:
+            if self.fixed:
+                return None
+            self.grow()
+        index = self.free.pop()
+        for name, value in values.items():
+            self.columns[name][index] = value
+        self.alive[index] = True
+        self.count += 1
+        return index
+
+    # Slot indices of the entities that are alive
+    def active(self):
+        return np.flatnonzero(self.alive)
+
+    def kill(self, indices):
+        indices = np.unique(indices)
+        indices = indices[self.alive[indices]]
+        self.alive[indices] = False
+        self.free.extend(indices.tolist())
+        self.count -= len(indices)
+
+    def clear(self):
+        self.alive[:] = False
+        self.free = list(range(self.capacity - 1, -1, -1))
+        self.count = 0
+
+
+# Function to check many rectangles against one rect at once, same rule as pygame.Rect.colliderect.
+# rect is (left, top, width, height), a pygame.Rect works too. Its values may be arrays that
+# broadcast against x and y, to check against one rect per row.
+def overlaps_rect(x, y, width, height, rect):
+    left, top, rect_width, rect_height = rect
+    return (x < left + rect_width) & (x + width > left) & (y < top + rect_height) & (y + height > top)
+
+
+# Function to find which points lie strictly inside which square boxes (box x, y is the top left corner).
+# Boxes are sorted by x once (sweep and prune), so each point is only tested against the boxes
+# that overlap it along x. Returns matching (point, box) position pairs, ordered by box then point.
+def points_in_boxes(point_x, point_y, box_x, box_y, box_size):
+    if len(point_x) == 0 or len(box_x) == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty
+
+    order = np.argsort(box_x, kind="stable")
+    sorted_x = box_x[order]
+    largest = box_size.max()
+
+    # Candidate boxes start between point_x - largest and point_x
+    first = np.searchsorted(sorted_x, point_x - largest, side="right")
+    last = np.searchsorted(sorted_x, point_x, side="left")
+    counts = np.maximum(last - first, 0)
+    total = counts.sum()
+    if total == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty
+
+    points = np.repeat(np.arange(len(point_x)), counts)
+    starts = np.repeat(first - (np.cumsum(counts) - counts), counts)
+    boxes = order[starts + np.arange(total)]
+
+    hit = ((point_x[points] > box_x[boxes]) & (point_x[points] < box_x[boxes] + box_size[boxes]) &
+           (point_y[points] > box_y[boxes]) & (point_y[points] < box_y[boxes] + box_size[boxes]))
+    points = points[hit]
+    boxes = boxes[hit]
+    ordered = np.lexsort((points, boxes))
+    return points[ordered], boxes[ordered]
@@ -0,0 +1,52 @@
+import cv2
+import numpy as np
+
+
+# Camera and converted frames are written into buffers allocated once and reused in turn, instead
+# of new images from cap.read(), cv2.flip() and cv2.cvtColor() on every frame.
+# A buffer is only written again after `count` newer frames, so keep count above the number of
+# frames that can be in flight at once (capture, queue, inference and the one the game shows).
+class FrameBuffers:
+    def __init__(self, count=5):
+        self.count = count
+        self.shape = None
+        self.camera = []
+        self.rgb = []
+        self.preview = None
+        self.next_camera = 0
+        self.next_rgb = 0
+        self.allocations = 0  # Times the buffers were made, once unless the camera size changes
+
+    def allocate(self, shape):
+        self.camera = [np.empty(shape, dtype=np.uint8) for _ in range(self.count)]
+        self.rgb = [np.empty(shape, dtype=np.uint8) for _ in range(self.count)]
+        self.preview = np.empty(shape, dtype=np.uint8)
+        self.allocations += 1
+        self.shape = shape  # Set last, the capture thread checks it before using the buffers
+
+    # Buffer for cap.read() to fill, None until the size of the camera frames is known
+    def camera_buffer(self):
+        if self.shape is None:
+            return None
+        buffer = self.camera[self.next_camera]
+        self.next_camera = (self.next_camera + 1) % self.count
+        return buffer
+
+    # Function to mirror a BGR camera frame and turn it into RGB for Mediapipe in a single pass.
+    # Reversing each row as one run of bytes reverses the pixel order and the B, G, R order together.
+    def flip_rgb(self, image):
+        if image.shape != self.shape:
+            self.allocate(image.shape)
+        rgb = self.rgb[self.next_rgb]
+        self.next_rgb = (self.next_rgb + 1) % self.count
+
+        height, width = image.shape[:2]
+        row_bytes = width * image.shape[2]
+        cv2.flip(np.ascontiguousarray(image).reshape(height, row_bytes), 1, dst=rgb.reshape(height, row_bytes))
+        return rgb
+
+    # Function to turn an RGB frame back to BGR for cv2.imshow(), the same buffer is reused every time
+    def to_bgr(self, image):
+        if image.shape != self.shape:
+            return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        return cv2.cvtColor(image, cv2.COLOR_RGB2BGR, dst=self.preview)
@@ -2,8 +2,20 @@ import cv2  # Import OpenCV
 import mediapipe as mp
 import pygame
 import math
+import os
 import random
-import time  # For adding a delay
+from camera_preview import CameraPreview
+from dirty_renderer import DirtyRenderer, bake_layer
+from game_rules import LockGame, LockSettings
+from gestures import standard_engine
+from hand_pipeline import GAME_HANDS_OPTIONS, end_game, open_pipeline
+from hud_text import HudLabel, render_text
+from idle_scheduler import IdleScheduler
+from live_profiler import profiler
+from session_telemetry import open_telemetry
+from sim_clock import SimClock, lerp_angle
+from sprite_atlas import SpriteAtlas
+from stage_timer import timings
 
 # Initialize pygame
 pygame.init()
@@ -14,6 +26,10 @@ SCREEN_HEIGHT = 600
 screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
 pygame.display.set_caption("Pop the Lock - Hand Gesture")
 
+# Open the webcam and Mediapipe hand detection on background threads (or a recorded session).
+# This comes before the target is picked so a replay starts from the same random seed.
+pipeline = open_pipeline(**GAME_HANDS_OPTIONS["game1"])
+
 # Define colors
 WHITE = (255, 255, 255)
 RED = (255, 0, 0)
@@ -26,19 +42,14 @@ GRAY = (100, 100, 100)
 LOCK_RADIUS = 100
 BAR_LENGTH = 150
 BAR_WIDTH = 30 
-bar_angle = 0
-bar_speed = 0.05  # Adjusted speed of the rotating bar
-target_angle = random.uniform(0, 2 * math.pi)
-target_range = 0.3  # Increased width of the target zone
-level = 1
-score = 0
-high_score = 0  # Initialize high score
-game_over = False
+BAR_FRAMES = 180  # Turned copies of the bar and the target, one every 2 degrees
 game_started = False  # Game will start after clicking Start button
 
-# Grace period settings
-grace_period = 1.0  # Grace period in seconds
-grace_timer = 0.0  # Timer for the grace period
+# The bar turns in fixed steps of 1/30 second, however fast frames come in
+sim = SimClock(30)
+
+# Bar, target zone, score and grace period (see game_rules.py for the speeds and zone width)
+lock = LockGame(LockSettings(), random, sim.step)
 
 # Button settings
 BUTTON_WIDTH = 200
@@ -48,175 +59,202 @@ BUTTON_HEIGHT = 80
 mp_drawing = mp.solutions.drawing_utils
 mp_hands = mp.solutions.hands
 
-# Function to calculate the Euclidean distance between two points
-def calculate_distance(landmark1, landmark2):
-    return math.sqrt((landmark1.x - landmark2.x) ** 2 + (landmark1.y - landmark2.y) ** 2)
-
-# Function to detect if the hand is making a fist
-def is_fist(hand_landmarks):
-    thumb_tip = hand_landmarks.landmark[mp_hands.HandLandmark.THUMB_TIP]
-    index_tip = hand_landmarks.landmark[mp_hands.HandLandmark.INDEX_FINGER_TIP]
-    middle_tip = hand_landmarks.landmark[mp_hands.HandLandmark.MIDDLE_FINGER_TIP]
-    ring_tip = hand_landmarks.landmark[mp_hands.HandLandmark.RING_FINGER_TIP]
-    pinky_tip = hand_landmarks.landmark[mp_hands.HandLandmark.PINKY_TIP]
-    
-    index_base = hand_landmarks.landmark[mp_hands.HandLandmark.INDEX_FINGER_MCP]
-    middle_base = hand_landmarks.landmark[mp_hands.HandLandmark.MIDDLE_FINGER_MCP]
-    ring_base = hand_landmarks.landmark[mp_hands.HandLandmark.RING_FINGER_MCP]
-    pinky_base = hand_landmarks.landmark[mp_hands.HandLandmark.PINKY_MCP]
-
-    index_distance = calculate_distance(index_tip, index_base)
-    middle_distance = calculate_distance(middle_tip, middle_base)
-    ring_distance = calculate_distance(ring_tip, ring_base)
-    pinky_distance = calculate_distance(pinky_tip, pinky_base)
+# Gesture engine, converts each hand to an array once and checks all hands together
+gestures = standard_engine()
 
-    fist_threshold = 0.15
-    return (index_distance < fist_threshold and
-            middle_distance < fist_threshold and
-            ring_distance < fist_threshold and
-            pinky_distance < fist_threshold)
-
-# Open the webcam
-cap = cv2.VideoCapture(0)
-
-# Mediapipe hand detection
-hands = mp_hands.Hands()
-
-# Function to check if the bar is in the target range
-def in_target_range(bar_angle, target_angle, target_range):
-    return abs(bar_angle - target_angle) < target_range or abs(bar_angle - target_angle) > 2 * math.pi - target_range
+# Function to detect which hands are making a fist (one True/False per detected hand).
+# The landmarks are smoothed over the last frames, so the capture time goes with them.
+def is_fist(frame):
+    return gestures.evaluate(frame.results, frame.capture_time)["fist"]
 
 # Function to draw a button
-def draw_button(text, x, y, width, height, color, text_color):
-    pygame.draw.rect(screen, color, (x, y, width, height))
-    font = pygame.font.Font(None, 36)
-    button_text = font.render(text, True, text_color)
-    screen.blit(button_text, (x + (width - button_text.get_width()) // 2, y + (height - button_text.get_height()) // 2))
+def draw_button(surface, text, x, y, width, height, color, text_color):
+    pygame.draw.rect(surface, color, (x, y, width, height))
+    button_text = render_text(text, 36, text_color)
+    surface.blit(button_text, (x + (width - button_text.get_width()) // 2, y + (height - button_text.get_height()) // 2))
+
+# Function to draw the start screen layer
+def draw_start_layer(surface):
+    surface.fill(WHITE)
+    draw_button(surface, "Start", SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, SCREEN_HEIGHT // 2 - BUTTON_HEIGHT // 2, BUTTON_WIDTH, BUTTON_HEIGHT, GREEN, WHITE)
+
+# Function to draw the lock layer, everything in the game that does not move
+def draw_lock_layer(surface):
+    surface.fill(WHITE)
+
+    # Draw the lock body (yellow circle)
+    pygame.draw.circle(surface, YELLOW, (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2), LOCK_RADIUS)
+
+    # Draw the lock shackle (gray rectangle to resemble a lock shackle)
+    pygame.draw.rect(surface, GRAY, (SCREEN_WIDTH // 2 - 40, SCREEN_HEIGHT // 2 - LOCK_RADIUS - 30, 80, 30))
+
+# Function to draw the game over layer
+def draw_game_over_layer(surface):
+    surface.fill(WHITE)
+    game_over_text = render_text("Game Over!", 36, RED)
+    surface.blit(game_over_text, (SCREEN_WIDTH // 2 - 100, SCREEN_HEIGHT // 2))
+    draw_button(surface, "Restart", SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, SCREEN_HEIGHT // 2 + 40, BUTTON_WIDTH, BUTTON_HEIGHT, GREEN, WHITE)
+
+# Static layers are drawn once, each frame only the bar, the target and changed scores are pushed
+renderer = DirtyRenderer(screen)
+start_layer = bake_layer(screen.get_size(), draw_start_layer)
+lock_layer = bake_layer(screen.get_size(), draw_lock_layer)
+game_over_layer = bake_layer(screen.get_size(), draw_game_over_layer)
+
+# Function to make the draw function of a bar (red) or the target zone (blue) for the sprite atlas
+def bar_drawer(color):
+    def draw(surface, centre, angle):
+        end = (centre[0] + int(LOCK_RADIUS * math.cos(angle)), centre[1] + int(LOCK_RADIUS * math.sin(angle)))
+        pygame.draw.line(surface, color, centre, end, BAR_WIDTH)
+    return draw
+
+# The bar and the target are drawn once at every angle, each frame copies the two closest ones to the screen
+sprites = SpriteAtlas()
+bar_size = 2 * (LOCK_RADIUS + BAR_WIDTH)
+sprites.add_rotations("bar", BAR_FRAMES, (bar_size, bar_size), bar_drawer(RED), (bar_size // 2, bar_size // 2))
+sprites.add_rotations("target", BAR_FRAMES, (bar_size, bar_size), bar_drawer(BLUE), (bar_size // 2, bar_size // 2))
+sprites.build()
+
+# Score lines, only rendered again when the numbers change
+score_label = HudLabel("Score: {}", 36, (0, 0, 0), (10, 10))  # (0, 0, 0) is black in RGB
+high_score_label = HudLabel("High Score: {}", 36, (0, 0, 0), (10, 40))
+
+# Camera picture with the hand landmarks in the top right corner (or the OpenCV window when debugging)
+preview = CameraPreview((SCREEN_WIDTH - 170, 10))
+
+# NEROFLEX_DEBUG=1 shows the time from camera capture to the screen and how the last fist was timed
+debug_label = HudLabel("{}", 24, GRAY, (10, SCREEN_HEIGHT - 30)) if os.environ.get("NEROFLEX_DEBUG") else None
+latency_ms = None  # Moving average of the time from camera capture to the screen
+judged_frame_id = None
+shown_frame_id = None
+
+# Function to describe how the last fist was timed against its hit window
+def last_fist():
+    if lock.last_timing is None:
+        return "none"
+    outcome, seconds = lock.last_timing
+    if outcome == "hit":
+        return "hit, {:.0f} ms into the window".format(seconds * 1000)
+    return "{:.0f} ms {}".format(seconds * 1000, outcome)
 
 # Function to reset the game
 def reset_game():
-    global bar_angle, bar_speed, target_angle, target_range, level, score, game_over, grace_timer
-    bar_angle = 0
-    bar_speed = 0.05
-    target_angle = random.uniform(0, 2 * math.pi)
-    target_range = 0.3
-    level = 1
-    score = 0
-    game_over = False
-    grace_timer = 0.0
+    sim.start(pipeline.now())
+    lock.reset(pipeline.now())  # Only fists after the restart count
 
 # Main game loop
-clock = pygame.time.Clock()  # To manage frame rate
+scheduler = IdleScheduler(pipeline, 30)  # To manage frame rate and slow down on the menus
+telemetry = open_telemetry("game1")  # Per-frame session record, with NEROFLEX_TELEMETRY=<directory>
 running = True
 while running:
-    success, image = cap.read()
-    if not success:
-        print("Ignoring empty camera frame.")
-        continue
-    
-    # Flip the image and process it with Mediapipe
-    image = cv2.cvtColor(cv2.flip(image, 1), cv2.COLOR_BGR2RGB)
-    results = hands.process(image)
-
-    # Clear the screen
-    screen.fill(WHITE)
+    # Get the newest flipped image and Mediapipe result without waiting for the camera
+    frame = pipeline.latest()
+    image = frame.image
+    results = frame.results
+    if pipeline.finished:
+        running = False
+
+    # Start the frame on the layer for the current screen
+    if not game_started:
+        renderer.begin(start_layer)
+    elif lock.game_over:
+        renderer.begin(game_over_layer)
+    else:
+        renderer.begin(lock_layer)
 
+    fists = ()  # Which hands make a fist, only checked while playing
     if not game_started:
-        # Display start button
-        draw_button("Start", SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, SCREEN_HEIGHT // 2 - BUTTON_HEIGHT // 2, BUTTON_WIDTH, BUTTON_HEIGHT, GREEN, WHITE)
-        
         # Check for mouse click to start the game
-        for event in pygame.event.get():
+        for event in pipeline.events():
             if event.type == pygame.MOUSEBUTTONDOWN:
-                mouse_x, mouse_y = pygame.mouse.get_pos()
+                mouse_x, mouse_y = event.pos
                 if SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2 <= mouse_x <= SCREEN_WIDTH // 2 + BUTTON_WIDTH // 2 and SCREEN_HEIGHT // 2 - BUTTON_HEIGHT // 2 <= mouse_y <= SCREEN_HEIGHT // 2 + BUTTON_HEIGHT // 2:
                     game_started = True  # Start the game after clicking the button
+                    sim.start(pipeline.now())
+                    lock.start(pipeline.now())
             if event.type == pygame.QUIT:
                 running = False
 
-    elif not game_over:
-        # Update the rotating bar
-        bar_angle += bar_speed
-        if bar_angle > 2 * math.pi:
-            bar_angle -= 2 * math.pi
-
-        # Draw the lock body (yellow circle)
-        pygame.draw.circle(screen, YELLOW, (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2), LOCK_RADIUS)
-
-        # Draw the lock shackle (gray rectangle to resemble a lock shackle)
-        pygame.draw.rect(screen, GRAY, (SCREEN_WIDTH // 2 - 40, SCREEN_HEIGHT // 2 - LOCK_RADIUS - 30, 80, 30))
-
-        # Draw the rotating bar (red line)
-        bar_x = SCREEN_WIDTH // 2 + int(LOCK_RADIUS * math.cos(bar_angle))
-        bar_y = SCREEN_HEIGHT // 2 + int(LOCK_RADIUS * math.sin(bar_angle))
-        pygame.draw.line(screen, RED, (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2), (bar_x, bar_y), BAR_WIDTH)
-
-        # Draw the target zone (wider for easier hits)
-        target_x = SCREEN_WIDTH // 2 + int(LOCK_RADIUS * math.cos(target_angle))
-        target_y = SCREEN_HEIGHT // 2 + int(LOCK_RADIUS * math.sin(target_angle))
-        pygame.draw.line(screen, BLUE, (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2), (target_x, target_y), BAR_WIDTH)
-
-        # Handle grace period
-        if grace_timer > 0:
-            grace_timer -= clock.get_time() / 1000  # Subtract the frame time in seconds
-        else:
-            # If hand landmarks are detected
-            if results.multi_hand_landmarks:
+    elif not lock.game_over:
+        # Check which hands are making a fist
+        if results.multi_hand_landmarks:
+            with timings.stage("is_fist"):
+                fists = is_fist(frame)
+
+            # Draw hand landmarks on the image for visualization in the OpenCV window
+            if preview.window:
                 for hand_landmarks in results.multi_hand_landmarks:
-                    # Draw hand landmarks on the image for visualization
                     mp_drawing.draw_landmarks(image, hand_landmarks, mp_hands.HAND_CONNECTIONS)
 
-                    # Check if the hand is making a fist
-                    if is_fist(hand_landmarks):
-                        # Check if the bar is in the target range
-                        if in_target_range(bar_angle, target_angle, target_range):
-                            score += 1
-                            level += 1
-                            target_angle = random.uniform(0, 2 * math.pi)  # Generate a new target zone
-                            bar_speed += 0.005  # Increase the bar speed slowly
-                            grace_timer = grace_period  # Reset grace timer
-                        else:
-                            game_over = True
-                            # Update high score if current score is higher
-                            if score > high_score:
-                                high_score = score
+        # Run as many fixed steps as the time since the last frame holds
+        with timings.stage("simulation"):
+            for _ in range(sim.advance(pipeline.now())):
+                lock.step()
+
+        # Each camera result is judged once, by where the bar was when the camera took the picture
+        # and not where it is once the picture has gone through hand tracking
+        if frame.frame_id != judged_frame_id and any(fists):
+            lock.judge_fist(frame.capture_time, sim.step_time(), pipeline.now())
+        judged_frame_id = frame.frame_id
+
+        with timings.stage("draw"):
+            # Draw the rotating bar (red line) between its last two steps, then the target zone over it
+            angle = lerp_angle(lock.previous_bar_angle, lock.bar_angle, sim.alpha)
+            centre_x, centre_y = SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2
+            renderer.sprites([sprites.place("bar", centre_x, centre_y, sprites.frame("bar", angle)),
+                              sprites.place("target", centre_x, centre_y, sprites.frame("target", lock.target_angle))])
 
     # Display game info
-    font = pygame.font.Font(None, 36)
-    score_text = font.render(f"Score: {score}", True, (0, 0, 0))  # (0, 0, 0) is black in RGB
-    high_score_text = font.render(f"High Score: {high_score}", True, (0, 0, 0))
-    screen.blit(score_text, (10, 10))
-    screen.blit(high_score_text, (10, 40))
+    with timings.stage("draw_hud"):
+        renderer.draw_label(score_label, lock.score)
+        renderer.draw_label(high_score_label, lock.high_score)
+        if debug_label is not None:
+            latency = "n/a" if latency_ms is None else "{:.0f} ms".format(latency_ms)
+            renderer.draw_label(debug_label, "Capture to screen {}, last fist {}".format(latency, last_fist()))
+
+    with timings.stage("preview"):
+        preview.draw(renderer, frame)
     
-    if game_over:
-        game_over_text = font.render("Game Over!", True, RED)
-        screen.blit(game_over_text, (SCREEN_WIDTH // 2 - 100, SCREEN_HEIGHT // 2))
-        draw_button("Restart", SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, SCREEN_HEIGHT // 2 + 40, BUTTON_WIDTH, BUTTON_HEIGHT, GREEN, WHITE)
-
+    if lock.game_over:
         # Check for restart button click
-        for event in pygame.event.get():
+        for event in pipeline.events():
             if event.type == pygame.MOUSEBUTTONDOWN:
-                mouse_x, mouse_y = pygame.mouse.get_pos()
+                mouse_x, mouse_y = event.pos
                 if SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2 <= mouse_x <= SCREEN_WIDTH // 2 + BUTTON_WIDTH // 2 and SCREEN_HEIGHT // 2 + 40 <= mouse_y <= SCREEN_HEIGHT // 2 + 40 + BUTTON_HEIGHT:
                     reset_game()  # Reset the game
             if event.type == pygame.QUIT:
                 running = False
 
-    # Update the display
-    pygame.display.flip()
+    # F3 profiler overlay, does nothing while it is hidden
+    profiler.draw(renderer)
+
+    # Update the display, only the parts that changed
+    with timings.stage("display_flip"):
+        renderer.present()
+
+    # Time from camera capture to the screen, measured the first time each camera frame is shown
+    if frame.frame_id >= 0 and frame.frame_id != shown_frame_id:
+        shown_frame_id = frame.frame_id
+        latency = (pipeline.now() - frame.capture_time) * 1000
+        latency_ms = latency if latency_ms is None else 0.9 * latency_ms + 0.1 * latency
+        timings.count("capture_to_display_ms", latency)
 
     # Show hand tracking image in OpenCV window with landmarks
-    cv2.imshow("Hand Tracking", image)
+    if preview.window and image is not None:
+        with timings.stage("imshow"):
+            cv2.imshow("Hand Tracking", image)
 
     # Event handling for quitting the game
-    for event in pygame.event.get():
+    for event in pipeline.events():
         if event.type == pygame.QUIT:
             running = False
 
-    # Limit frame rate to 30 FPS
-    clock.tick(30)
+    # Limit frame rate to 30 FPS, less on the start and game over screens
+    telemetry.frame(pipeline.now(), frame, playing=game_started and not lock.game_over, score=lock.score,
+                    hits=lock.hits, misses=lock.misses, gesture=float(any(fists)))
+    scheduler.update(game_started and not lock.game_over)
+    scheduler.tick()
 
 # Release resources
-cap.release()
-cv2.destroyAllWindows()  # Close the OpenCV window
-pygame.quit()
+telemetry.close()
+end_game(pipeline)
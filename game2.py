@@ -1,8 +1,19 @@
 import cv2
-import mediapipe as mp
+import numpy as np
 import pygame
 import random
-import time                                                                                          
+from camera_preview import CameraPreview
+from dirty_renderer import DirtyRenderer, bake_layer
+from game_rules import TacoGame, TacoSettings
+from hud_text import HudLabel, render_text
+from idle_scheduler import IdleScheduler
+from live_profiler import profiler
+from session_telemetry import open_telemetry
+from sprite_atlas import SpriteAtlas
+from gestures import standard_engine
+from hand_pipeline import GAME_HANDS_OPTIONS, end_game, open_pipeline
+from sim_clock import SimClock, lerp
+from stage_timer import timings
 
 # Initialize pygame
 pygame.init()
@@ -14,8 +25,9 @@ PLAYER_WIDTH = 50
 PLAYER_HEIGHT = 80  # Character height
 OBSTACLE_WIDTH = 50  # Taco width
 OBSTACLE_HEIGHT = 30  # Taco height
-BASE_OBSTACLE_SPEED = 5  # Taco speed
+BASE_OBSTACLE_SPEED = 5  # Taco speed (pixels per step)
 FPS = 30
+OBSTACLE_SPAWN_STEPS = FPS  # One taco every second
 GROUND_COLOR = (80, 80, 80)
 
 # Border settings
@@ -34,145 +46,159 @@ TACO_COLOR = (255, 215, 0)
 screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
 pygame.display.set_caption("Taco Eating Game")
 
-# Initialize clock
-clock = pygame.time.Clock()
+# The game moves in fixed steps of 1/FPS second, however fast frames come in
+sim = SimClock(FPS)
 
-# Load MediaPipe for wrist tracking
-mp_hands = mp.solutions.hands
-hands = mp_hands.Hands()
+# Wrist tracking
+gestures = standard_engine()
 
-# Camera capture
-cap = cv2.VideoCapture(0)
+# Camera capture and hand tracking run on background threads (or play back a recorded session)
+pipeline = open_pipeline(**GAME_HANDS_OPTIONS["game2"])
 
-# Game variables
-player_x = SCREEN_WIDTH // 2 - PLAYER_WIDTH // 2
-player_y = SCREEN_HEIGHT - PLAYER_HEIGHT - 50
-player_speed = 5  # Default speed
+# Frame rate, lower while the start screen waits for a click
+scheduler = IdleScheduler(pipeline, FPS)
 
-# Obstacles (Tacos)
-obstacles = []
-obstacle_spawn_time = 0
+# Per-frame session record, with NEROFLEX_TELEMETRY=<directory>
+telemetry = open_telemetry("game2")
 
-# Score, tacos eaten, and game over state
-score = 0
-tacos_eaten = 0
-game_over = False
+# Player, tacos and score (see game_rules.py for the speeds and spawn rate)
+taco = TacoGame(TacoSettings(obstacle_speed=BASE_OBSTACLE_SPEED, spawn_steps=OBSTACLE_SPAWN_STEPS,
+                             screen_width=SCREEN_WIDTH, screen_height=SCREEN_HEIGHT,
+                             player_width=PLAYER_WIDTH, player_height=PLAYER_HEIGHT,
+                             obstacle_width=OBSTACLE_WIDTH, obstacle_height=OBSTACLE_HEIGHT,
+                             border_width=BORDER_WIDTH), random)
 
 # Game state control
 game_started = False
 
-def create_obstacle():
-    x = random.randint(50, SCREEN_WIDTH - 50 - OBSTACLE_WIDTH)
-    y = -OBSTACLE_HEIGHT
-    return {'rect': pygame.Rect(x, y, OBSTACLE_WIDTH, OBSTACLE_HEIGHT)}
-
-def draw_player():
-    pygame.draw.rect(screen, GREEN, (player_x, player_y, PLAYER_WIDTH, PLAYER_HEIGHT))
-    head_radius = 15
-    pygame.draw.circle(screen, (0, 0, 0), (player_x + PLAYER_WIDTH // 2, player_y - head_radius), head_radius)
-    pygame.draw.rect(screen, RED, (player_x + PLAYER_WIDTH // 2 - 10, player_y - head_radius // 2, 20, 10))
-
-def draw_obstacles():
-    for obstacle in obstacles:
-        pygame.draw.polygon(screen, TACO_COLOR, [(obstacle['rect'].x, obstacle['rect'].y + OBSTACLE_HEIGHT),
-                                                 (obstacle['rect'].x + OBSTACLE_WIDTH // 2, obstacle['rect'].y),
-                                                 (obstacle['rect'].x + OBSTACLE_WIDTH, obstacle['rect'].y + OBSTACLE_HEIGHT)])
-
-def move_obstacles():
-    for obstacle in obstacles:
-        obstacle['rect'].y += BASE_OBSTACLE_SPEED
-        if obstacle['rect'].y > SCREEN_HEIGHT:
-            obstacles.remove(obstacle)
-
-def check_collision():
-    global tacos_eaten, score
-    mouth_rect = pygame.Rect(player_x + PLAYER_WIDTH // 2 - 10, player_y - 15, 20, 10)
-    for obstacle in obstacles:
-        if mouth_rect.colliderect(obstacle['rect']):
-            obstacles.remove(obstacle)
-            tacos_eaten += 1
-            if tacos_eaten % 5 == 0:
-                score += 1
-
-def process_wrist_movement(results):
-    global player_x
-    if results.multi_hand_landmarks:
-        hand_landmarks = results.multi_hand_landmarks[0]
-        wrist = hand_landmarks.landmark[mp_hands.HandLandmark.WRIST]
-        index_tip = hand_landmarks.landmark[mp_hands.HandLandmark.INDEX_FINGER_TIP]
-        movement = index_tip.y - wrist.y
-
-        if movement > 0.05:
-            player_x += 5
-        elif movement < -0.05:
-            player_x -= 5
-
-        player_x = max(BORDER_WIDTH, min(SCREEN_WIDTH - PLAYER_WIDTH - BORDER_WIDTH, player_x))
+# Score line, only rendered again when the score changes
+score_label = HudLabel("Score: {}", 36, BLACK, (10, 10))
+
+# Camera picture with the hand landmarks in the top right corner (or the OpenCV window when debugging)
+preview = CameraPreview((SCREEN_WIDTH - 170, 10))
+
+HEAD_RADIUS = 15
+
+def draw_player(surface, position):
+    player_x, player_y = position
+    pygame.draw.rect(surface, GREEN, (player_x, player_y, PLAYER_WIDTH, PLAYER_HEIGHT))
+    pygame.draw.circle(surface, (0, 0, 0), (player_x + PLAYER_WIDTH // 2, player_y - HEAD_RADIUS), HEAD_RADIUS)
+    pygame.draw.rect(surface, RED, (player_x + PLAYER_WIDTH // 2 - 10, player_y - HEAD_RADIUS // 2, 20, 10))
+
+def draw_taco(surface, position):
+    x, y = position
+    pygame.draw.polygon(surface, TACO_COLOR, [(x, y + OBSTACLE_HEIGHT),
+                                              (x + OBSTACLE_WIDTH // 2, y),
+                                              (x + OBSTACLE_WIDTH, y + OBSTACLE_HEIGHT)])
+
+# The player and a taco are drawn once here, every frame copies them to the screen in one go
+sprites = SpriteAtlas()
+sprites.add("player", (PLAYER_WIDTH, PLAYER_HEIGHT + 2 * HEAD_RADIUS), draw_player, origin=(0, 2 * HEAD_RADIUS))
+sprites.add("taco", (OBSTACLE_WIDTH + 1, OBSTACLE_HEIGHT + 1), draw_taco)
+sprites.build()
+
+# Function to draw the player and the tacos, between their last two steps
+def draw_sprites():
+    blits = [sprites.place("player", round(lerp(taco.previous_player_x, taco.player_x, sim.alpha)), taco.player_y)]
+    obstacles = taco.obstacles
+    active = obstacles.active()
+    y = np.rint(lerp(obstacles["previous_y"][active], obstacles["y"][active], sim.alpha)).astype(np.int32)
+    blits.extend(sprites.place("taco", x, y) for x, y in zip(obstacles["x"][active].tolist(), y.tolist()))
+    renderer.sprites(blits)
+
+# Function to turn the hand into a direction to move: 1 for right, -1 for left, 0 to stay
+def process_wrist_movement(frame):
+    if frame.results.multi_hand_landmarks:
+        # Index fingertip height relative to the wrist of the first hand, past 0.05 to start
+        # walking and back inside 0.03 to stop
+        return int(gestures.evaluate(frame.results, frame.capture_time)["walk"][0])
+    return 0
+
+START_BUTTON = pygame.Rect(SCREEN_WIDTH // 2 - 100, SCREEN_HEIGHT // 2 - 50, 200, 100)
+
+def draw_start_layer(surface):
+    surface.fill(WHITE)
+    text = render_text("Taco Eating Game", 74, BLUE)
+    surface.blit(text, (SCREEN_WIDTH // 2 - 200, SCREEN_HEIGHT // 2 - 200))
+
+    pygame.draw.rect(surface, GREEN, START_BUTTON)
+    button_text = render_text("Start", 50, BLACK)
+    surface.blit(button_text, (SCREEN_WIDTH // 2 - 40, SCREEN_HEIGHT // 2 - 20))
+
+def draw_ground_layer(surface):
+    surface.fill(WHITE)
+    pygame.draw.rect(surface, GROUND_COLOR, (0, SCREEN_HEIGHT - 50, SCREEN_WIDTH, 50))
+
+# Static layers are drawn once, each frame only the player, tacos and changed score are pushed
+renderer = DirtyRenderer(screen)
+start_layer = bake_layer(screen.get_size(), draw_start_layer)
+ground_layer = bake_layer(screen.get_size(), draw_ground_layer)
 
 def start_screen():
-    screen.fill(WHITE)
-    font = pygame.font.Font(None, 74)
-    text = font.render("Taco Eating Game", True, BLUE)
-    screen.blit(text, (SCREEN_WIDTH // 2 - 200, SCREEN_HEIGHT // 2 - 200))
-
-    button_rect = pygame.Rect(SCREEN_WIDTH // 2 - 100, SCREEN_HEIGHT // 2 - 50, 200, 100)
-    pygame.draw.rect(screen, GREEN, button_rect)
-    font = pygame.font.Font(None, 50)
-    button_text = font.render("Start", True, BLACK)
-    screen.blit(button_text, (SCREEN_WIDTH // 2 - 40, SCREEN_HEIGHT // 2 - 20))
-
-    pygame.display.flip()
-    return button_rect
+    renderer.begin(start_layer)
+    renderer.present()
+    return START_BUTTON
 
 running = True
 while running:
     if not game_started:
         button_rect = start_screen()
-        for event in pygame.event.get():
+        for event in pipeline.events():
             if event.type == pygame.QUIT:
                 running = False
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if button_rect.collidepoint(event.pos):
                     game_started = True
+                    sim.start(pipeline.now())
+        scheduler.update(game_started)
+        scheduler.tick()
         continue
 
-    success, image = cap.read()
-    if not success:
-        print("Ignoring empty camera frame.")
-        continue
-
-    image = cv2.cvtColor(cv2.flip(image, 1), cv2.COLOR_BGR2RGB)
-    results = hands.process(image)
+    frame = pipeline.latest()
+    image = frame.image
+    results = frame.results
+    if pipeline.finished:
+        break
 
-    cv2.imshow("Hand Tracking", cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+    if preview.window and image is not None:
+        with timings.stage("imshow"):
+            cv2.imshow("Hand Tracking", pipeline.preview(image))
 
-    for event in pygame.event.get():
+    for event in pipeline.events():
         if event.type == pygame.QUIT:
             running = False
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_q:
+            running = False
 
-    process_wrist_movement(results)
-    move_obstacles()
-    check_collision()
+    with timings.stage("process_wrist_movement"):
+        direction = process_wrist_movement(frame)
 
-    if time.time() - obstacle_spawn_time > 1:
-        obstacles.append(create_obstacle())
-        obstacle_spawn_time = time.time()
+    # Run as many fixed steps as the time since the last frame holds
+    with timings.stage("simulation"):
+        for _ in range(sim.advance(pipeline.now())):
+            taco.step(direction)
 
-    screen.fill(WHITE)
-    pygame.draw.rect(screen, GROUND_COLOR, (0, SCREEN_HEIGHT - 50, SCREEN_WIDTH, 50))
-    draw_player()
-    draw_obstacles()
+    with timings.stage("draw"):
+        renderer.begin(ground_layer)
+        draw_sprites()
     
-    font = pygame.font.Font(None, 36)
-    score_text = font.render(f"Score: {score}", True, BLACK)
-    screen.blit(score_text, (10, 10))
+    with timings.stage("draw_hud"):
+        renderer.draw_label(score_label, taco.score)
+
+    with timings.stage("preview"):
+        preview.draw(renderer, frame)
+
+    # F3 profiler overlay, does nothing while it is hidden
+    profiler.draw(renderer)
 
-    pygame.display.flip()
-    clock.tick(FPS)
+    with timings.stage("display_flip"):
+        renderer.present()
+    telemetry.frame(pipeline.now(), frame, score=taco.score, hits=taco.tacos_eaten, misses=taco.tacos_missed,
+                    gesture=direction, x=taco.player_x, y=taco.player_y)
+    scheduler.tick()
     
-    if cv2.waitKey(1) & 0xFF == ord('q'):
+    if preview.window and cv2.waitKey(1) & 0xFF == ord('q'):
         break
 
-cap.release()
-cv2.destroyAllWindows()
-pygame.quit()
+telemetry.close()
+end_game(pipeline)
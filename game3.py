@@ -1,8 +1,19 @@
 import cv2
-import mediapipe as mp
 import pygame
 import sys
 import random
+from camera_preview import CameraPreview
+from dirty_renderer import DirtyRenderer, bake_layer
+from game_rules import AsteroidGame, AsteroidSettings
+from gestures import standard_engine
+from hud_text import HudLabel, render_text
+from live_profiler import profiler
+from idle_scheduler import IdleScheduler
+from session_telemetry import open_telemetry
+from sprite_atlas import SpriteAtlas
+from hand_pipeline import GAME_HANDS_OPTIONS, end_game, open_pipeline
+from sim_clock import SimClock, lerp
+from stage_timer import timings
 
 # Initialize Pygame
 pygame.init()
@@ -24,196 +35,141 @@ HEALTH_COLOR = (0, 255, 0)
 BUTTON_COLOR = (0, 0, 255)
 BUTTON_HOVER_COLOR = (0, 128, 255)
 
-# Fonts
-font = pygame.font.Font(None, 50)
-button_font = pygame.font.Font(None, 36)
+# Score and health lines, only rendered again when the numbers change
+score_label = HudLabel("Score: {}", 50, TEXT_COLOR, (10, 10))
+health_label = HudLabel("Health: {}", 50, TEXT_COLOR, (10, 50))
 
-# Game states
-game_started = False
-game_over = False
+# Camera picture with the hand landmarks in the top right corner (or the OpenCV window when debugging)
+preview = CameraPreview((SCREEN_WIDTH - 170, 10))
 
 # Player settings
-player_pos = [SCREEN_WIDTH // 2, SCREEN_HEIGHT - 100]
-player_speed = 5
 player_width = 50
 player_height = 50
-bullets = []
-bullet_speed = 10
-
-# Scoring
-score = 0
-
-# Asteroid settings
-asteroids = []
-asteroid_spawn_rate = 30
-asteroid_size = 30
-asteroid_health = 3
-
-# Health settings
-player_health = 5
-
-# Level settings
-level = 1
-damage_per_bullet = 1
 
 # Hand tracking settings
-mp_hands = mp.solutions.hands
-hands = mp_hands.Hands(static_image_mode=False, max_num_hands=2,
-                       min_detection_confidence=0.7, min_tracking_confidence=0.7)
-cap = cv2.VideoCapture(0)
-
-# Function to create an asteroid
-def create_asteroid():
-    x_pos = random.randint(0, SCREEN_WIDTH - asteroid_size)
-    return [x_pos, 0, asteroid_size, asteroid_health]
-
-# Function to create bullets
-def create_bullet():
-    bullet_x = player_pos[0] + player_width // 2
-    bullet_y = player_pos[1]
-    bullets.append([bullet_x, bullet_y])
-
-# Function to move bullets
-def move_bullets():
-    global score
-    for bullet in bullets:
-        bullet[1] -= bullet_speed
-        if bullet[1] < 0:
-            bullets.remove(bullet)
-
-# Function to move asteroids
-def move_asteroids():
-    global score, player_health
-    for asteroid in asteroids:
-        asteroid[1] += 5
-        if asteroid[1] > SCREEN_HEIGHT:
-            asteroids.remove(asteroid)
-        if (player_pos[0] < asteroid[0] < player_pos[0] + player_width and
-            player_pos[1] < asteroid[1] < player_pos[1] + player_height):
-            player_health -= 1
-            asteroids.remove(asteroid)
-            if player_health <= 0:
-                return True
-        for bullet in bullets:
-            if (bullet[0] > asteroid[0] and bullet[0] < asteroid[0] + asteroid[2] and
-                bullet[1] > asteroid[1] and bullet[1] < asteroid[1] + asteroid[2]):
-                bullets.remove(bullet)
-                asteroid[3] -= damage_per_bullet
-                damage = max(1, asteroid[3] // 2)
-                asteroid[3] -= damage
-                if asteroid[3] <= 0:
-                    asteroids.remove(asteroid)
-                    score += 1
-                break
-    return False
-
-# Function to draw the player
-def draw_player():
-    pygame.draw.rect(screen, PLAYER_COLOR, (*player_pos, player_width, player_height))
-
-# Function to draw bullets
-def draw_bullets():
-    for bullet in bullets:
-        pygame.draw.rect(screen, BULLET_COLOR, (bullet[0], bullet[1], 5, 10))
-
-# Function to draw asteroids
-def draw_asteroids():
-    for asteroid in asteroids:
-        pygame.draw.circle(screen, ASTEROID_COLOR, (asteroid[0], asteroid[1]), asteroid[2])
+gestures = standard_engine()
+pipeline = open_pipeline(**GAME_HANDS_OPTIONS["game3"])
+
+# Player, bullets, asteroids, score and health (see game_rules.py for the speeds and spawn rate)
+asteroid = AsteroidGame(AsteroidSettings(screen_width=SCREEN_WIDTH, screen_height=SCREEN_HEIGHT,
+                                         player_width=player_width, player_height=player_height), random)
+
+# The player, a bullet and an asteroid are drawn once here, every frame copies them to the screen
+# in one go. Asteroids all have the size in the settings.
+asteroid_size = asteroid.settings.asteroid_size
+sprites = SpriteAtlas()
+sprites.add("player", (player_width, player_height),
+            lambda surface, position: pygame.draw.rect(surface, PLAYER_COLOR, (*position, player_width, player_height)))
+sprites.add("bullet", (5, 10), lambda surface, position: pygame.draw.rect(surface, BULLET_COLOR, (*position, 5, 10)))
+sprites.add("asteroid", (2 * asteroid_size + 1, 2 * asteroid_size + 1),
+            lambda surface, position: pygame.draw.circle(surface, ASTEROID_COLOR, position, asteroid_size),
+            origin=(asteroid_size, asteroid_size))
+sprites.build()
+
+# Function to draw the player, the bullets and the asteroids, between their last two steps
+def draw_sprites():
+    x = round(lerp(asteroid.previous_player_x, asteroid.player_pos[0], sim.alpha))
+    blits = [sprites.place("player", x, asteroid.player_pos[1])]
+
+    bullets = asteroid.bullets
+    active = bullets.active()
+    y = lerp(bullets["previous_y"][active], bullets["y"][active], sim.alpha)
+    blits.extend(sprites.place("bullet", x, y) for x, y in zip(bullets["x"][active].tolist(), y.tolist()))
+
+    asteroids = asteroid.asteroids
+    active = asteroids.active()
+    y = lerp(asteroids["previous_y"][active], asteroids["y"][active], sim.alpha)
+    blits.extend(sprites.place("asteroid", x, y) for x, y in zip(asteroids["x"][active].tolist(), y.tolist()))
+    renderer.sprites(blits)
 
 # Function to draw score and health
 def draw_score_health():
-    score_text = font.render(f"Score: {score}", True, TEXT_COLOR)
-    health_text = font.render(f"Health: {player_health}", True, TEXT_COLOR)
-    screen.blit(score_text, (10, 10))
-    screen.blit(health_text, (10, 50))
+    renderer.draw_label(score_label, asteroid.score)
+    renderer.draw_label(health_label, asteroid.player_health)
 
 # Function to reset the game state
 def reset_game():
-    global game_over, player_pos, bullets, score, asteroids, player_health, level, damage_per_bullet
-    game_over = False
-    player_pos[0] = SCREEN_WIDTH // 2
-    player_pos[1] = SCREEN_HEIGHT - 100
-    bullets.clear()
-    score = 0
-    asteroids.clear()
-    player_health = 5
-    level = 1
-    damage_per_bullet = 1
+    asteroid.reset()
+    renderer.invalidate()
+    sim.start(pipeline.now())
 
 # Function to draw the game over screen
 def draw_game_over_screen():
-    game_over_text = font.render("Game Over!", True, TEXT_COLOR)
-    screen.blit(game_over_text, (SCREEN_WIDTH // 2 - game_over_text.get_width() // 2, SCREEN_HEIGHT // 2 - 50))
-
-# Function to detect thumb movement
-def detect_thumb_movement(results):
-    global player_pos
-
-    if results.multi_hand_landmarks:
-        for hand_landmarks in results.multi_hand_landmarks:
-            thumb_tip = hand_landmarks.landmark[mp_hands.HandLandmark.THUMB_TIP]
-            thumb_mcp = hand_landmarks.landmark[mp_hands.HandLandmark.THUMB_MCP]
-            thumb_distance = thumb_tip.x - thumb_mcp.x
-            if thumb_distance > 0.01:
-                player_pos[0] += player_speed
-            elif thumb_distance < -0.01:
-                player_pos[0] -= player_speed
-            player_pos[0] = max(0, min(SCREEN_WIDTH - player_width, player_pos[0]))
-
-# Game loop
-clock = pygame.time.Clock()
-frame_count = 0
-shoot_timer = 0
-shoot_delay = 10
+    game_over_text = render_text("Game Over!", 50, TEXT_COLOR)
+    renderer.draw_static(game_over_text, (SCREEN_WIDTH // 2 - game_over_text.get_width() // 2, SCREEN_HEIGHT // 2 - 50))
+
+# The background is drawn once, each frame only the sprites and changed HUD lines are pushed
+renderer = DirtyRenderer(screen)
+background_layer = bake_layer(screen.get_size(), lambda surface: surface.fill(BACKGROUND_COLOR))
+
+# Function to detect thumb movement, returns how many hands point right minus how many point left
+def detect_thumb_movement(frame):
+    if frame.results.multi_hand_landmarks:
+        # Each hand's thumb past 0.01 from its knuckle turns it, back inside 0.005 lets go
+        return int(gestures.evaluate(frame.results, frame.capture_time)["steer"].sum())
+    return 0
+
+# Game loop. The game moves in fixed steps of 1/FPS second, however fast frames come in.
+scheduler = IdleScheduler(pipeline, FPS)  # Slower on the game over screen
+telemetry = open_telemetry("game3")  # Per-frame session record, with NEROFLEX_TELEMETRY=<directory>
+direction = 0
+sim = SimClock(FPS)
+escape_pressed = False
 
 while True:
-    success, image = cap.read()
-    if not success:
-        print("Error: Could not read from camera.")
+    frame = pipeline.latest()
+    image_rgb = frame.image
+    results = frame.results
+    if pipeline.finished:
         break
 
-    image = cv2.flip(image, 1)
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    results = hands.process(image_rgb)
-
-    for event in pygame.event.get():
+    for event in pipeline.events():
         if event.type == pygame.QUIT:
-            cap.release()
-            cv2.destroyAllWindows()
-            pygame.quit()
+            telemetry.close()
+            end_game(pipeline)
             sys.exit()
-        if event.type == pygame.MOUSEBUTTONDOWN and game_over:
+        if event.type == pygame.MOUSEBUTTONDOWN and asteroid.game_over:
             if event.button == 1:
                 reset_game()
-
-    if not game_over:
-        screen.fill(BACKGROUND_COLOR)
-        detect_thumb_movement(results)
-        if frame_count % asteroid_spawn_rate == 0:
-            asteroids.append(create_asteroid())
-        if shoot_timer >= shoot_delay:
-            create_bullet()
-            shoot_timer = 0
-        else:
-            shoot_timer += 1
-        if move_asteroids():
-            game_over = True
-        move_bullets()
-        draw_player()
-        draw_bullets()
-        draw_asteroids()
-        draw_score_health()
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+            escape_pressed = True
+
+    if not asteroid.game_over:
+        with timings.stage("detect_thumb_movement"):
+            direction = detect_thumb_movement(frame)
+        with timings.stage("simulation"):
+            for _ in range(sim.advance(pipeline.now())):
+                if asteroid.step(direction):
+                    break
+        with timings.stage("draw"):
+            renderer.begin(background_layer)
+            draw_sprites()
+        with timings.stage("draw_hud"):
+            draw_score_health()
     else:
+        # Keep the last frame on screen with the message over it
+        renderer.begin(None)
         draw_game_over_screen()
 
-    pygame.display.flip()
-    cv2.imshow('Hand Tracking', image)
-    frame_count += 1
+    with timings.stage("preview"):
+        preview.draw(renderer, frame)
+
+    # F3 profiler overlay, does nothing while it is hidden
+    profiler.draw(renderer)
+
+    with timings.stage("display_flip"):
+        renderer.present()
+    if preview.window and image_rgb is not None:
+        with timings.stage("imshow"):
+            cv2.imshow('Hand Tracking', pipeline.preview(image_rgb))
+    telemetry.frame(pipeline.now(), frame, playing=not asteroid.game_over, score=asteroid.score,
+                    hits=asteroid.asteroids_destroyed, misses=asteroid.asteroids_taken, gesture=direction,
+                    x=asteroid.player_pos[0], y=asteroid.player_pos[1])
+    scheduler.update(not asteroid.game_over)
+    scheduler.tick()
 
-    if cv2.waitKey(1) & 0xFF == 27:
+    if escape_pressed or (preview.window and cv2.waitKey(1) & 0xFF == 27):
         break
 
-cap.release()
-cv2.destroyAllWindows()
-pygame.quit()
+telemetry.close()
+end_game(pipeline)
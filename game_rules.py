@@ -0,0 +1,508 @@
+import math
+
+import numpy as np
+
+from entity_store import EntityStore, overlaps_rect, points_in_boxes
+
+
+# Difficulty and layout settings of a game: DEFAULTS are the values the game ships with and any
+# of them can be overridden by keyword, e.g. LockSettings(target_range=0.25)
+class Settings:
+    DEFAULTS = {}
+
+    def __init__(self, **overrides):
+        unknown = sorted(set(overrides) - set(self.DEFAULTS))
+        if unknown:
+            raise ValueError(f"unknown {type(self).__name__} {', '.join(unknown)}")
+        self.__dict__.update(self.DEFAULTS)
+        self.__dict__.update(overrides)
+
+    def values(self):
+        return {name: getattr(self, name) for name in self.DEFAULTS}
+
+
+# The rules of each game without pygame, the camera or the clock, so they can run headless
+# (bulk_sim.py) as well as in the games. Each game is a state object with a step() per fixed
+# time step. rng is anything with randint() and uniform(): the random module in the games, so
+# recorded sessions replay with their seed, or a random.Random(seed) of its own.
+
+
+class LockSettings(Settings):
+    DEFAULTS = {
+        "bar_speed": 0.05,  # Radians per step at the start
+        "speed_step": 0.005,  # Added to the bar speed on every hit
+        "target_range": 0.3,  # Half width of the target zone in radians
+        "grace_period": 1.0,  # Seconds after a hit in which fists are not judged
+    }
+
+
+# Pop the Lock (game1): a bar turns around the lock and a fist must close while it is in the target zone
+class LockGame:
+    def __init__(self, settings, rng, step, now=0.0):
+        self.settings = settings
+        self.rng = rng
+        self.step_seconds = step
+        self.high_score = 0
+        self.hits = 0  # Fists in the target zone over the whole session
+        self.misses = 0  # Fists outside it
+        self.last_timing = None  # (outcome, seconds) of the last judged fist
+        self.reset(now)
+
+    def reset(self, now):
+        self.bar_angle = 0
+        self.previous_bar_angle = 0  # Angle one step ago, the bar is drawn in between
+        self.bar_speed = self.settings.bar_speed
+        self.target_angle = self.rng.uniform(0, 2 * math.pi)
+        self.target_range = self.settings.target_range
+        self.level = 1
+        self.score = 0
+        self.game_over = False
+        self.grace_until = now  # Fists in camera frames taken before this time are not judged
+
+    # Function to start playing at time now, only fists after it count
+    def start(self, now):
+        self.grace_until = now
+
+    # One step: turn the bar
+    def step(self):
+        self.previous_bar_angle = self.bar_angle
+        self.bar_angle += self.bar_speed
+        if self.bar_angle > 2 * math.pi:
+            self.bar_angle -= 2 * math.pi
+
+    # Function to run many steps at once, for simulations that jump from one fist to the next
+    def advance(self, steps):
+        self.previous_bar_angle = (self.bar_angle + (steps - 1) * self.bar_speed) % (2 * math.pi)
+        self.bar_angle = (self.bar_angle + steps * self.bar_speed) % (2 * math.pi)
+
+    # Function to find when the bar is in the target zone, as the (start, end) times of its pass
+    # closest to time t. step_time is when the last step happened on the same clock.
+    def hit_window(self, t, step_time):
+        rate = self.bar_speed / self.step_seconds  # Radians per second
+        angle = self.bar_angle + rate * (t - step_time)
+        # How far the bar is past the start of the zone at time t, between -pi and pi
+        past_start = (angle - (self.target_angle - self.target_range) + math.pi) % (2 * math.pi) - math.pi
+        start = t - past_start / rate
+        return start, start + 2 * self.target_range / rate
+
+    # Function to judge a fist by where the bar was when the camera took the picture. Returns
+    # "hit", "early" or "late", or None when the fist came during the grace period.
+    def judge_fist(self, capture_time, step_time, now):
+        if capture_time < self.grace_until:
+            return None
+
+        start, end = self.hit_window(capture_time, step_time)
+        if start < capture_time < end:
+            self.last_timing = ("hit", capture_time - start)
+            self.score += 1
+            self.hits += 1
+            self.level += 1
+            self.target_angle = self.rng.uniform(0, 2 * math.pi)  # Generate a new target zone
+            self.bar_speed += self.settings.speed_step  # Increase the bar speed slowly
+            self.grace_until = now + self.settings.grace_period
+        else:
+            self.last_timing = ("early", start - capture_time) if capture_time < start else ("late", capture_time - end)
+            self.game_over = True
+            self.misses += 1
+            self.high_score = max(self.high_score, self.score)
+        return self.last_timing[0]
+
+
+class TacoSettings(Settings):
+    DEFAULTS = {
+        "obstacle_speed": 5,  # Pixels per step
+        "spawn_steps": 30,  # Steps between tacos
+        "player_speed": 5,  # Pixels per step
+        "screen_width": 800,
+        "screen_height": 600,
+        "player_width": 50,
+        "player_height": 80,
+        "obstacle_width": 50,
+        "obstacle_height": 30,
+        "border_width": 10,
+    }
+
+
+# Taco Eating Game (game2): tacos fall from the top and the player walks under them to eat them
+class TacoGame:
+    def __init__(self, settings, rng, max_obstacles=64):
+        self.settings = settings
+        self.rng = rng
+        self.player_x = settings.screen_width // 2 - settings.player_width // 2
+        self.player_y = settings.screen_height - settings.player_height - 50
+        self.previous_player_x = self.player_x  # Position one step ago, the player is drawn in between
+        # A fixed pool whose slots are reused as tacos are eaten or fall off the screen
+        self.obstacles = EntityStore(max_obstacles, fixed=True, x=np.int32, y=np.int32, previous_y=np.int32)
+        self.steps_until_spawn = 0
+        self.score = 0
+        self.tacos_eaten = 0
+        self.tacos_missed = 0
+
+    def create_obstacle(self):
+        settings = self.settings
+        x = self.rng.randint(50, settings.screen_width - 50 - settings.obstacle_width)
+        y = -settings.obstacle_height
+        self.obstacles.spawn(x=x, y=y, previous_y=y)
+
+    def move_obstacles(self):
+        obstacles = self.obstacles
+        active = obstacles.active()
+        y = obstacles["y"]
+        obstacles["previous_y"][active] = y[active]
+        y[active] += self.settings.obstacle_speed
+        missed = active[y[active] > self.settings.screen_height]
+        obstacles.kill(missed)
+        self.tacos_missed += len(missed)
+
+    # Tacos that touch the mouth are eaten, one point for every fifth taco
+    def check_collision(self):
+        settings = self.settings
+        obstacles = self.obstacles
+        mouth = (self.player_x + settings.player_width // 2 - 10, self.player_y - 15, 20, 10)
+        active = obstacles.active()
+        x, y = obstacles["x"][active], obstacles["y"][active]
+        eaten = active[overlaps_rect(x, y, settings.obstacle_width, settings.obstacle_height, mouth)]
+        if len(eaten):
+            obstacles.kill(eaten)
+            self.score += (self.tacos_eaten + len(eaten)) // 5 - self.tacos_eaten // 5
+            self.tacos_eaten += len(eaten)
+
+    # One step: direction is 1 to walk right, -1 left and 0 to stay
+    def step(self, direction):
+        settings = self.settings
+        self.previous_player_x = self.player_x
+        self.player_x += settings.player_speed * direction
+        self.player_x = max(settings.border_width,
+                            min(settings.screen_width - settings.player_width - settings.border_width, self.player_x))
+
+        self.move_obstacles()
+        self.check_collision()
+
+        self.steps_until_spawn -= 1
+        if self.steps_until_spawn <= 0:
+            self.create_obstacle()
+            self.steps_until_spawn = settings.spawn_steps
+
+
+# Many sessions of the taco game played at once, for bulk_sim.py: each session is a row of NumPy
+# arrays and step() moves every row together, with the same rules as TacoGame. Tacos all fall at
+# the same speed, so the oldest one always goes first and each row keeps them in a small ring of
+# slots, as many as can be on the screen at once. rng is a NumPy Generator shared by the sessions.
+class TacoBatch:
+    def __init__(self, settings, rng, sessions, max_obstacles=64):
+        self.settings = settings
+        self.rng = rng
+        self.sessions = sessions
+        self.player_x = np.full(sessions, settings.screen_width // 2 - settings.player_width // 2, dtype=np.int64)
+        self.player_y = settings.screen_height - settings.player_height - 50
+        on_screen = (settings.screen_height + settings.obstacle_height) / max(1, settings.obstacle_speed * settings.spawn_steps)
+        slots = min(max_obstacles, math.ceil(on_screen) + 2)
+        self.x = np.zeros((sessions, slots), dtype=np.int64)
+        self.y = np.zeros((sessions, slots), dtype=np.int64)
+        self.alive = np.zeros((sessions, slots), dtype=bool)
+        self.serial = np.full((sessions, slots), -1, dtype=np.int64)  # Spawn number of the taco in each slot
+        self.spawned = 0
+        self.steps_until_spawn = 0
+        self.score = np.zeros(sessions, dtype=np.int64)
+        self.tacos_eaten = np.zeros(sessions, dtype=np.int64)
+        self.tacos_missed = np.zeros(sessions, dtype=np.int64)
+
+    # A new taco in every session. A session whose ring is full skips it, like a full TacoGame pool.
+    def create_obstacles(self):
+        settings = self.settings
+        x = self.rng.integers(50, settings.screen_width - 50 - settings.obstacle_width + 1, size=self.sessions)
+        slot = self.spawned % self.alive.shape[1]
+        free = ~self.alive[:, slot]
+        self.x[free, slot] = x[free]
+        self.y[free, slot] = -settings.obstacle_height
+        self.serial[free, slot] = self.spawned
+        self.alive[:, slot] = True
+        self.spawned += 1
+
+    # One step of every session: direction has 1 (right), -1 (left) or 0 for each session
+    def step(self, direction):
+        settings = self.settings
+        self.player_x += settings.player_speed * direction
+        np.clip(self.player_x, settings.border_width,
+                settings.screen_width - settings.player_width - settings.border_width, out=self.player_x)
+
+        self.y += settings.obstacle_speed
+        missed = self.alive & (self.y > settings.screen_height)
+        self.alive &= ~missed
+        self.tacos_missed += missed.sum(axis=1)
+
+        mouth = ((self.player_x + settings.player_width // 2 - 10)[:, None], self.player_y - 15, 20, 10)
+        eaten = self.alive & overlaps_rect(self.x, self.y, settings.obstacle_width, settings.obstacle_height, mouth)
+        self.alive &= ~eaten
+        count = eaten.sum(axis=1)
+        self.score += (self.tacos_eaten + count) // 5 - self.tacos_eaten // 5
+        self.tacos_eaten += count
+
+        self.steps_until_spawn -= 1
+        if self.steps_until_spawn <= 0:
+            self.create_obstacles()
+            self.steps_until_spawn = settings.spawn_steps
+
+
+class AsteroidSettings(Settings):
+    DEFAULTS = {
+        "asteroid_spawn_rate": 30,  # Steps between asteroids
+        "asteroid_size": 30,  # Also the size of the square used for hits
+        "asteroid_health": 3,
+        "asteroid_speed": 5,  # Pixels per step
+        "damage_per_bullet": 1,
+        "bullet_speed": 10,
+        "shoot_delay": 10,  # Steps between bullets
+        "player_speed": 5,
+        "player_health": 5,
+        "screen_width": 800,
+        "screen_height": 600,
+        "player_width": 50,
+        "player_height": 50,
+    }
+
+
+# Asteroids Therapy Game (game3): the ship shoots by itself and the player steers it under the asteroids
+class AsteroidGame:
+    def __init__(self, settings, rng):
+        self.settings = settings
+        self.rng = rng
+        self.bullets = EntityStore(64, x=np.float32, y=np.float32, previous_y=np.float32)
+        self.asteroids = EntityStore(64, x=np.float32, y=np.float32, previous_y=np.float32,
+                                     radius=np.float32, health=np.int32)
+        self.step_count = 0
+        self.shoot_timer = 0
+        self.asteroids_destroyed = 0  # Over the whole session
+        self.asteroids_taken = 0  # Asteroids that hit the player over the whole session
+        self.reset()
+
+    def reset(self):
+        settings = self.settings
+        self.game_over = False
+        self.player_pos = [settings.screen_width // 2, settings.screen_height - 100]
+        self.previous_player_x = self.player_pos[0]  # Position one step ago, the player is drawn in between
+        self.bullets.clear()
+        self.asteroids.clear()
+        self.score = 0
+        self.player_health = settings.player_health
+
+    def create_asteroid(self):
+        settings = self.settings
+        x = self.rng.randint(0, settings.screen_width - settings.asteroid_size)
+        self.asteroids.spawn(x=x, y=0, previous_y=0, radius=settings.asteroid_size, health=settings.asteroid_health)
+
+    def create_bullet(self):
+        x = self.player_pos[0] + self.settings.player_width // 2
+        y = self.player_pos[1]
+        self.bullets.spawn(x=x, y=y, previous_y=y)
+
+    def move_bullets(self):
+        bullets = self.bullets
+        active = bullets.active()
+        y = bullets["y"]
+        bullets["previous_y"][active] = y[active]
+        y[active] -= self.settings.bullet_speed
+        bullets.kill(active[y[active] < 0])
+
+    # Function to move the asteroids, all asteroids and bullets are checked together.
+    # Returns True when the player is out of health.
+    def move_asteroids(self):
+        settings = self.settings
+        asteroids, bullets = self.asteroids, self.bullets
+        x, y, radius, health = asteroids["x"], asteroids["y"], asteroids["radius"], asteroids["health"]
+
+        active = asteroids.active()
+        asteroids["previous_y"][active] = y[active]
+        y[active] += settings.asteroid_speed
+        asteroids.kill(active[y[active] > settings.screen_height])
+
+        # Asteroids that hit the player
+        player_x, player_y = self.player_pos
+        active = asteroids.active()
+        hit_player = active[(player_x < x[active]) & (x[active] < player_x + settings.player_width) &
+                            (player_y < y[active]) & (y[active] < player_y + settings.player_height)]
+        if len(hit_player):
+            self.player_health = max(0, self.player_health - len(hit_player))
+            self.asteroids_taken += len(hit_player)
+            asteroids.kill(hit_player)
+            if self.player_health <= 0:
+                return True
+
+        # Bullets inside asteroids. A bullet hits one asteroid and an asteroid takes one bullet per step.
+        active = asteroids.active()
+        shots = bullets.active()
+        bullet_hits, asteroid_hits = points_in_boxes(bullets["x"][shots], bullets["y"][shots],
+                                                     x[active], y[active], radius[active])
+        _, first = np.unique(bullet_hits, return_index=True)
+        bullet_hits, asteroid_hits = bullet_hits[first], asteroid_hits[first]
+        _, first = np.unique(asteroid_hits, return_index=True)
+        bullet_hits, asteroid_hits = bullet_hits[first], asteroid_hits[first]
+
+        bullets.kill(shots[bullet_hits])
+        hit = active[asteroid_hits]
+        health[hit] -= settings.damage_per_bullet
+        health[hit] -= np.maximum(1, health[hit] // 2)
+        destroyed = hit[health[hit] <= 0]
+        asteroids.kill(destroyed)
+        self.score += len(destroyed)
+        self.asteroids_destroyed += len(destroyed)
+        return False
+
+    # One step: direction is how many hands point right minus how many point left.
+    # Returns True (and sets game_over) when the player is out of health.
+    def step(self, direction):
+        settings = self.settings
+        self.previous_player_x = self.player_pos[0]
+        self.player_pos[0] += settings.player_speed * direction
+        self.player_pos[0] = max(0, min(settings.screen_width - settings.player_width, self.player_pos[0]))
+
+        if self.step_count % settings.asteroid_spawn_rate == 0:
+            self.create_asteroid()
+        if self.shoot_timer >= settings.shoot_delay:
+            self.create_bullet()
+            self.shoot_timer = 0
+        else:
+            self.shoot_timer += 1
+        self.step_count += 1
+        dead = self.move_asteroids()
+        self.move_bullets()
+        if dead:
+            self.game_over = True
+        return dead
+
+
+# Many sessions of the asteroids game played at once, for bulk_sim.py, with the same rules as
+# AsteroidGame. Like TacoBatch, asteroids and bullets each move at one speed, so every row keeps
+# them in rings of slots as long as the most that fit on the screen. A session stops counting
+# once its player is out of health; game_over and steps_played say when that happened.
+class AsteroidBatch:
+    def __init__(self, settings, rng, sessions):
+        self.settings = settings
+        self.rng = rng
+        self.sessions = sessions
+        self.player_x = np.full(sessions, settings.screen_width // 2, dtype=np.int64)
+        self.player_y = settings.screen_height - 100
+        self.player_health = np.full(sessions, settings.player_health, dtype=np.int64)
+        self.game_over = np.zeros(sessions, dtype=bool)
+        self.steps_played = np.zeros(sessions, dtype=np.int64)
+        self.score = np.zeros(sessions, dtype=np.int64)
+        self.asteroids_destroyed = np.zeros(sessions, dtype=np.int64)
+        self.asteroids_taken = np.zeros(sessions, dtype=np.int64)
+
+        on_screen = settings.screen_height / max(1, settings.asteroid_speed * settings.asteroid_spawn_rate)
+        slots = math.ceil(on_screen) + 2
+        self.asteroid_x = np.zeros((sessions, slots), dtype=np.float32)
+        self.asteroid_y = np.zeros((sessions, slots), dtype=np.float32)
+        self.asteroid_health = np.zeros((sessions, slots), dtype=np.int64)
+        self.asteroid_alive = np.zeros((sessions, slots), dtype=bool)
+        self.asteroid_serial = np.full((sessions, slots), -1, dtype=np.int64)
+        self.asteroids_spawned = 0
+
+        on_screen = settings.screen_height / max(1, settings.bullet_speed * (settings.shoot_delay + 1))
+        slots = math.ceil(on_screen) + 2
+        self.bullet_x = np.zeros((sessions, slots), dtype=np.float32)
+        self.bullet_y = np.zeros((sessions, slots), dtype=np.float32)
+        self.bullet_alive = np.zeros((sessions, slots), dtype=bool)
+        self.bullets_spawned = 0
+
+        self.step_count = 0
+        self.shoot_timer = 0
+
+    def create_asteroids(self):
+        settings = self.settings
+        x = self.rng.integers(0, settings.screen_width - settings.asteroid_size + 1, size=self.sessions)
+        slot = self.asteroids_spawned % self.asteroid_alive.shape[1]
+        free = ~self.asteroid_alive[:, slot]
+        self.asteroid_x[free, slot] = x[free]
+        self.asteroid_y[free, slot] = 0
+        self.asteroid_health[free, slot] = settings.asteroid_health
+        self.asteroid_serial[free, slot] = self.asteroids_spawned
+        self.asteroid_alive[:, slot] = True
+        self.asteroids_spawned += 1
+
+    def create_bullets(self):
+        slot = self.bullets_spawned % self.bullet_alive.shape[1]
+        free = ~self.bullet_alive[:, slot]
+        self.bullet_x[free, slot] = (self.player_x + self.settings.player_width // 2)[free]
+        self.bullet_y[free, slot] = self.player_y
+        self.bullet_alive[:, slot] = True
+        self.bullets_spawned += 1
+
+    # Function to move the asteroids of every session and check them against the player and the
+    # bullets. Returns which sessions lost their last health on this step.
+    def move_asteroids(self, playing):
+        settings = self.settings
+        size = settings.asteroid_size
+        x, y, alive = self.asteroid_x, self.asteroid_y, self.asteroid_alive
+        y += settings.asteroid_speed
+        alive &= ~(y > settings.screen_height)
+
+        player_x = self.player_x[:, None]
+        hit_player = alive & (player_x < x) & (x < player_x + settings.player_width) & \
+                     (self.player_y < y) & (y < self.player_y + settings.player_height)
+        alive &= ~hit_player
+        taken = hit_player.sum(axis=1) * playing
+        self.player_health = np.maximum(0, self.player_health - taken)
+        self.asteroids_taken += taken
+        dead = playing & (taken > 0) & (self.player_health <= 0)
+
+        # Bullets inside asteroids. Like AsteroidGame, a bullet hits the first asteroid it is in and
+        # an asteroid takes the first bullet that chose it. A session whose player just died does
+        # not get to shoot anything on this step. 0 < d < size is tested as |d - size / 2| < size / 2.
+        sessions, bullets = np.nonzero(self.bullet_alive & ~dead[:, None])
+        half = size / 2
+        inside = alive[sessions] & \
+            (np.abs(self.bullet_x[sessions, bullets][:, None] - x[sessions] - half) < half) & \
+            (np.abs(self.bullet_y[sessions, bullets][:, None] - y[sessions] - half) < half)
+        shots = np.flatnonzero(inside.any(axis=1))
+        asteroids = inside[shots].argmax(axis=1)
+        # Shots are in (session, bullet) order, so the first of each (session, asteroid) is the first bullet
+        _, first = np.unique(sessions[shots] * alive.shape[1] + asteroids, return_index=True)
+        shots, asteroids = shots[first], asteroids[first]
+        self.bullet_alive[sessions[shots], bullets[shots]] = False
+        hit = np.zeros_like(alive)
+        hit[sessions[shots], asteroids] = True
+
+        health = self.asteroid_health
+        health[hit] -= settings.damage_per_bullet
+        health[hit] -= np.maximum(1, health[hit] // 2)
+        destroyed = hit & (health <= 0)
+        alive &= ~destroyed
+        count = destroyed.sum(axis=1) * playing
+        self.score += count
+        self.asteroids_destroyed += count
+        return dead
+
+    def move_bullets(self):
+        self.bullet_y -= self.settings.bullet_speed
+        self.bullet_alive &= ~(self.bullet_y < 0)
+
+    # Function to carry on with only the given sessions (row numbers), so lost ones stop costing anything
+    def keep(self, rows):
+        for name in ("player_x", "player_health", "game_over", "steps_played", "score", "asteroids_destroyed",
+                     "asteroids_taken", "asteroid_x", "asteroid_y", "asteroid_health", "asteroid_alive",
+                     "asteroid_serial", "bullet_x", "bullet_y", "bullet_alive"):
+            setattr(self, name, getattr(self, name)[rows])
+        self.sessions = len(rows)
+
+    # One step of every session: direction is each session's hands pointing right minus left.
+    # Returns which sessions lost on this step.
+    def step(self, direction):
+        settings = self.settings
+        playing = ~self.game_over
+        self.player_x += settings.player_speed * direction
+        np.clip(self.player_x, 0, settings.screen_width - settings.player_width, out=self.player_x)
+
+        if self.step_count % settings.asteroid_spawn_rate == 0:
+            self.create_asteroids()
+        if self.shoot_timer >= settings.shoot_delay:
+            self.create_bullets()
+            self.shoot_timer = 0
+        else:
+            self.shoot_timer += 1
+        self.step_count += 1
+        dead = self.move_asteroids(playing)
+        self.move_bullets()
+        self.game_over |= dead
+        self.steps_played += playing
+        return dead
@@ -0,0 +1,346 @@
+import math
+
+import numpy as np
+
+NUM_LANDMARKS = 21
+
+# Mediapipe handedness labels, a hand's label number is its index here
+HAND_LABELS = ("Left", "Right")
+
+# Mediapipe hand landmark indices
+WRIST = 0
+THUMB_MCP = 2
+THUMB_TIP = 4
+INDEX_FINGER_MCP = 5
+INDEX_FINGER_TIP = 8
+MIDDLE_FINGER_MCP = 9
+MIDDLE_FINGER_TIP = 12
+RING_FINGER_MCP = 13
+RING_FINGER_TIP = 16
+PINKY_MCP = 17
+PINKY_TIP = 20
+
+FINGER_TIPS = (INDEX_FINGER_TIP, MIDDLE_FINGER_TIP, RING_FINGER_TIP, PINKY_TIP)
+FINGER_MCPS = (INDEX_FINGER_MCP, MIDDLE_FINGER_MCP, RING_FINGER_MCP, PINKY_MCP)
+
+
+# A serialized landmark with only x, y and z set is 17 bytes: message tag and length, then a tag
+# byte before each float32. The floats sit 5 bytes apart, so all hands can be read as one strided
+# (hands * 21, 3) view of the serialized bytes instead of 63 attribute reads per hand.
+# Every landmark's tag bytes are checked, since one landmark with a field missing and another
+# with an extra one (e.g. visibility) add up to the same length.
+SERIALIZED_LANDMARK_SIZE = 17
+SERIALIZED_TAG_OFFSETS = [0, 1, 2, 7, 12]
+SERIALIZED_TAGS = np.array([0x0A, 0x0F, 0x0D, 0x15, 0x1D], dtype=np.uint8)
+
+
+# Function to convert Mediapipe's multi_hand_landmarks into a (hands, 21, 3) float32 array
+def hands_to_array(multi_hand_landmarks):
+    if not multi_hand_landmarks:
+        return np.zeros((0, NUM_LANDMARKS, 3), dtype=np.float32)
+
+    hand_count = len(multi_hand_landmarks)
+    data = b"".join([hand.SerializeToString() for hand in multi_hand_landmarks])
+    records = np.frombuffer(data, dtype=np.uint8)
+    if (len(data) == hand_count * NUM_LANDMARKS * SERIALIZED_LANDMARK_SIZE
+            and (records.reshape(-1, SERIALIZED_LANDMARK_SIZE)[:, SERIALIZED_TAG_OFFSETS] == SERIALIZED_TAGS).all()):
+        points = np.ndarray((hand_count * NUM_LANDMARKS, 3), dtype="<f4", buffer=data, offset=3,
+                            strides=(SERIALIZED_LANDMARK_SIZE, 5))
+        return points.reshape(hand_count, NUM_LANDMARKS, 3)
+
+    # Some fields missing or extra (e.g. visibility), read the attributes instead
+    values = (value for hand in multi_hand_landmarks for point in hand.landmark
+              for value in (point.x, point.y, point.z))
+    count = hand_count * NUM_LANDMARKS * 3
+    return np.fromiter(values, dtype=np.float32, count=count).reshape(hand_count, NUM_LANDMARKS, 3)
+
+
+# One Euro filter (Casiez, Roussel and Vogel, CHI 2012) for an array of values that are filtered
+# together, e.g. the 21 landmarks of a hand. It is a low-pass filter whose cutoff frequency rises
+# with the speed of each value: a still hand is smoothed hard so the jitter goes, a moving hand is
+# followed with little lag, which a moving average cannot do. Every update is a fixed number of
+# operations on buffers allocated once.
+# min_cutoff (Hz) is the smoothing at rest, beta how much the cutoff rises per unit/s of speed and
+# d_cutoff (Hz) smooths the speed itself.
+class OneEuroFilter:
+    def __init__(self, shape, min_cutoff=1.0, beta=30.0, d_cutoff=3.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.value = np.zeros(shape, dtype=np.float32)
+        self.velocity = np.zeros(shape, dtype=np.float32)  # Units per second
+        self.scratch = np.zeros(shape, dtype=np.float32)
+        self.gain = np.zeros(shape, dtype=np.float32)
+        self.time = None
+
+    def reset(self):
+        self.time = None
+
+    # Function to take a new measurement made at time t (seconds), returns the filtered value
+    def update(self, value, t):
+        if self.time is None:
+            self.value[...] = value
+            self.velocity[...] = 0
+            self.time = t
+            return self.value
+        dt = t - self.time
+        if dt <= 0:
+            return self.value
+        self.time = t
+
+        # Speed of the raw value against the filtered one, smoothed at d_cutoff
+        scratch, gain = self.scratch, self.gain
+        np.subtract(value, self.value, out=scratch)
+        scratch /= dt
+        scratch -= self.velocity
+        scratch *= 1 / (1 + 1 / (2 * math.pi * self.d_cutoff * dt))
+        self.velocity += scratch
+
+        # Cutoff of each value from its speed, then the smoothing factor 1 / (1 + 1 / (2 pi cutoff dt))
+        np.abs(self.velocity, out=gain)
+        gain *= self.beta
+        gain += self.min_cutoff
+        gain *= 2 * math.pi * dt
+        np.reciprocal(gain, out=gain)
+        gain += 1
+        np.reciprocal(gain, out=gain)
+
+        np.subtract(value, self.value, out=scratch)
+        scratch *= gain
+        self.value += scratch
+        return self.value
+
+
+# Filtered landmarks of each tracked hand over the last `length` camera frames, kept in one
+# (slots, length, 21, 3) ring allocated once, with the time of each entry. Each camera frame costs
+# one One Euro update and one ring write per hand, however long the history.
+# A hand keeps its slot from frame to frame by its handedness (slot 0 left, slot 1 right). A hand
+# not seen for forget_after seconds, or whose wrist is more than `jump` away from where the slot's
+# hand was (Mediapipe swapped the handedness of two hands), starts again with an empty history and
+# a fresh filter, so it is not smoothed towards a position that was not its own.
+class HandHistory:
+    def __init__(self, slots=2, length=32, forget_after=0.5, jump=0.2, **filter_options):
+        self.slots = slots
+        self.length = length
+        self.forget_after = forget_after
+        self.jump = jump
+        self.landmarks = np.zeros((slots, length, NUM_LANDMARKS, 3), dtype=np.float32)
+        self.times = np.zeros((slots, length))
+        self.written = np.zeros(slots, dtype=np.int64)  # Entries since the slot's hand came into view
+        self.last_seen = np.full(slots, -np.inf)
+        self.filters = [OneEuroFilter((NUM_LANDMARKS, 3), **filter_options) for _ in range(slots)]
+
+    # Function to pick a slot for each hand from its handedness (0 left, 1 right, -1 unknown).
+    # A hand whose slot is taken gets a free one, -1 when there is none.
+    def assign(self, labels):
+        slots = np.full(len(labels), -1, dtype=np.intp)
+        taken = [False] * self.slots
+        for i, label in enumerate(labels):
+            if 0 <= label < self.slots and not taken[label]:
+                slots[i] = label
+                taken[label] = True
+        for i in range(len(labels)):
+            if slots[i] < 0 and not all(taken):
+                slots[i] = taken.index(False)
+                taken[slots[i]] = True
+        return slots
+
+    # Function to add the hands of one camera frame taken at time t. landmarks is (hands, 21, 3).
+    # Returns the filtered landmarks, their velocity (units per second) and the slot of each hand.
+    # Hands that got no slot are passed through unfiltered with no velocity.
+    def update(self, landmarks, labels, t):
+        slots = self.assign(labels)
+        filtered = landmarks.copy()
+        velocity = np.zeros_like(landmarks)
+        for i, slot in enumerate(slots.tolist()):
+            if slot < 0:
+                continue
+            hand_filter = self.filters[slot]
+            if self.written[slot] and t <= self.last_seen[slot]:
+                # The same camera frame again
+                filtered[i] = hand_filter.value
+                velocity[i] = hand_filter.velocity
+                continue
+            wrist_moved = np.abs(landmarks[i, WRIST, :2] - hand_filter.value[WRIST, :2]).max()
+            if t - self.last_seen[slot] > self.forget_after or wrist_moved > self.jump:
+                hand_filter.reset()
+                self.written[slot] = 0
+            self.last_seen[slot] = t
+
+            filtered[i] = hand_filter.update(landmarks[i], t)
+            velocity[i] = hand_filter.velocity
+            entry = self.written[slot] % self.length
+            self.landmarks[slot, entry] = filtered[i]
+            self.times[slot, entry] = t
+            self.written[slot] += 1
+        return filtered, velocity, slots
+
+    # Function to get the last `frames` entries of a slot (all by default) as (times, landmarks),
+    # oldest first. Fewer come back when the hand has not been in view that long.
+    def window(self, slot, frames=None):
+        count = min(self.written[slot], self.length)
+        if frames is not None:
+            count = min(count, frames)
+        entries = (self.written[slot] - count + np.arange(count)) % self.length
+        return self.times[slot, entries], self.landmarks[slot, entries]
+
+
+# Function to get the handedness of each hand as its HAND_LABELS index, -1 when it is not known
+def hand_labels(multi_handedness, hand_count):
+    labels = np.full(hand_count, -1, dtype=np.intp)
+    for i, handedness in enumerate((multi_handedness or [])[:hand_count]):
+        label = handedness.classification[0].label
+        if label in HAND_LABELS:
+            labels[i] = HAND_LABELS.index(label)
+    return labels
+
+
+# Evaluates every registered gesture for all detected hands at once.
+# Distance and offset gestures are landmark pairs, so all of them are computed with a single
+# gather, subtraction and threshold test no matter how many are registered. Other gestures can be
+# added with register() as a function that takes the (hands, 21, 3) array and returns one value per hand.
+# Distance and direction gestures can have hysteresis: once a hand is in a gesture it stays in it
+# until it is clearly out (the release threshold), so jitter around the threshold does not flicker
+# it on and off. With a HandHistory the gestures are worked out on the filtered landmarks and each
+# hand keeps its gesture states in its history slot, otherwise hands are known by their order.
+class GestureEngine:
+    def __init__(self, history=None):
+        self.history = history
+        self.pairs = []
+        self.limits = []
+        self.pair_index = np.zeros((0, 2), dtype=np.intp)
+        self.squared_limits = np.zeros(0, dtype=np.float32)
+        self.distance_gestures = {}
+        self.offset_gestures = {}
+        self.direction_gestures = {}
+        self.custom_gestures = {}
+        # Gesture name -> its state for each history slot, from the last frame the slot's hand was on
+        self.states = {}
+        self.last_hand_count = 0
+
+        # The pipeline hands out the same result object until a new camera frame is processed
+        self.last_results = None
+        self.last_values = None
+
+    def add_pairs(self, points, bases, limit):
+        start = len(self.pairs)
+        self.pairs.extend(zip(points, bases))
+        self.limits.extend([limit] * len(points))
+        self.pair_index = np.array(self.pairs, dtype=np.intp)
+        self.squared_limits = np.square(np.array(self.limits, dtype=np.float32))
+        self.last_results = None
+        return slice(start, len(self.pairs))
+
+    # True for a hand when every point is closer than threshold to its base (x and y only).
+    # With release, a hand in the gesture stays in it while every point is closer than release.
+    def register_distance(self, name, points, bases, threshold, release=None):
+        enter = self.add_pairs(points, bases, threshold)
+        hold = self.add_pairs(points, bases, release) if release is not None else None
+        self.distance_gestures[name] = (enter, hold)
+
+    # Position of point minus position of base along one axis (0 is x, 1 is y, 2 is z)
+    def register_offset(self, name, point, base, axis):
+        self.offset_gestures[name] = (self.add_pairs([point], [base], np.inf).start, axis)
+
+    # 1 when the offset of point from base is above threshold, -1 when below -threshold, else 0.
+    # With release, a hand keeps its direction until the offset falls back inside +-release.
+    def register_direction(self, name, point, base, axis, threshold, release=None):
+        pair = self.add_pairs([point], [base], np.inf).start
+        self.direction_gestures[name] = (pair, axis, threshold, threshold if release is None else release)
+
+    def register(self, name, function):
+        self.custom_gestures[name] = function
+        self.last_results = None
+
+    # Function to get the last state of a gesture for each hand, off (zero) for hands that are new
+    def previous_states(self, name, slots, continuing, dtype):
+        states = np.zeros(len(slots), dtype=dtype)
+        previous = self.states.get(name)
+        if previous is not None:
+            known = continuing & (slots < len(previous))
+            states[known] = previous[slots[known]]
+        return states
+
+    # Function to store the state of each hand under its slot. Slots of hands missing from the
+    # frame keep theirs, so a hand that drops out for a frame or two carries on in its gesture.
+    def keep_states(self, name, slots, values):
+        known = slots >= 0
+        kept = self.states.get(name)
+        size = int(slots.max()) + 1 if len(slots) else 0
+        if kept is None or len(kept) < size:
+            grown = np.zeros(size, dtype=values.dtype)
+            if kept is not None:
+                grown[:len(kept)] = kept
+            kept = self.states[name] = grown
+        kept[slots[known]] = values[known]
+
+    # Returns a dict of gesture name -> array with one value per detected hand, plus "landmarks"
+    # with the (read-only) (hands, 21, 3) array itself. With a HandHistory, pass the time the
+    # camera frame was taken: the landmarks are then the filtered ones, "velocity" has their
+    # velocity (units per second) and "slots" the history slot of each hand.
+    def evaluate(self, results, time=None):
+        if results is self.last_results:
+            return self.last_values
+
+        landmarks = hands_to_array(results.multi_hand_landmarks)
+        values = {}
+        if self.history is not None and time is not None:
+            labels = hand_labels(results.multi_handedness, len(landmarks))
+            landmarks, values["velocity"], slots = self.history.update(landmarks, labels, time)
+            values["slots"] = slots
+            # Hands the history still knows, whose gestures carry over. That includes a hand missing
+            # from a few frames, until the history forgets it after forget_after seconds.
+            continuing = (slots >= 0) & (self.history.written[slots] > 1)
+        else:
+            # Without a history hands are only known by their order, so only the hands of the
+            # frame before carry over
+            slots = np.arange(len(landmarks))
+            continuing = slots < self.last_hand_count
+        self.last_hand_count = len(landmarks)
+        pairs = landmarks[:, self.pair_index]
+        offsets = pairs[:, :, 0] - pairs[:, :, 1]
+        close = np.square(offsets[..., :2]).sum(axis=2) < self.squared_limits
+
+        values["landmarks"] = landmarks
+        for name, (enter, hold) in self.distance_gestures.items():
+            values[name] = close[:, enter].all(axis=1)
+            if hold is not None:
+                previous = self.previous_states(name, slots, continuing, np.bool_)
+                values[name] |= previous & close[:, hold].all(axis=1)
+                self.keep_states(name, slots, values[name])
+        for name, (pair, axis) in self.offset_gestures.items():
+            values[name] = offsets[:, pair, axis]
+        for name, (pair, axis, threshold, release) in self.direction_gestures.items():
+            offset = offsets[:, pair, axis]
+            previous = self.previous_states(name, slots, continuing, np.int8)
+            direction = (offset > threshold).astype(np.int8) - (offset < -threshold)
+            # Keep the previous direction while the offset is still past the release threshold
+            holding = (direction == 0) & (previous * offset > release)
+            direction[holding] = previous[holding]
+            values[name] = direction
+            self.keep_states(name, slots, direction)
+        for name, function in self.custom_gestures.items():
+            values[name] = function(landmarks)
+
+        self.last_results = results
+        self.last_values = values
+        return values
+
+
+# Function to make an engine with the gestures the games use. The landmarks go through a
+# HandHistory, so the games have to pass the capture time of the frame to evaluate().
+def standard_engine():
+    engine = GestureEngine(HandHistory())
+    # All four fingertips pulled in to their knuckles (game1)
+    engine.register_distance("fist", FINGER_TIPS, FINGER_MCPS, 0.15, release=0.17)
+    # Index fingertip below (positive) or above (negative) the wrist (game2)
+    engine.register_offset("wrist_tilt", INDEX_FINGER_TIP, WRIST, axis=1)
+    # Walking direction from the wrist tilt: 1 right (fingertip down), -1 left (game2)
+    engine.register_direction("walk", INDEX_FINGER_TIP, WRIST, axis=1, threshold=0.05, release=0.03)
+    # Thumb tip right (positive) or left (negative) of the thumb knuckle (game3)
+    engine.register_offset("thumb_direction", THUMB_TIP, THUMB_MCP, axis=0)
+    # Steering direction from the thumb: 1 right, -1 left (game3)
+    engine.register_direction("steer", THUMB_TIP, THUMB_MCP, axis=0, threshold=0.01, release=0.005)
+    # Thumb and index fingertips touching
+    engine.register_distance("pinch", [THUMB_TIP], [INDEX_FINGER_TIP], 0.05, release=0.06)
+    return engine
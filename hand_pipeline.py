@@ -0,0 +1,509 @@
+import os
+import queue
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+import cv2
+import pygame
+
+from camera_capture import Backoff
+from frame_buffers import FrameBuffers
+from live_profiler import profiler
+from stage_timer import timings
+
+# Result used before the first camera frame has gone through Mediapipe
+NO_HANDS = SimpleNamespace(multi_hand_landmarks=None, multi_handedness=None)
+
+# Hand tracking settings each game asks open_pipeline() for, also used by launcher.py to load
+# the models up front and by clinic_server.py for the inference pool
+GAME_HANDS_OPTIONS = {
+    "game1": {},
+    "game2": {},
+    "game3": dict(static_image_mode=False, max_num_hands=2, min_detection_confidence=0.7, min_tracking_confidence=0.7),
+}
+
+
+# One camera frame and the hand tracking result computed for it
+class HandFrame:
+    __slots__ = ("frame_id", "capture_time", "image", "results")
+
+    def __init__(self, frame_id, capture_time, image, results=NO_HANDS):
+        self.frame_id = frame_id
+        self.capture_time = capture_time
+        self.image = image
+        self.results = results
+
+
+# Runs the camera and Mediapipe on worker threads so the game loop never waits on them.
+# Only the newest frame is kept at each stage, older ones are dropped and counted.
+# With threaded=False every latest() call reads and processes exactly one frame instead,
+# which is how recorded sessions are replayed frame for frame.
+# on_result is called with every processed frame (from the inference thread), and prepared=True
+# is for sources that already deliver mirrored RGB frames.
+class HandPipeline:
+    def __init__(self, cap, hands, queue_size=1, threaded=True, recorder=None, replay=None, max_frames=None,
+                 on_result=None, prepared=False):
+        self.cap = cap
+        self.hands = hands
+        self.threaded = threaded
+        self.on_result = on_result
+        self.prepared = prepared
+        self.recorder = recorder
+        self.replay = replay
+        self.frame_queue = queue.Queue(maxsize=queue_size)
+        self.buffers = FrameBuffers(queue_size + 4)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.keep_open = False  # True for a pipeline that outlives the game, see WarmPipeline
+        self.finished = False  # Set when a replay runs out of frames or max_frames were shown
+        self.max_frames = max_frames
+        self.frames_shown = 0
+        self.last_latest_time = None
+        self.event_calls = 0
+        self.idle_fps = None  # Hand tracking rate while the game does not use the hands, None at full rate
+        self.idle_interval = None  # Seconds between tracked frames while idle, None at full rate
+        self.last_idle_frame = 0.0
+        self.idle_since = None
+        self.idle_time = 0.0  # Seconds spent idle
+        # Wait between reads of a camera that delivers nothing, unless it already waits on its own
+        # (camera_capture.Camera backs off and reconnects inside read())
+        self.read_backoff = None if hasattr(cap, "backoff") else Backoff()
+
+        self.newest = HandFrame(-1, 0.0, None)
+        self.newest_unread = False
+
+        self.frames_captured = 0
+        self.frames_processed = 0
+        self.capture_dropped = 0  # Frames replaced before Mediapipe got to them
+        self.result_dropped = 0  # Results replaced before the game read them
+        self.idle_skipped = 0  # Frames not tracked because the game was idle
+
+    def start(self):
+        if not self.threaded:
+            return self
+        for target, name in ((self.capture_loop, "hand-capture"), (self.inference_loop, "hand-inference")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    # Function to track hands at only idle_fps frames a second (0 to pause) while the game does not
+    # use them, or at full rate again with None. A source that tracks hands elsewhere and has a
+    # set_idle() of its own (clinic_server.StationClient) is asked to slow down instead.
+    def set_idle(self, idle_fps):
+        if idle_fps == self.idle_fps:
+            return
+        self.idle_fps = idle_fps
+        now = time.perf_counter()
+        if idle_fps is None:
+            self.idle_time += now - self.idle_since
+            self.idle_since = None
+        elif self.idle_since is None:
+            self.idle_since = now
+
+        if hasattr(self.cap, "set_idle"):
+            self.cap.set_idle(idle_fps)
+        elif idle_fps is None:
+            self.idle_interval = None
+        else:
+            self.idle_interval = 1.0 / idle_fps if idle_fps else float("inf")
+            self.last_idle_frame = now
+
+    # True while idle and the next frame is not due for tracking yet
+    def idle_skip(self):
+        if self.idle_interval is None:
+            return False
+        now = time.perf_counter()
+        if now - self.last_idle_frame < self.idle_interval:
+            return True
+        self.last_idle_frame = now
+        return False
+
+    # Frame for the image the source just read. A camera that comes with its own capture_time
+    # (camera_capture.Camera) says when the frame was taken, otherwise it is
+    # when the read returned. A source with a frame_id of its own numbers the frames.
+    def captured_frame(self, image):
+        capture_time = getattr(self.cap, "capture_time", None)
+        if capture_time is None:
+            capture_time = self.now()
+        frame_id = getattr(self.cap, "frame_id", None)
+        if frame_id is None:
+            frame_id = self.frames_captured
+        self.frames_captured += 1
+        return HandFrame(frame_id, capture_time, image)
+
+    # Capture stage: read frames as fast as the camera delivers them
+    def capture_loop(self):
+        while not self.stop_event.is_set():
+            if self.idle_skip():
+                # Skipped frames are only grabbed, not decoded, which still keeps the camera's
+                # buffer empty so the first frame after going back to full rate is a fresh one
+                if hasattr(self.cap, "grab"):
+                    success = self.cap.grab()
+                else:
+                    success, _ = self.cap.read(self.buffers.camera_buffer())
+                if not success and not self.cap.isOpened():
+                    self.finished = True
+                    return
+                self.idle_skipped += 1
+                continue
+
+            with timings.stage("capture"):
+                success, image = self.cap.read(self.buffers.camera_buffer())
+            if not success:
+                if not self.cap.isOpened():
+                    self.finished = True
+                    return
+                if self.read_backoff is not None:
+                    self.read_backoff.wait(self.stop_event)
+                continue
+            if self.read_backoff is not None:
+                self.read_backoff.reset()
+
+            frame = self.captured_frame(image)
+            try:
+                self.frame_queue.put_nowait(frame)
+            except queue.Full:
+                try:
+                    self.frame_queue.get_nowait()
+                    self.capture_dropped += 1
+                except queue.Empty:
+                    pass
+                self.frame_queue.put_nowait(frame)
+
+    # Inference stage: flip, convert and run Mediapipe on the newest captured frame
+    def inference_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                frame = self.frame_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            self.process_frame(frame)
+
+    def process_frame(self, frame):
+        if not self.prepared:
+            with timings.stage("frame_prep"):
+                frame.image = self.buffers.flip_rgb(frame.image)
+        with timings.stage("hands_process"):
+            if hasattr(self.hands, "frame_results"):
+                # Landmarks that came with the frame from its source (clinic_server.StationClient)
+                frame.results = self.hands.frame_results(frame)
+            else:
+                frame.results = self.hands.process(frame.image)
+        self.frames_processed += 1
+
+        with self.lock:
+            if self.newest_unread:
+                self.result_dropped += 1
+            self.newest = frame
+            self.newest_unread = True
+        if self.on_result is not None:
+            self.on_result(frame)
+
+    # Used instead of the worker threads when threaded=False
+    def process_next(self):
+        with timings.stage("capture"):
+            success, image = self.cap.read(self.buffers.camera_buffer())
+        if not success:
+            self.finished = True
+            return
+        if self.idle_skip():
+            self.idle_skipped += 1
+            return
+        if self.replay is not None:
+            # The camera frame the game had when it was recorded, the same one on every game frame
+            # that was shown it, so frame ids and capture times line up with the recorded session
+            frame_id, capture_time = self.replay.recorded_frame()
+            self.frames_captured += 1
+            self.process_frame(HandFrame(frame_id, capture_time, image))
+        else:
+            self.process_frame(self.captured_frame(image))
+
+    # Newest processed frame, never blocks. Returns the same frame again if nothing new arrived.
+    # Call it once per game frame, it also marks the start of the frame for recording and replay.
+    def latest(self):
+        if timings.enabled:
+            now = time.perf_counter()
+            if self.last_latest_time is not None:
+                timings.add("frame", now - self.last_latest_time)
+            self.last_latest_time = now
+        else:
+            self.last_latest_time = None  # So the first frame after turning timings on is not counted
+
+        self.frames_shown += 1
+        if self.max_frames is not None and self.frames_shown > self.max_frames:
+            self.finished = True
+        elif not self.threaded:
+            self.process_next()
+        with self.lock:
+            fresh = self.newest_unread
+            self.newest_unread = False
+            frame = self.newest
+        if fresh and timings.enabled:
+            # The game reads its gestures from this frame straight away
+            timings.count("capture_to_gesture_ms", (self.now() - frame.capture_time) * 1000)
+        self.event_calls = 0
+        if self.recorder is not None:
+            self.recorder.next_frame(self.now(), frame)
+        return frame
+
+    # Use this instead of pygame.event.get() so clicks and key presses are recorded and replayed too
+    def events(self):
+        call = self.event_calls
+        self.event_calls += 1
+        if self.replay is not None:
+            # Recorded input only, but the window can still be closed
+            events = self.replay.frame_events(call)
+            live = pygame.event.get()
+            # The profiler keys work during a replay too, recorded ones are ignored by it
+            profiler.handle_events(live)
+            events += [event for event in live if event.type == pygame.QUIT]
+        else:
+            events = pygame.event.get()
+            profiler.handle_events(events)
+            # A source can deliver input of its own, e.g. a clinic station playing back a recording
+            if hasattr(self.cap, "take_events"):
+                events = self.cap.take_events() + events
+        if self.recorder is not None:
+            self.recorder.add_events(call, events)
+        return events
+
+    # BGR copy of a frame's image for cv2.imshow(), in a buffer that is reused every frame
+    def preview(self, image):
+        return self.buffers.to_bgr(image)
+
+    # Game time in seconds. During a replay this is the recorded time of the current frame.
+    def now(self):
+        if self.replay is not None:
+            return self.replay.clock()
+        return time.perf_counter()
+
+    def queue_depths(self):
+        return {"capture": self.frame_queue.qsize(), "result": int(self.newest_unread)}
+
+    def stats(self):
+        stats = {
+            "frames_captured": self.frames_captured,
+            "frames_processed": self.frames_processed,
+            "capture_dropped": self.capture_dropped,
+            "result_dropped": self.result_dropped,
+            "idle_skipped": self.idle_skipped,
+            "idle_seconds": self.idle_time + (time.perf_counter() - self.idle_since if self.idle_since else 0.0),
+            "queue_depth": self.queue_depths(),
+        }
+        if hasattr(self.hands, "stats"):
+            stats["inference"] = self.hands.stats()
+        if hasattr(self.cap, "stats"):
+            stats["camera"] = self.cap.stats()
+        return stats
+
+    def report(self):
+        stats = self.stats()
+        report = ("Hand pipeline: {frames_captured} captured, {frames_processed} processed, "
+                  "{capture_dropped} dropped before inference, {result_dropped} results never shown, "
+                  "{idle_skipped} skipped while idle ({idle_seconds:.0f} s idle), queue depth {queue_depth}".format(**stats))
+        if hasattr(self.hands, "report"):
+            report += "\n" + self.hands.report()
+        if hasattr(self.cap, "describe"):
+            camera = stats["camera"]
+            report += (f"\n{self.cap.describe()}, {camera['stale_dropped']} stale frames dropped, "
+                       f"{camera['reconnects']} reconnects")
+        return report
+
+    # A camera that can be told to stop (camera_capture.Camera) is told first, so a capture thread
+    # waiting to reconnect wakes up. The camera is only released once no thread reads from it.
+    def stop(self):
+        self.stop_event.set()
+        if hasattr(self.cap, "close"):
+            self.cap.close()
+        for thread in self.threads:
+            thread.join(timeout=5.0)
+        if any(thread.is_alive() for thread in self.threads):
+            print("Hand pipeline: capture thread still running, camera left open")
+        else:
+            self.cap.release()
+        self.threads = []
+        if self.recorder is not None:
+            self.recorder.close()
+
+
+# Camera and hand tracking kept running by launcher.py from one game to the next, so switching
+# games does not reopen the camera or reload the model. There is one model per set of
+# hands_options the games ask for, open_pipeline() hands each game the pipeline with its model.
+# The time from a switch() to the game's first latest() or events() call is recorded as game_switch.
+class WarmPipeline(HandPipeline):
+    def __init__(self, cap):
+        super().__init__(cap, None)
+        self.keep_open = True
+        self.models = {}
+        self.switch_start = None
+        self.switch_times = []  # (game, seconds)
+        self.game = None
+
+    def get_hands(self, hands_options):
+        key = tuple(sorted(hands_options.items()))
+        hands = self.models.get(key)
+        if hands is None:
+            hands = self.models[key] = predict_hands(make_hands(hands_options))
+        return hands
+
+    # Function to mark the start of a switch to another game
+    def switch(self, game):
+        self.game = game
+        self.switch_start = time.perf_counter()
+
+    # Function to hand the pipeline to a game, called by open_pipeline()
+    def attach(self, hands_options, max_frames=None):
+        self.hands = self.get_hands(hands_options)
+        self.max_frames = max_frames
+        self.frames_shown = 0
+        self.finished = False
+        self.last_latest_time = None
+        if not self.threads:
+            self.start()
+        return self
+
+    def game_ready(self):
+        if self.switch_start is None:
+            return
+        seconds = time.perf_counter() - self.switch_start
+        self.switch_start = None
+        self.switch_times.append((self.game, seconds))
+        timings.add("game_switch", seconds)
+
+    def latest(self):
+        self.game_ready()
+        return super().latest()
+
+    def events(self):
+        self.game_ready()
+        return super().events()
+
+    # Function called when a game ends, the camera and models keep running
+    def detach(self):
+        print(self.report())
+
+    def stop(self):
+        super().stop()
+        for hands in self.models.values():
+            if hasattr(hands, "close"):
+                hands.close()
+
+
+# Set by launcher.py, open_pipeline() returns it instead of opening a new pipeline
+warm_pipeline = None
+
+
+# Function to end a game: stops the hand pipeline and closes the windows. A pipeline kept warm by
+# launcher.py stays open for the next game, and so does the pygame window.
+def end_game(pipeline):
+    cv2.destroyAllWindows()
+    if pipeline.keep_open:
+        pipeline.detach()
+        return
+    pipeline.stop()
+    print(pipeline.report())
+    pygame.quit()
+
+
+# Function to make the Mediapipe hand tracker. With NEROFLEX_TARGET_MS=<ms> it is wrapped in
+# AdaptiveHands, which crops to the hands and lowers the resolution and model complexity to keep
+# inference under that many milliseconds (for slower PCs).
+def make_hands(hands_options):
+    import mediapipe as mp
+
+    target_ms = os.environ.get("NEROFLEX_TARGET_MS")
+    if not target_ms:
+        return mp.solutions.hands.Hands(**hands_options)
+
+    from adaptive_hands import AdaptiveHands
+
+    def make_model(complexity):
+        return mp.solutions.hands.Hands(**dict(hands_options, model_complexity=complexity))
+
+    return AdaptiveHands(make_model, float(target_ms), model_complexity=hands_options.get("model_complexity", 1),
+                         max_num_hands=hands_options.get("max_num_hands", 2))
+
+
+# Function to only run the hand tracker every few frames and predict the landmarks in between.
+# Turned on with NEROFLEX_INFER_EVERY=<n>, NEROFLEX_MOTION_BUDGET=<distance> (normalized image
+# units, 0.03 by default) runs it sooner when the hands move fast.
+def predict_hands(hands, truth=None):
+    every = os.environ.get("NEROFLEX_INFER_EVERY")
+    if not every:
+        return hands
+
+    from predicted_hands import PredictingHands
+
+    motion_budget = float(os.environ.get("NEROFLEX_MOTION_BUDGET", 0.03))
+    return PredictingHands(hands, int(every), motion_budget, truth=truth)
+
+
+# Function to open the hand tracking pipeline for a game.
+# Set NEROFLEX_RECORD=<file> to record the session or NEROFLEX_REPLAY=<file> to play one back
+# without a camera or Mediapipe model. NEROFLEX_REPLAY_MODEL=1 still runs the model on the
+# replayed frames (for timing only) and NEROFLEX_MAX_FRAMES=<n> ends the game after n frames.
+# NEROFLEX_STATION is set by clinic_server.py for the games it starts.
+# NEROFLEX_SHM=<camera number or recorded session> runs the camera and Mediapipe in a separate
+# process that shares the results through shared memory (see landmark_ring.py), it can be
+# recorded with NEROFLEX_RECORD too.
+# The camera is NEROFLEX_CAMERA=<n> (the first one by default) in the NEROFLEX_CAMERA_MODE format
+# (see camera_capture.py). hands_options are passed to mp.solutions.hands.Hands().
+def open_pipeline(**hands_options):
+    from camera_capture import open_camera
+    from landmark_replay import LandmarkReplay
+
+    max_frames = os.environ.get("NEROFLEX_MAX_FRAMES")
+    max_frames = int(max_frames) if max_frames else None
+
+    # Started from launcher.py, which keeps the camera and model running between games
+    if warm_pipeline is not None:
+        return warm_pipeline.attach(hands_options, max_frames)
+
+    # Game session of a clinic server, which runs the camera and Mediapipe for it
+    station = os.environ.get("NEROFLEX_STATION")
+    if station:
+        from clinic_server import StationClient
+
+        client = StationClient(station, bytes.fromhex(os.environ["NEROFLEX_STATION_KEY"]))
+        return HandPipeline(client, client, max_frames=max_frames, prepared=True).start()
+
+    # Inference in its own process, so it does not compete with the game for the GIL
+    shm_source = os.environ.get("NEROFLEX_SHM")
+    if shm_source:
+        from landmark_ring import THUMBNAIL_SIZE, open_shm_pipeline
+
+        # The game only gets thumbnails of the camera frames, so that is the recorded frame size
+        return open_shm_pipeline(shm_source, hands_options, max_frames=max_frames,
+                                 recorder=open_recorder(THUMBNAIL_SIZE))
+
+    replay_path = os.environ.get("NEROFLEX_REPLAY")
+    if replay_path:
+        model = None
+        if os.environ.get("NEROFLEX_REPLAY_MODEL"):
+            model = make_hands(hands_options)
+        replay = LandmarkReplay(replay_path, model=model)
+        random.seed(replay.seed)
+        hands = predict_hands(replay, truth=replay.recorded)
+        return HandPipeline(replay, hands, threaded=False, replay=replay, max_frames=max_frames).start()
+
+    cap = open_camera()
+    hands = predict_hands(make_hands(hands_options))
+    recorder = open_recorder((int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))))
+    return HandPipeline(cap, hands, recorder=recorder, max_frames=max_frames).start()
+
+
+# Function to start recording the session when NEROFLEX_RECORD=<file> is set, or None. The game's
+# random numbers get a new seed that goes into the recording, so a replay deals the same targets.
+def open_recorder(frame_size):
+    record_path = os.environ.get("NEROFLEX_RECORD")
+    if not record_path:
+        return None
+    from landmark_replay import LandmarkRecorder
+
+    seed = random.randrange(2 ** 63)
+    random.seed(seed)
+    return LandmarkRecorder(record_path, seed, frame_size)
@@ -0,0 +1,65 @@
+from collections import OrderedDict
+
+import pygame
+
+# Fonts by size, each font file is only loaded once
+fonts = {}
+
+
+def get_font(size):
+    font = fonts.get(size)
+    if font is None:
+        font = fonts[size] = pygame.font.Font(None, size)
+    return font
+
+
+# Rendered text surfaces by (text, size, color). When full, the least recently used one is dropped.
+class TextCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, text, size, color):
+        key = (text, size, color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = get_font(size).render(text, True, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_entries:
+            self.surfaces.popitem(last=False)
+        return surface
+
+
+text_cache = TextCache()
+
+
+# Function to get a rendered text surface from the shared cache
+def render_text(text, size, color):
+    return text_cache.render(text, size, color)
+
+
+# A HUD line like "Score: 3" that is only rendered again when its value changes
+class HudLabel:
+    def __init__(self, template, size, color, position):
+        self.template = template
+        self.size = size
+        self.color = color
+        self.position = position
+        self.value = None
+        self.surface = None
+        self.rect = None  # Screen area covered the last time it was drawn
+        self.changed = True
+
+    def update(self, value):
+        self.changed = self.surface is None or value != self.value
+        if self.changed:
+            self.value = value
+            self.surface = render_text(self.template.format(value), self.size, self.color)
+        return self.changed
@@ -0,0 +1,35 @@
+import pygame
+
+# Frame rate of start and game over screens, they only wait for a click
+MENU_FPS = 10
+
+# Hand tracking rate on those screens, enough to keep the camera preview moving
+IDLE_INFERENCE_FPS = 2
+
+
+# Runs the game loop, capture and inference at full rate while the game is played, and slows
+# them down on start and game over screens, where the landmarks are not used.
+# Call update(playing) every frame and tick() at the end of it instead of clock.tick(fps).
+# Back to playing, the next camera frame goes straight through the model again. This works the
+# same for every pipeline, including inference in another process (NEROFLEX_SHM) or on a clinic
+# server, and the time spent idle is in the pipeline's report.
+# Replays keep the full rate on every screen, so recorded sessions time the same as before.
+class IdleScheduler:
+    def __init__(self, pipeline, fps, menu_fps=MENU_FPS, idle_inference_fps=IDLE_INFERENCE_FPS):
+        self.pipeline = pipeline
+        self.clock = pygame.time.Clock()
+        self.fps = fps
+        self.replay = pipeline.replay is not None
+        self.menu_fps = fps if self.replay else menu_fps
+        self.idle_inference_fps = idle_inference_fps
+        self.playing = None
+
+    def update(self, playing):
+        if playing == self.playing:
+            return
+        self.playing = playing
+        if not self.replay:
+            self.pipeline.set_idle(None if playing else self.idle_inference_fps)
+
+    def tick(self):
+        return self.clock.tick(self.fps if self.playing else self.menu_fps)
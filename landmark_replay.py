@@ -0,0 +1,234 @@
+import struct
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pygame
+from mediapipe.framework.formats import classification_pb2, landmark_pb2
+
+from gestures import HAND_LABELS, NUM_LANDMARKS, hands_to_array
+from hand_pipeline import NO_HANDS
+
+# Recording file layout (little endian):
+#   header: magic, version, random seed, camera frame width and height
+#   frame:  game time in seconds (time.perf_counter), capture time of the camera frame the game
+#           used, camera frame id, hand count, event count
+#           then per hand: handedness (0 left, 1 right), handedness score, 21 x (x, y, z) float32
+#           then per event: event call number in the frame, pygame event type, button or key, x, y
+HEADER = struct.Struct("<4sHQHH")
+FRAME = struct.Struct("<ddiBI")
+HAND = struct.Struct("<Bf")
+EVENT = struct.Struct("<IIihh")
+MAGIC = b"NFLM"
+VERSION = 2
+# Version 1 frames had no capture time, the game time stands in for it
+FRAME_V1 = struct.Struct("<diBI")
+
+LANDMARK_BYTES = NUM_LANDMARKS * 3 * 4
+
+# Frame id written for events that happen before the first camera frame (e.g. a start screen)
+PRELUDE_FRAME = -2
+
+# Only the events the games react to are recorded
+RECORDED_EVENTS = (pygame.QUIT, pygame.MOUSEBUTTONDOWN, pygame.KEYDOWN)
+
+
+# Function to turn a Mediapipe result into (hands, 21, 3) landmarks, handedness and scores arrays
+def results_to_arrays(results):
+    landmarks = hands_to_array(results.multi_hand_landmarks)
+    labels = np.zeros(len(landmarks), dtype=np.uint8)
+    scores = np.zeros(len(landmarks), dtype=np.float32)
+    for i, handedness in enumerate((results.multi_handedness or [])[:len(landmarks)]):
+        classification = handedness.classification[0]
+        labels[i] = HAND_LABELS.index(classification.label)
+        scores[i] = classification.score
+    return landmarks, labels, scores
+
+
+# Function to build a Mediapipe style result from landmarks, handedness and scores arrays
+def results_from_arrays(landmarks, labels, scores):
+    if len(landmarks) == 0:
+        return NO_HANDS
+
+    hand_list = []
+    handedness_list = []
+    for hand, label, score in zip(landmarks, labels, scores):
+        hand_landmarks = landmark_pb2.NormalizedLandmarkList()
+        for x, y, z in hand.tolist():
+            hand_landmarks.landmark.add(x=x, y=y, z=z)
+        hand_list.append(hand_landmarks)
+
+        handedness = classification_pb2.ClassificationList()
+        handedness.classification.add(index=int(label), score=float(score), label=HAND_LABELS[label])
+        handedness_list.append(handedness)
+    return SimpleNamespace(multi_hand_landmarks=hand_list, multi_handedness=handedness_list)
+
+
+# Function to turn a recorded event back into a pygame event
+def recorded_event(event_type, code, x, y):
+    if event_type == pygame.MOUSEBUTTONDOWN:
+        return pygame.event.Event(event_type, button=code, pos=(x, y))
+    if event_type == pygame.KEYDOWN:
+        return pygame.event.Event(event_type, key=code)
+    return pygame.event.Event(event_type)
+
+
+# Writes the hand landmarks and input events the game used on each frame
+class LandmarkRecorder:
+    def __init__(self, path, seed, frame_size):
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, seed, *frame_size))
+        self.pending = (0.0, 0.0, PRELUDE_FRAME, NO_HANDS)
+        self.pending_events = []
+
+    def add_events(self, call, events):
+        for event in events:
+            if event.type not in RECORDED_EVENTS:
+                continue
+            code = getattr(event, "button", getattr(event, "key", 0))
+            x, y = getattr(event, "pos", (0, 0))
+            self.pending_events.append(EVENT.pack(call, event.type, code, x, y))
+
+    # Called once per game frame, the frame is written when the next one starts so its events are included
+    def next_frame(self, timestamp, frame):
+        self.write_pending()
+        self.pending = (timestamp, frame.capture_time, frame.frame_id, frame.results)
+
+    def write_pending(self):
+        timestamp, capture_time, frame_id, results = self.pending
+        if frame_id == PRELUDE_FRAME and not self.pending_events:
+            return
+
+        landmarks, labels, scores = results_to_arrays(results)
+        self.file.write(FRAME.pack(timestamp, capture_time, frame_id, len(landmarks), len(self.pending_events)))
+        for hand, label, score in zip(landmarks, labels, scores):
+            self.file.write(HAND.pack(label, score))
+            self.file.write(hand.astype("<f4").tobytes())
+        self.file.write(b"".join(self.pending_events))
+        self.pending_events = []
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.write_pending()
+        self.file.close()
+
+
+# Plays a recording back in place of both the camera and Mediapipe Hands.
+# read() moves to the next recorded frame and process() returns its landmarks.
+# If a model is given it is run on every frame as well, only so its cost can be measured.
+class LandmarkReplay:
+    def __init__(self, path, model=None):
+        self.model = model
+        with open(path, "rb") as f:
+            data = f.read()
+
+        magic, version, self.seed, width, height = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version not in (1, VERSION):
+            raise ValueError(f"{path} is not a landmark recording")
+        self.frame_size = (width, height)
+        self.blank = np.zeros((height, width, 3), dtype=np.uint8)
+
+        self.timestamps = []
+        self.capture_times = []
+        self.frame_ids = []
+        self.results = []
+        self.events = []
+        self.prelude_events = []
+
+        offset = HEADER.size
+        while offset < len(data):
+            if version == 1:
+                timestamp, frame_id, hand_count, event_count = FRAME_V1.unpack_from(data, offset)
+                capture_time = timestamp
+                offset += FRAME_V1.size
+            else:
+                timestamp, capture_time, frame_id, hand_count, event_count = FRAME.unpack_from(data, offset)
+                offset += FRAME.size
+
+            landmarks = np.zeros((hand_count, NUM_LANDMARKS, 3), dtype=np.float32)
+            labels = np.zeros(hand_count, dtype=np.uint8)
+            scores = np.zeros(hand_count, dtype=np.float32)
+            for i in range(hand_count):
+                labels[i], scores[i] = HAND.unpack_from(data, offset)
+                offset += HAND.size
+                landmarks[i] = np.frombuffer(data, dtype="<f4", count=NUM_LANDMARKS * 3, offset=offset).reshape(NUM_LANDMARKS, 3)
+                offset += LANDMARK_BYTES
+
+            frame_events = []
+            for _ in range(event_count):
+                frame_events.append(EVENT.unpack_from(data, offset))
+                offset += EVENT.size
+
+            if frame_id == PRELUDE_FRAME:
+                self.prelude_events = frame_events
+                continue
+            self.timestamps.append(timestamp)
+            self.capture_times.append(capture_time)
+            self.frame_ids.append(frame_id)
+            self.results.append(results_from_arrays(landmarks, labels, scores))
+            self.events.append(frame_events)
+
+        self.index = -1
+
+    def __len__(self):
+        return len(self.results)
+
+    # image is the buffer a camera would fill, the blank frame is returned instead
+    def read(self, image=None):
+        if self.index + 1 >= len(self.results):
+            return False, None
+        self.index += 1
+        return True, self.blank
+
+    def process(self, image):
+        if self.model is not None:
+            self.model.process(image)
+        return self.results[self.index]
+
+    # Recorded result of the current frame, without running the model
+    def recorded(self):
+        return self.results[self.index]
+
+    # Frame id and capture time of the camera frame the game used on the current frame
+    def recorded_frame(self):
+        return self.frame_ids[self.index], self.capture_times[self.index]
+
+    def stats(self):
+        if hasattr(self.model, "stats"):
+            return self.model.stats()
+        return {}
+
+    def report(self):
+        if hasattr(self.model, "report"):
+            return self.model.report()
+        return "Replay: {} recorded frames".format(len(self.results))
+
+    # Game time of the current frame
+    def clock(self):
+        if not self.timestamps:
+            return 0.0
+        return self.timestamps[max(self.index, 0)]
+
+    # Recorded pygame events for the given event call of the current frame
+    def frame_events(self, call):
+        frame_events = self.prelude_events if self.index < 0 else self.events[self.index]
+        return [recorded_event(event_type, code, x, y)
+                for event_call, event_type, code, x, y in frame_events if event_call == call]
+
+    def release(self):
+        pass
+
+
+# Function to call step() once per recorded frame at the pace the frames were recorded,
+# for feeding a replay to something that runs in real time. Stops early once stopped() is true.
+def play_at_recorded_pace(replay, step, stopped):
+    timestamps = replay.timestamps
+    start = time.perf_counter()
+    for timestamp in timestamps:
+        delay = start + (timestamp - timestamps[0]) - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        if stopped():
+            break
+        step()
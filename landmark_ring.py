@@ -0,0 +1,238 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+from camera_capture import open_camera
+from hand_pipeline import HandFrame, HandPipeline, make_hands, predict_hands
+from landmark_replay import LandmarkReplay, play_at_recorded_pace, results_from_arrays, results_to_arrays
+from stage_timer import timings
+
+MAGIC = b"NFRB"
+VERSION = 2
+MAX_HANDS = 2
+THUMBNAIL_SIZE = (160, 120)
+
+# Fixed binary layout of the shared memory: one header, then `slots` entries.
+# The header says how many entries were written and whether the writer has stopped, and the
+# reader sets the hand tracking rate it wants while idle (negative for full rate).
+HEADER = np.dtype([
+    ("magic", "S4"),
+    ("version", "<u4"),
+    ("slots", "<u4"),
+    ("closed", "<u4"),
+    ("written", "<i8"),
+    ("idle_fps", "<f8"),
+], align=True)
+
+# Each entry has a sequence number that is odd while the writer is changing the entry, and
+# the thumbnail is a small copy of the camera picture for the game's preview
+SLOT = np.dtype([
+    ("sequence", "<u8"),
+    ("frame_id", "<i8"),
+    ("capture_time", "<f8"),
+    ("hand_count", "<u4"),
+    ("labels", "u1", (MAX_HANDS,)),
+    ("scores", "<f4", (MAX_HANDS,)),
+    ("landmarks", "<f4", (MAX_HANDS, 21, 3)),
+    ("thumbnail", "u1", (THUMBNAIL_SIZE[1], THUMBNAIL_SIZE[0], 3)),
+], align=True)
+
+
+# Hand tracking results in shared memory, written by one process and read by another without
+# locks, pickling or pipes. The writer fills the entries in turn and the reader takes the newest.
+# Every entry is guarded by its sequence number (a seqlock): the reader copies the landmarks out
+# and tries again if the sequence number was odd or changed meanwhile, so it never gets half a write.
+# The thumbnail is not copied, it stays valid until the writer comes round to that entry again.
+# Use LandmarkRing.create() in one process and LandmarkRing(name) to attach in the other.
+class LandmarkRing:
+    def __init__(self, name, memory=None):
+        if memory is None:
+            memory = shared_memory.SharedMemory(name)
+            # Only the process that created it removes it, not the tracker of this one
+            resource_tracker.unregister(memory._name, "shared_memory")
+        self.memory = memory
+        self.name = memory.name
+        self.header = np.ndarray((), dtype=HEADER, buffer=memory.buf)
+        if bytes(self.header["magic"]) != MAGIC or int(self.header["version"]) != VERSION:
+            raise ValueError(f"{name} is not a landmark ring")
+
+        slots = np.ndarray((int(self.header["slots"]),), dtype=SLOT, buffer=memory.buf, offset=HEADER.itemsize)
+        self.slots = slots
+        self.sequence = slots["sequence"]
+        self.frame_id = slots["frame_id"]
+        self.capture_time = slots["capture_time"]
+        self.hand_count = slots["hand_count"]
+        self.labels = slots["labels"]
+        self.scores = slots["scores"]
+        self.landmarks = slots["landmarks"]
+        self.thumbnail = slots["thumbnail"]
+        self.owner = False
+
+    @classmethod
+    def create(cls, slots=8):
+        memory = shared_memory.SharedMemory(create=True, size=HEADER.itemsize + slots * SLOT.itemsize)
+        header = np.ndarray((), dtype=HEADER, buffer=memory.buf)
+        header["magic"] = MAGIC
+        header["version"] = VERSION
+        header["slots"] = slots
+        header["closed"] = 0
+        header["written"] = 0
+        header["idle_fps"] = -1.0
+        ring = cls(memory.name, memory)
+        ring.sequence[:] = 0
+        ring.owner = True
+        return ring
+
+    @property
+    def closed(self):
+        return bool(self.header["closed"])
+
+    # Function to write a processed HandFrame, it can be passed to HandPipeline as on_result
+    def write_frame(self, frame):
+        landmarks, labels, scores = results_to_arrays(frame.results)
+        written = int(self.header["written"])
+        index = written % len(self.slots)
+        count = min(len(landmarks), MAX_HANDS)
+
+        self.sequence[index] += 1
+        self.frame_id[index] = frame.frame_id
+        self.capture_time[index] = frame.capture_time
+        self.hand_count[index] = count
+        self.labels[index, :count] = labels[:count]
+        self.scores[index, :count] = scores[:count]
+        self.landmarks[index, :count] = landmarks[:count]
+        if frame.image is not None:
+            cv2.resize(frame.image, THUMBNAIL_SIZE, dst=self.thumbnail[index], interpolation=cv2.INTER_LINEAR)
+        self.sequence[index] += 1
+        self.header["written"] = written + 1
+
+    # Newest entry as (frame_id, capture_time, thumbnail, landmarks, labels, scores), or None if
+    # nothing was written yet or the writer kept changing the entry while it was read
+    def read_latest(self, attempts=3):
+        for _ in range(attempts):
+            written = int(self.header["written"])
+            if written == 0:
+                return None
+            index = (written - 1) % len(self.slots)
+            sequence = int(self.sequence[index])
+            if sequence % 2:
+                continue
+            count = int(self.hand_count[index])
+            entry = (int(self.frame_id[index]), float(self.capture_time[index]), self.thumbnail[index],
+                     self.landmarks[index, :count].copy(), self.labels[index, :count].copy(),
+                     self.scores[index, :count].copy())
+            if int(self.sequence[index]) == sequence:
+                return entry
+        return None
+
+    # Function for the reader to ask for idle_fps tracked frames a second, or full rate with None
+    def set_idle(self, idle_fps):
+        self.header["idle_fps"] = -1.0 if idle_fps is None else idle_fps
+
+    def idle_fps(self):
+        idle_fps = float(self.header["idle_fps"])
+        return None if idle_fps < 0 else idle_fps
+
+    def close(self):
+        self.header["closed"] = 1
+
+    # Function to let go of the shared memory, the process that created it also removes it
+    def release(self):
+        self.header = self.slots = None
+        self.sequence = self.frame_id = self.capture_time = self.hand_count = None
+        self.labels = self.scores = self.landmarks = self.thumbnail = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+# Function run by the inference process: camera and Mediapipe (or a recorded session played
+# back at its recorded pace) in their own interpreter, writing every result into the ring.
+# It follows the idle rate the game sets in the ring, and stops when its stdin is closed,
+# which also happens when the game process dies.
+def inference_process(ring_name, source, hands_options):
+    stop_event = threading.Event()
+
+    def wait_for_stop():
+        sys.stdin.read()
+        stop_event.set()
+
+    threading.Thread(target=wait_for_stop, name="wait-for-stop", daemon=True).start()
+    ring = LandmarkRing(ring_name)
+    if source.isdigit():
+        pipeline = HandPipeline(open_camera(int(source)), predict_hands(make_hands(hands_options)),
+                                on_result=ring.write_frame).start()
+        while not stop_event.wait(0.02) and not pipeline.finished:
+            pipeline.set_idle(ring.idle_fps())
+    else:
+        replay = LandmarkReplay(source)
+        pipeline = HandPipeline(replay, replay, threaded=False, on_result=ring.write_frame)
+
+        def step():
+            pipeline.set_idle(ring.idle_fps())
+            pipeline.process_next()
+
+        play_at_recorded_pace(replay, step, stop_event.is_set)
+    pipeline.stop()
+    ring.close()
+    ring.release()
+
+
+# Game side of the inference process, with the same latest(), events() and now() as HandPipeline.
+# Every latest() reads the newest entry of the ring, frames the game never saw count as dropped.
+class ShmPipeline(HandPipeline):
+    def __init__(self, ring, process, max_frames=None, recorder=None):
+        super().__init__(None, None, threaded=False, recorder=recorder, max_frames=max_frames)
+        self.ring = ring
+        self.process = process
+
+    def process_next(self):
+        entry = self.ring.read_latest()
+        if entry is None or entry[0] == self.newest.frame_id:
+            if self.ring.closed or self.process.poll() is not None:
+                self.finished = True
+            return
+
+        frame_id, capture_time, thumbnail, landmarks, labels, scores = entry
+        if self.newest.frame_id >= 0:
+            self.result_dropped += max(0, frame_id - self.newest.frame_id - 1)
+        self.frames_captured = self.frames_processed = frame_id + 1
+        timings.count("shm_age_ms", (time.perf_counter() - capture_time) * 1000)
+        with self.lock:
+            self.newest = HandFrame(frame_id, capture_time, thumbnail, results_from_arrays(landmarks, labels, scores))
+
+    # The inference process does the tracking, so it is the one that slows down
+    def set_idle(self, idle_fps):
+        super().set_idle(idle_fps)
+        self.ring.set_idle(idle_fps)
+
+    def stop(self):
+        self.process.stdin.close()
+        try:
+            self.process.wait(timeout=2.0)
+        except subprocess.TimeoutExpired:
+            self.process.terminate()
+        self.ring.release()
+        if self.recorder is not None:
+            self.recorder.close()
+
+
+# Function to start the inference process for a game. source is a camera number or a recorded session.
+# It is started as a script of its own, because the games run at import and a multiprocessing
+# child would start the game again. A LandmarkRecorder given as recorder records the session.
+def open_shm_pipeline(source, hands_options, max_frames=None, recorder=None):
+    ring = LandmarkRing.create()
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), ring.name, source, json.dumps(hands_options)],
+                               stdin=subprocess.PIPE)
+    return ShmPipeline(ring, process, max_frames=max_frames, recorder=recorder)
+
+
+if __name__ == "__main__":
+    inference_process(sys.argv[1], sys.argv[2], json.loads(sys.argv[3]))
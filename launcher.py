@@ -0,0 +1,165 @@
+import argparse
+import os
+import runpy
+import threading
+import time
+
+import pygame
+
+from hud_text import render_text
+from idle_scheduler import MENU_FPS
+
+START = time.perf_counter()
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SCREEN_WIDTH = 800
+SCREEN_HEIGHT = 600
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+GRAY = (128, 128, 128)
+BUTTON_COLOR = (0, 128, 255)
+
+# Games on the menu as (script, title)
+GAMES = (("game1", "Pop the Lock"), ("game2", "Taco Eating Game"), ("game3", "Asteroids Therapy Game"))
+BUTTON_WIDTH = 400
+BUTTON_HEIGHT = 70
+
+
+# Loads OpenCV and Mediapipe, opens the camera and builds the hand models on a thread of its own,
+# so the menu is up straight away. Each game then gets the running pipeline from open_pipeline().
+class WarmUp:
+    def __init__(self, camera):
+        self.camera = camera
+        self.pipeline = None
+        self.ready_time = None  # Seconds from the start of the launcher
+        self.thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        import hand_pipeline
+        from camera_capture import open_camera
+
+        pipeline = hand_pipeline.WarmPipeline(open_camera(self.camera))
+        for hands_options in hand_pipeline.GAME_HANDS_OPTIONS.values():
+            pipeline.get_hands(hands_options)
+        # Hand tracking is paused on the menu, the camera keeps running
+        pipeline.set_idle(0)
+        pipeline.attach(hand_pipeline.GAME_HANDS_OPTIONS["game1"])
+        hand_pipeline.warm_pipeline = pipeline
+        self.pipeline = pipeline
+        self.ready_time = time.perf_counter() - START
+
+    def wait(self):
+        self.thread.join()
+        return self.pipeline
+
+
+# Button of each game on the menu
+def button_rects():
+    top = 180
+    return [pygame.Rect(SCREEN_WIDTH // 2 - BUTTON_WIDTH // 2, top + i * (BUTTON_HEIGHT + 30), BUTTON_WIDTH, BUTTON_HEIGHT)
+            for i in range(len(GAMES))]
+
+
+# Function to draw the menu with the loading state and the last game switch times
+def draw_menu(screen, warm_up, switch_times):
+    screen.fill(WHITE)
+    title = render_text("NeroFlex Adventures", 60, BLACK)
+    screen.blit(title, (SCREEN_WIDTH // 2 - title.get_width() // 2, 70))
+    for i, ((_, name), rect) in enumerate(zip(GAMES, button_rects())):
+        pygame.draw.rect(screen, BUTTON_COLOR, rect)
+        text = render_text(f"{i + 1}. {name}", 36, WHITE)
+        screen.blit(text, (rect.centerx - text.get_width() // 2, rect.centery - text.get_height() // 2))
+
+    if warm_up.pipeline is None:
+        status = "Starting the camera and hand tracking..."
+    else:
+        status = f"Camera and hand tracking ready in {warm_up.ready_time:.1f} s"
+    if switch_times:
+        game, seconds = switch_times[-1]
+        status += f", {game} started in {seconds * 1000:.0f} ms"
+    text = render_text(status, 24, GRAY)
+    screen.blit(text, (SCREEN_WIDTH // 2 - text.get_width() // 2, SCREEN_HEIGHT - 50))
+    pygame.display.flip()
+
+
+def open_menu():
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("NeroFlex Adventures")
+    return screen
+
+
+# Function to run a game in this process with the warm pipeline. Returns False when the game
+# asked to close the whole program (sys.exit()).
+def run_game(warm_up, game):
+    pipeline = warm_up.wait()
+    pipeline.switch(game)
+    try:
+        runpy.run_path(os.path.join(HERE, f"{game}.py"), run_name="__main__")
+    except SystemExit:
+        return False
+    finally:
+        pipeline.set_idle(0)
+    return True
+
+
+def report(menu_time, warm_up):
+    print(f"Startup: menu shown after {menu_time:.2f} s, "
+          f"camera and hand tracking ready after {warm_up.ready_time:.2f} s")
+    for game, seconds in warm_up.pipeline.switch_times:
+        print(f"Switch to {game}: {seconds * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Menu for the games that keeps the camera and hand tracking running")
+    parser.add_argument("--camera", type=int, help="camera number (NEROFLEX_CAMERA or the first camera by default)")
+    parser.add_argument("--play", nargs="+", choices=[game for game, _ in GAMES],
+                        help="play these games one after the other and exit, without the menu")
+    args = parser.parse_args()
+
+    from stage_timer import timings
+
+    pygame.init()
+    warm_up = WarmUp(args.camera)
+    screen = open_menu()
+    switch_times = []
+    draw_menu(screen, warm_up, switch_times)
+    menu_time = time.perf_counter() - START
+    timings.add("startup_menu", menu_time)
+
+    if args.play:
+        for game in args.play:
+            if not run_game(warm_up, game):
+                break
+    else:
+        clock = pygame.time.Clock()
+        running = True
+        while running:
+            choice = None
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                    for (game, _), rect in zip(GAMES, button_rects()):
+                        if rect.collidepoint(event.pos):
+                            choice = game
+                if event.type == pygame.KEYDOWN and pygame.K_1 <= event.key < pygame.K_1 + len(GAMES):
+                    choice = GAMES[event.key - pygame.K_1][0]
+
+            if choice is not None:
+                if not run_game(warm_up, choice):
+                    break
+                switch_times = warm_up.pipeline.switch_times
+                screen = open_menu()
+            draw_menu(screen, warm_up, switch_times)
+            clock.tick(MENU_FPS)
+
+    pipeline = warm_up.wait()
+    timings.add("startup_ready", warm_up.ready_time)
+    report(menu_time, warm_up)
+    pipeline.stop()
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import cProfile
+import collections
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+
+import numpy as np
+import pygame
+
+from hud_text import get_font
+from stage_timer import timings
+
+OVERLAY_KEY = pygame.K_F3  # Show or hide the overlay
+PROFILE_KEY = pygame.K_F4  # Profile the next PROFILE_SECONDS seconds
+PROFILE_SECONDS = 5.0
+SAMPLE_INTERVAL = 0.005  # Seconds between stack samples of every thread while profiling
+
+# Overlay lines as (label, stages added together). The gesture stage has a different name in each game.
+OVERLAY_STAGES = (
+    ("gesture", ("is_fist", "process_wrist_movement", "detect_thumb_movement")),
+    ("sim", ("simulation",)),
+    ("draw", ("draw", "draw_hud", "preview")),
+    ("flip", ("display_flip",)),
+)
+
+PANEL_SIZE = (300, 130)
+FONT_SIZE = 20
+GRAPH_HEIGHT = 50
+GRAPH_MAX_MS = 50.0
+PANEL_COLOR = (20, 20, 20)
+TEXT_COLOR = (230, 230, 230)
+GRAPH_COLOR = (0, 200, 0)
+SLOW_COLOR = (220, 60, 60)
+GUIDE_COLOR = (90, 90, 90)
+
+
+# Profiles the game for a few seconds: cProfile on the game loop's thread, plus stack samples of
+# every thread (camera, inference, telemetry...) which cProfile does not see. Writes a .prof file
+# for pstats or snakeviz and a .folded file of the samples for flame graph tools, and prints the
+# slowest functions.
+class ProfileSnapshot:
+    def __init__(self, seconds, path):
+        self.path = path
+        self.end = time.perf_counter() + seconds
+        self.stacks = collections.Counter()
+        self.stop_event = threading.Event()
+        self.sampler = threading.Thread(target=self.sample_loop, name="profile-sampler", daemon=True)
+        self.sampler.start()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def sample_loop(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(SAMPLE_INTERVAL):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def done(self):
+        return time.perf_counter() >= self.end
+
+    def finish(self):
+        self.profile.disable()
+        self.stop_event.set()
+        self.sampler.join()
+
+        self.profile.dump_stats(self.path + ".prof")
+        with open(self.path + ".folded", "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        report = io.StringIO()
+        pstats.Stats(self.profile, stream=report).sort_stats("cumulative").print_stats(15)
+        print(report.getvalue())
+        print(f"Profile written to {self.path}.prof and {self.path}.folded "
+              f"({sum(self.stacks.values())} stack samples)")
+
+
+# In-game profiler: F3 shows an overlay with the frame rate, a graph of the last frame times, the
+# hand tracking latency and the time of each loop stage, F4 takes a ProfileSnapshot. The stage
+# timings are only collected while the overlay is shown (or NEROFLEX_TIMINGS records them), so
+# with the overlay hidden the games run as if it was not there.
+# NEROFLEX_OVERLAY=1 shows it from the start, NEROFLEX_PROFILE_DIR=<directory> is where snapshots go.
+# The game passes its events to handle_events() and calls draw() before presenting each frame.
+class LiveProfiler:
+    def __init__(self, visible=False, refresh=0.25):
+        self.visible = False
+        self.refresh = refresh  # Seconds between redraws of the panel
+        self.surface = None
+        self.rect = None  # Where the panel was drawn last frame
+        self.last_refresh = 0.0
+        self.snapshot = None
+        self.set_visible(visible)
+
+    def set_visible(self, visible):
+        self.visible = visible
+        timings.set_live(visible)
+        self.surface = None
+
+    def handle_events(self, events):
+        for event in events:
+            if event.type != pygame.KEYDOWN:
+                continue
+            if event.key == OVERLAY_KEY:
+                self.set_visible(not self.visible)
+            elif event.key == PROFILE_KEY and self.snapshot is None:
+                self.start_snapshot()
+        if self.snapshot is not None and self.snapshot.done():
+            self.snapshot.finish()
+            self.snapshot = None
+            self.surface = None
+
+    def start_snapshot(self):
+        directory = os.environ.get("NEROFLEX_PROFILE_DIR", ".")
+        os.makedirs(directory, exist_ok=True)
+        game = os.path.splitext(os.path.basename(sys.argv[0]))[0] or "game"
+        path = os.path.join(directory, f"profile-{game}-{time.strftime('%Y%m%d-%H%M%S')}")
+        print(f"Profiling for {PROFILE_SECONDS:g} s...")
+        self.snapshot = ProfileSnapshot(PROFILE_SECONDS, path)
+
+    # Function to draw the overlay in the bottom right corner through the DirtyRenderer
+    def draw(self, renderer):
+        if not self.visible:
+            if self.rect is not None:
+                # Take the panel off the screen
+                renderer.invalidate()
+                self.rect = None
+            return
+
+        now = time.perf_counter()
+        changed = self.surface is None or now - self.last_refresh >= self.refresh
+        if changed:
+            self.surface = self.render_panel()
+            self.last_refresh = now
+        screen_rect = renderer.screen_rect
+        position = (screen_rect.width - PANEL_SIZE[0] - 10, screen_rect.height - PANEL_SIZE[1] - 10)
+        self.rect = renderer.draw_overlay(self.surface, position, changed, self.rect)
+
+    # Panel text changes on every refresh, so it is rendered directly rather than filling the shared text cache
+    def text(self, panel, text, position, color=TEXT_COLOR):
+        panel.blit(get_font(FONT_SIZE).render(text, True, color), position)
+
+    def render_panel(self):
+        panel = pygame.Surface(PANEL_SIZE).convert()
+        panel.fill(PANEL_COLOR)
+        frame_ms = timings.recent("frame") * 1000
+
+        if len(frame_ms):
+            fps = 1000 / frame_ms.mean()
+            p50, p95 = np.percentile(frame_ms, [50, 95])
+            header = f"{fps:.0f} fps   frame p50 {p50:.1f}  p95 {p95:.1f} ms"
+        else:
+            header = "waiting for frames"
+        self.text(panel, header, (6, 4))
+        self.draw_graph(panel, pygame.Rect(6, 22, PANEL_SIZE[0] - 12, GRAPH_HEIGHT), frame_ms)
+
+        parts = []
+        for label, names in OVERLAY_STAGES:
+            stage_ms = [timings.recent(name).mean() * 1000 for name in names if len(timings.recent(name))]
+            if stage_ms:
+                parts.append(f"{label} {sum(stage_ms):.1f}")
+        y = 22 + GRAPH_HEIGHT + 4
+        self.text(panel, "  ".join(parts) + " ms", (6, y))
+
+        inference = timings.recent("hands_process") * 1000
+        latency = timings.recent("capture_to_gesture_ms")
+        if not len(latency):
+            latency = timings.recent("shm_age_ms")
+        line = f"inference {np.percentile(inference, 50):.1f} ms" if len(inference) else "inference n/a"
+        if len(latency):
+            line += f"   camera to game {np.percentile(latency, 50):.0f}/{np.percentile(latency, 95):.0f} ms"
+        self.text(panel, line, (6, y + 16))
+
+        if self.snapshot is not None:
+            status = f"profiling, {max(0.0, self.snapshot.end - time.perf_counter()):.0f} s left"
+        else:
+            status = "F3 hide   F4 profile 5 s"
+        self.text(panel, status, (6, y + 32), GUIDE_COLOR)
+        return panel
+
+    # Function to draw the frame times as a bar per frame, red above 33 ms (under 30 fps)
+    def draw_graph(self, panel, area, frame_ms):
+        for ms in (1000 / 60, 1000 / 30):
+            y = area.bottom - int(ms / GRAPH_MAX_MS * area.height)
+            pygame.draw.line(panel, GUIDE_COLOR, (area.left, y), (area.right, y))
+        frame_ms = frame_ms[-area.width:]
+        heights = np.minimum(frame_ms / GRAPH_MAX_MS, 1.0) * area.height
+        left = area.right - len(frame_ms)
+        for i, (ms, height) in enumerate(zip(frame_ms.tolist(), heights.tolist())):
+            color = SLOW_COLOR if ms > 1000 / 30 else GRAPH_COLOR
+            pygame.draw.line(panel, color, (left + i, area.bottom), (left + i, area.bottom - int(height)))
+
+
+# Shared profiler of the games
+profiler = LiveProfiler(visible=bool(os.environ.get("NEROFLEX_OVERLAY")))
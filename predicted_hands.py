@@ -0,0 +1,107 @@
+import numpy as np
+
+from landmark_replay import results_from_arrays, results_to_arrays
+from stage_timer import timings
+
+
+# Runs the hand model only every `every` frames, or sooner when the hands are expected to have
+# moved more than motion_budget (normalized image units) since the last detection. It has the same
+# process() as a Hands object, so the gesture checks work on predicted frames like on real ones.
+# Between detections each of the 21 landmarks is moved on at its own velocity (per camera frame).
+# The velocity is updated from every detection with an alpha-beta filter, a Kalman filter with a
+# fixed gain, so one noisy detection does not throw the prediction off.
+# Prediction error is measured in pixels every time a detection follows skipped frames. If truth is
+# given (a function returning the real result of the current frame, e.g. from a replay) it is
+# measured on every skipped frame instead.
+class PredictingHands:
+    def __init__(self, hands, every=2, motion_budget=0.03, velocity_gain=0.5, truth=None):
+        self.hands = hands
+        self.every = every
+        self.motion_budget = motion_budget
+        self.velocity_gain = velocity_gain
+        self.truth = truth
+
+        self.landmarks = np.zeros((0, 21, 3), dtype=np.float32)
+        self.velocity = np.zeros((0, 21, 3), dtype=np.float32)
+        self.labels = np.zeros(0, dtype=np.uint8)
+        self.scores = np.zeros(0, dtype=np.float32)
+        self.frames_since_detection = None
+
+        self.detected = 0
+        self.predicted = 0
+        self.error_count = 0
+        self.error_total = 0.0
+        self.error_max = 0.0
+
+    # True when this frame has to go through the model
+    def should_detect(self, frames_ahead):
+        if self.frames_since_detection is None or frames_ahead >= self.every:
+            return True
+        if len(self.velocity) == 0:
+            return False
+        return np.abs(self.velocity[..., :2]).max() * frames_ahead > self.motion_budget
+
+    def process(self, image):
+        frames_ahead = 1 if self.frames_since_detection is None else self.frames_since_detection + 1
+        if self.should_detect(frames_ahead):
+            results = self.hands.process(image)
+            self.update(results, frames_ahead, image)
+            self.detected += 1
+            return results
+
+        self.frames_since_detection = frames_ahead
+        self.predicted += 1
+        predicted = self.landmarks + self.velocity * frames_ahead
+        if self.truth is not None:
+            self.measure(predicted, results_to_arrays(self.truth())[0], image)
+        return results_from_arrays(predicted, self.labels, self.scores)
+
+    # Function to take a new detection, the velocity only carries over if the same number of hands is seen
+    def update(self, results, frames_ahead, image):
+        landmarks, labels, scores = results_to_arrays(results)
+        landmarks = np.array(landmarks)
+        if len(landmarks) and len(landmarks) == len(self.landmarks):
+            predicted = self.landmarks + self.velocity * frames_ahead
+            if self.truth is None and frames_ahead > 1:
+                self.measure(predicted, landmarks, image)
+            self.velocity += self.velocity_gain * (landmarks - predicted) / frames_ahead
+        else:
+            self.velocity = np.zeros_like(landmarks)
+        self.landmarks, self.labels, self.scores = landmarks, labels, scores
+        self.frames_since_detection = 0
+
+    # Function to record the mean landmark distance in pixels of the worst hand
+    def measure(self, predicted, actual, image):
+        if len(actual) == 0 or len(actual) != len(predicted):
+            return
+        height, width = image.shape[:2]
+        offsets = (predicted[..., :2] - actual[..., :2]) * (width, height)
+        error = float(np.hypot(offsets[..., 0], offsets[..., 1]).mean(axis=1).max())
+        self.error_count += 1
+        self.error_total += error
+        self.error_max = max(self.error_max, error)
+        timings.count("prediction_error_px", error)
+
+    def stats(self):
+        stats = {
+            "detected": self.detected,
+            "predicted": self.predicted,
+            "prediction_error_mean_px": self.error_total / self.error_count if self.error_count else None,
+            "prediction_error_max_px": self.error_max,
+        }
+        if hasattr(self.hands, "stats"):
+            stats["model"] = self.hands.stats()
+        return stats
+
+    def report(self):
+        stats = self.stats()
+        error = stats["prediction_error_mean_px"]
+        report = "Landmark prediction: {} frames detected, {} predicted, error {} px mean, {:.1f} px max".format(
+            self.detected, self.predicted, "n/a" if error is None else "{:.1f}".format(error), self.error_max)
+        if hasattr(self.hands, "report"):
+            report += "\n" + self.hands.report()
+        return report
+
+    def close(self):
+        if hasattr(self.hands, "close"):
+            self.hands.close()
@@ -0,0 +1,193 @@
+import json
+import math
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+MAGIC = b"NFTL"
+VERSION = 1
+
+# File header: magic, version and the length of the JSON metadata that follows it
+HEADER = struct.Struct("<4sHI")
+# Each batch starts with its record count, then holds every column of the batch one after the other
+BATCH = struct.Struct("<I")
+
+# One record per game frame. hits and misses count up over the whole session (gameplay events
+# like tacos eaten or missed), gesture is the value the game reads from the hand that frame.
+RECORD = np.dtype([
+    ("time", "<f8"),  # Game time (pipeline.now()) in seconds
+    ("frame_ms", "<f4"),  # Time since the previous frame
+    ("latency_ms", "<f4"),  # Age of the hand tracking result when the game used it
+    ("frame_id", "<i8"),  # Camera frame the result belongs to
+    ("hands", "u1"),
+    ("confidence", "<f4"),  # Best Mediapipe handedness score, NaN without hands
+    ("gesture", "<f4"),
+    ("playing", "u1"),  # 0 on start and game over screens
+    ("score", "<i4"),
+    ("hits", "<i4"),
+    ("misses", "<i4"),
+    ("x", "<f4"),  # Player position on screen, NaN if the game has none
+    ("y", "<f4"),
+])
+
+
+# Stand-in used when telemetry is turned off, so the games pay almost nothing for it
+class NullTelemetry:
+    def frame(self, now, frame, **values):
+        pass
+
+    def close(self):
+        pass
+
+
+# Records one fixed-size record per game frame into a ring buffer allocated once. A background
+# thread writes the records out in batches of batch_size (or every flush_every seconds), so the
+# game loop never waits on the disk. If the writer falls a whole buffer behind, new records are
+# dropped and counted rather than blocking the game.
+class TelemetryRecorder:
+    def __init__(self, path, game, capacity=4096, batch_size=256, flush_every=1.0):
+        self.path = path
+        self.buffer = np.zeros(capacity, dtype=RECORD)
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_every = flush_every
+        self.written = 0  # Records added by the game
+        self.flushed = 0  # Records written to the file
+        self.dropped = 0
+        self.last_time = None
+
+        metadata = {
+            "game": game,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "columns": [[name, RECORD[name].str] for name in RECORD.names],
+        }
+        metadata = json.dumps(metadata).encode()
+        # A session never writes over another one's file
+        self.file = open(path, "xb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, len(metadata)))
+        self.file.write(metadata)
+
+        self.wake = threading.Event()
+        self.closing = False
+        self.thread = threading.Thread(target=self.write_loop, name="telemetry-writer", daemon=True)
+        self.thread.start()
+
+    # Function to record a game frame. frame is the HandFrame the game used, values are the
+    # RECORD fields the game knows (score, hits, misses, gesture, x, y, playing).
+    def frame(self, now, frame, playing=True, score=0, hits=0, misses=0, gesture=math.nan, x=math.nan, y=math.nan):
+        if self.written - self.flushed >= self.capacity:
+            self.dropped += 1
+            return
+        frame_ms = 0.0 if self.last_time is None else (now - self.last_time) * 1000
+        self.last_time = now
+
+        confidence = math.nan
+        handedness = frame.results.multi_handedness
+        if handedness:
+            confidence = max(hand.classification[0].score for hand in handedness)
+        latency_ms = (now - frame.capture_time) * 1000 if frame.frame_id >= 0 else math.nan
+
+        self.buffer[self.written % self.capacity] = (
+            now, frame_ms, latency_ms, frame.frame_id, len(handedness or ()), confidence, gesture,
+            playing, score, hits, misses, x, y)
+        self.written += 1
+        if self.written - self.flushed >= self.batch_size:
+            self.wake.set()
+
+    def write_loop(self):
+        while not self.closing:
+            self.wake.wait(self.flush_every)
+            self.wake.clear()
+            self.flush()
+        self.flush()
+
+    # Function to write every record not written yet, one batch per unbroken run of the ring
+    def flush(self):
+        end = self.written
+        start = self.flushed
+        while start < end:
+            index = start % self.capacity
+            count = min(end - start, self.capacity - index)
+            records = self.buffer[index:index + count]
+            self.file.write(BATCH.pack(count))
+            for name in RECORD.names:
+                self.file.write(records[name].tobytes())
+            start += count
+            self.flushed = start
+
+    def close(self):
+        self.closing = True
+        self.wake.set()
+        self.thread.join()
+        self.file.close()
+        if self.dropped:
+            print(f"Telemetry: {self.dropped} records dropped")
+
+
+# Function to load a recorded session as (metadata, {column: NumPy array})
+def load_session(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    magic, version, metadata_size = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a telemetry file")
+    offset = HEADER.size
+    metadata = json.loads(data[offset:offset + metadata_size])
+    offset += metadata_size
+
+    columns = [(name, np.dtype(dtype)) for name, dtype in metadata["columns"]]
+    chunks = {name: [] for name, _ in columns}
+    while offset < len(data):
+        (count,) = BATCH.unpack_from(data, offset)
+        offset += BATCH.size
+        for name, dtype in columns:
+            chunks[name].append(np.frombuffer(data, dtype=dtype, count=count, offset=offset))
+            offset += count * dtype.itemsize
+    return metadata, {name: np.concatenate(chunks[name]) if chunks[name] else np.zeros(0, dtype)
+                      for name, dtype in columns}
+
+
+# Function to start recording telemetry for a game, turned on with NEROFLEX_TELEMETRY=<directory>.
+# Every session gets its own file named after the game and the time it started, with a number
+# added when another session (e.g. another station, or a quick game switch) started that second.
+def open_telemetry(game):
+    directory = os.environ.get("NEROFLEX_TELEMETRY")
+    if not directory:
+        return NullTelemetry()
+    os.makedirs(directory, exist_ok=True)
+    name = f"{game}-{time.strftime('%Y%m%d-%H%M%S')}"
+    number = 1
+    while True:
+        path = os.path.join(directory, f"{name}.nftl" if number == 1 else f"{name}-{number}.nftl")
+        try:
+            return TelemetryRecorder(path, game)
+        except FileExistsError:
+            number += 1
+
+
+# Function to print a short summary of a recorded session
+def summarize(path):
+    metadata, columns = load_session(path)
+    frames = len(columns["time"])
+    print(f"{path}: {metadata['game']} started {metadata['started']}, {frames} frames")
+    if frames == 0:
+        return
+    playing = columns["playing"] == 1
+    print(f"  played {playing.sum()} frames over {columns['time'][-1] - columns['time'][0]:.1f} s, "
+          f"score {columns['score'][-1]}, {columns['hits'][-1]} hits, {columns['misses'][-1]} misses")
+    frame_ms = columns["frame_ms"][1:]
+    latency_ms = columns["latency_ms"][~np.isnan(columns["latency_ms"])]
+    if len(frame_ms):
+        print(f"  frame time p50 {np.percentile(frame_ms, 50):.1f} ms, p95 {np.percentile(frame_ms, 95):.1f} ms")
+    if len(latency_ms):
+        print(f"  hand tracking latency p50 {np.percentile(latency_ms, 50):.1f} ms, "
+              f"p95 {np.percentile(latency_ms, 95):.1f} ms")
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        summarize(path)
@@ -0,0 +1,59 @@
+import math
+
+from stage_timer import timings
+
+
+# Fixed timestep clock for the game simulation.
+# Every frame, advance() adds the real time that passed to an accumulator and returns how many
+# steps of `step` seconds to run, so the games move at the same speed however fast the loop runs
+# (slow camera, slow Mediapipe, dropped frames). alpha is how far between the last two steps the
+# current time is, for drawing moving things in between. A frame that took longer than
+# max_frame_time only counts as max_frame_time, so one long stall does not end in a burst of steps,
+# the time cut off is counted in the timings as sim_dropped_ms.
+class SimClock:
+    def __init__(self, rate, max_frame_time=0.25):
+        self.step = 1.0 / rate
+        self.max_frame_time = max_frame_time
+        self.last_time = None
+        self.accumulator = 0.0
+        self.alpha = 0.0
+
+    # Start (or restart after a menu or game over) counting from now, with nothing to catch up
+    def start(self, now):
+        self.last_time = now
+        self.accumulator = 0.0
+        self.alpha = 0.0
+
+    # Returns the number of steps to run this frame
+    def advance(self, now):
+        if self.last_time is None:
+            self.start(now)
+        frame_time = now - self.last_time
+        self.last_time = now
+        if frame_time > self.max_frame_time:
+            timings.count("sim_dropped_ms", (frame_time - self.max_frame_time) * 1000)
+            frame_time = self.max_frame_time
+        self.accumulator += max(frame_time, 0.0)
+
+        # Frames that are a rounding error short of a whole step still count as one
+        steps = int(self.accumulator / self.step + 1e-6)
+        self.accumulator = max(self.accumulator - steps * self.step, 0.0)
+        self.alpha = self.accumulator / self.step
+        timings.count("sim_steps", steps)
+        return steps
+
+    # When the last step happened on the clock passed to advance(), to relate the game state to
+    # camera capture times. The current time is alpha steps past it.
+    def step_time(self):
+        return self.last_time - self.accumulator
+
+
+# Function to find the value between the last two steps to draw (works on NumPy arrays too)
+def lerp(previous, current, alpha):
+    return previous + (current - previous) * alpha
+
+
+# Function to do the same for an angle in radians that wraps around at 2 pi
+def lerp_angle(previous, current, alpha):
+    difference = (current - previous + math.pi) % (2 * math.pi) - math.pi
+    return previous + difference * alpha
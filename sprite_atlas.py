@@ -0,0 +1,75 @@
+import math
+
+import pygame
+
+# Colour left out of opaque sprites, none of the games draw with it
+COLORKEY = (255, 0, 255)
+
+
+# Pictures of everything that moves in a game, drawn once with the same pygame.draw calls the game
+# used to make every frame, cropped to what was drawn and converted to the display format. Each
+# frame the sprites are copied to the screen with a single Surface.blits() call per layer, so the
+# Python cost per entity is one tuple instead of a draw call. Opaque sprites use a run-length
+# encoded colour key (only the drawn runs are copied), alpha=True keeps per-pixel alpha.
+# Every sprite keeps its own surface rather than sharing one big sheet: SDL has to walk a
+# run-length encoded surface from the top to blit part of it, which made a shared sheet slower
+# than drawing. Add the sprites with add() and add_rotations(), then build() once the display mode is set.
+class SpriteAtlas:
+    def __init__(self, alpha=False):
+        self.alpha = alpha
+        self.pending = []  # (name, cropped surface, offset from the position) until build()
+        self.sprites = {}  # name -> list of (surface, offset) per frame
+
+    def blank(self, size):
+        if self.alpha:
+            surface = pygame.Surface(size, pygame.SRCALPHA)
+            surface.fill((0, 0, 0, 0))
+        else:
+            surface = pygame.Surface(size)
+            surface.fill(COLORKEY)
+            surface.set_colorkey(COLORKEY)
+        return surface
+
+    # Function to add a sprite. draw(surface, origin) draws it on a blank surface of the given size
+    # as if it was on the screen with its position at origin. Only the part actually drawn is kept.
+    def add(self, name, size, draw, origin=(0, 0)):
+        surface = self.blank(size)
+        draw(surface, origin)
+        self.crop(name, surface, origin)
+
+    # Function to add `frames` turned copies of a sprite for angles 0 to 2 pi, drawn by
+    # draw(surface, origin, angle). frame(name, angle) picks the closest one.
+    def add_rotations(self, name, frames, size, draw, origin):
+        surface = self.blank(size)
+        for i in range(frames):
+            surface.fill((0, 0, 0, 0) if self.alpha else COLORKEY)
+            draw(surface, origin, 2 * math.pi * i / frames)
+            self.crop(name, surface, origin)
+
+    def crop(self, name, surface, origin):
+        area = surface.get_bounding_rect()
+        self.pending.append((name, surface.subsurface(area).copy(), (area.x - origin[0], area.y - origin[1])))
+
+    # Function to convert every sprite to the display format
+    def build(self):
+        self.sprites = {}
+        for name, surface, offset in self.pending:
+            if self.alpha:
+                surface = surface.convert_alpha()
+            else:
+                surface = surface.convert()
+                surface.set_colorkey(COLORKEY, pygame.RLEACCEL)
+            self.sprites.setdefault(name, []).append((surface, offset))
+        self.pending = []
+        return self
+
+    # Frame of a rotated sprite closest to angle
+    def frame(self, name, angle):
+        frames = len(self.sprites[name])
+        return round(angle / (2 * math.pi) * frames) % frames
+
+    # Entry for Surface.blits() that draws a sprite with its position at (x, y).
+    # Positions are cut to whole pixels the way pygame.draw does.
+    def place(self, name, x, y, frame=0):
+        surface, (dx, dy) = self.sprites[name][frame]
+        return surface, (int(x) + dx, int(y) + dy)
@@ -0,0 +1,136 @@
+import atexit
+import json
+import os
+import time
+
+import numpy as np
+
+
+# Times one stage of the game loop, used as `with timings.stage("draw"):`
+class TimedStage:
+    __slots__ = ("timer", "name", "start")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+
+
+# Stand-in used when timing is turned off, so the games pay almost nothing for it
+class NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+# The last `size` values of one stage or counter, in a buffer allocated once
+class RollingSamples:
+    __slots__ = ("values", "written")
+
+    def __init__(self, size):
+        self.values = np.zeros(size)
+        self.written = 0
+
+    def append(self, value):
+        self.values[self.written % len(self.values)] = value
+        self.written += 1
+
+    # Values in the window, oldest first
+    def recent(self):
+        size = len(self.values)
+        if self.written <= size:
+            return self.values[:self.written]
+        start = self.written % size
+        return np.concatenate((self.values[start:], self.values[:start]))
+
+
+# Collects per-stage timings (seconds) and per-frame counters, in two ways that can be on together:
+# recording keeps every value for the benchmark summary (NEROFLEX_TIMINGS), live keeps only the
+# last `window` values of each for the profiler overlay (live_profiler.py), which turns it on and off.
+# With both off, stage() hands out a shared do-nothing context and the games pay almost nothing.
+class StageTimer:
+    def __init__(self, enabled=False, window=240):
+        self.record = enabled
+        self.live = False
+        self.enabled = enabled  # True when either is on
+        self.window = window
+        self.samples = {}
+        self.counters = {}
+        self.rolling = {}  # Stage and counter name -> RollingSamples while live
+
+    def set_live(self, live):
+        self.live = live
+        self.enabled = self.record or live
+        if not live:
+            self.rolling = {}
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_STAGE
+        return TimedStage(self, name)
+
+    def add(self, name, seconds):
+        if self.record:
+            self.samples.setdefault(name, []).append(seconds)
+        if self.live:
+            self.rolling_samples(name).append(seconds)
+
+    def count(self, name, value):
+        if self.record:
+            self.counters.setdefault(name, []).append(value)
+        if self.live:
+            self.rolling_samples(name).append(value)
+
+    def rolling_samples(self, name):
+        rolling = self.rolling.get(name)
+        if rolling is None:
+            rolling = self.rolling[name] = RollingSamples(self.window)
+        return rolling
+
+    # Function to get the last values of a stage (seconds) or counter, empty when there are none
+    def recent(self, name):
+        rolling = self.rolling.get(name)
+        if rolling is None:
+            return np.zeros(0)
+        return rolling.recent()
+
+    def summary(self):
+        stages = {}
+        for name, samples in self.samples.items():
+            if not samples:
+                continue
+            ms = np.array(samples) * 1000
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            stages[name] = {"count": len(ms), "mean_ms": float(ms.mean()), "p50_ms": float(p50),
+                            "p95_ms": float(p95), "p99_ms": float(p99), "max_ms": float(ms.max())}
+        counters = {}
+        for name, values in self.counters.items():
+            if not values:
+                continue
+            values = np.array(values)
+            p50, p95 = np.percentile(values, [50, 95])
+            counters[name] = {"count": len(values), "mean": float(values.mean()), "p50": float(p50),
+                              "p95": float(p95), "max": float(values.max())}
+        return {"stages": stages, "counters": counters}
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+# Shared timer for the games. Set NEROFLEX_TIMINGS=<file> to record and write the summary on exit.
+timings = StageTimer(enabled=bool(os.environ.get("NEROFLEX_TIMINGS")))
+if timings.enabled:
+    atexit.register(timings.save, os.environ["NEROFLEX_TIMINGS"])
@@ -0,0 +1,60 @@
+import math
+
+import numpy as np
+import pygame
+
+from gestures import FINGER_MCPS, NUM_LANDMARKS, THUMB_MCP, THUMB_TIP
+from hand_pipeline import HandFrame
+from landmark_replay import LandmarkRecorder, results_from_arrays
+
+# Open right hand pointing up, relative to the wrist, in normalized image units.
+# Order is Mediapipe's: wrist, thumb (CMC, MCP, IP, TIP), then index, middle, ring and pinky (MCP, PIP, DIP, TIP).
+OPEN_HAND = np.array([
+    (0.0, 0.0),
+    (-0.04, -0.03), (-0.08, -0.06), (-0.11, -0.09), (-0.13, -0.12),
+    (-0.05, -0.18), (-0.055, -0.26), (-0.06, -0.31), (-0.06, -0.36),
+    (-0.01, -0.19), (-0.01, -0.28), (-0.01, -0.33), (-0.01, -0.38),
+    (0.03, -0.18), (0.035, -0.26), (0.04, -0.30), (0.04, -0.34),
+    (0.07, -0.16), (0.08, -0.22), (0.085, -0.25), (0.09, -0.28),
+], dtype=np.float32)
+
+
+# Function to build one synthetic hand as a (21, 3) landmark array.
+# fist goes from 0 (open) to 1 (closed), angle rotates the hand around the wrist in radians
+# (0 is fingers up, positive turns the fingers down the right side) and thumb moves the thumb
+# tip sideways from the thumb MCP.
+def hand_pose(wrist_x=0.5, wrist_y=0.8, fist=0.0, angle=0.0, thumb=None):
+    points = OPEN_HAND.copy()
+    for mcp in FINGER_MCPS:
+        curled = points[mcp] + (0.0, 0.04)
+        for joint in range(mcp + 1, mcp + 4):
+            points[joint] += (curled - points[joint]) * fist
+    if thumb is not None:
+        points[THUMB_TIP, 0] = points[THUMB_MCP, 0] + thumb
+
+    cos_a, sin_a = math.cos(angle), math.sin(angle)
+    rotated = np.empty((NUM_LANDMARKS, 3), dtype=np.float32)
+    rotated[:, 0] = wrist_x + points[:, 0] * cos_a - points[:, 1] * sin_a
+    rotated[:, 1] = wrist_y + points[:, 0] * sin_a + points[:, 1] * cos_a
+    rotated[:, 2] = 0.0
+    return rotated
+
+
+# Function to write a recording that LandmarkReplay can play back.
+# poses has one (21, 3) array (or None for no hand) per frame and clicks maps a frame
+# number to the (x, y) of a left click. Frame -1 is before the first camera frame.
+def write_recording(path, poses, clicks=None, fps=30, seed=0, frame_size=(640, 480)):
+    clicks = clicks or {}
+    recorder = LandmarkRecorder(path, seed, frame_size)
+    if -1 in clicks:
+        recorder.add_events(0, [pygame.event.Event(pygame.MOUSEBUTTONDOWN, button=1, pos=clicks[-1])])
+
+    for frame_id, pose in enumerate(poses):
+        if pose is None:
+            results = results_from_arrays(np.zeros((0, NUM_LANDMARKS, 3), dtype=np.float32), [], [])
+        else:
+            results = results_from_arrays(pose[None], np.ones(1, dtype=np.uint8), np.ones(1, dtype=np.float32))
+        recorder.next_frame(frame_id / fps, HandFrame(frame_id, frame_id / fps, None, results))
+        if frame_id in clicks:
+            recorder.add_events(0, [pygame.event.Event(pygame.MOUSEBUTTONDOWN, button=1, pos=clicks[frame_id])])
+    recorder.close()
@@ -0,0 +1,39 @@
+import pytest
+
+from bulk_sim import run_batch
+
+OPTIONS = {"recording": None, "latency": 0.1, "timing_sd": 0.08, "reaction": 0.25, "aim_sd": 15.0}
+
+
+@pytest.mark.parametrize("game", ["game1", "game2", "game3"])
+def test_batch_plays_every_seed_the_same_way_twice(game):
+    task = (game, {}, OPTIONS, list(range(40)), 20.0)
+    sessions = run_batch(task)
+    assert len(sessions) == 40
+    assert all(session is not None for session in sessions)
+    assert run_batch(task) == sessions
+    assert all(0 < session["seconds"] <= 20.0 for session in sessions)
+
+
+def test_lost_game3_sessions_keep_their_results():
+    sessions = run_batch(("game3", {"player_health": 1}, OPTIONS, list(range(40)), 60.0))
+    lost = [session for session in sessions if session["game_over"]]
+    assert lost
+    assert all(session["misses"] >= 1 and session["seconds"] < 60.0 for session in lost)
+
+
+# Many more asteroids and a player slower to react lose more sessions, sooner, than the defaults
+def test_game3_outcomes_follow_the_difficulty():
+    seeds = list(range(40))
+    easy = run_batch(("game3", {}, OPTIONS, seeds, 60.0))
+    hard = run_batch(("game3", {"asteroid_spawn_rate": 6}, dict(OPTIONS, reaction=0.5), seeds, 60.0))
+
+    def lost(sessions):
+        return sum(session["game_over"] for session in sessions)
+
+    assert lost(easy) <= 2
+    assert lost(hard) >= 20
+    assert sum(session["seconds"] for session in hard) < sum(session["seconds"] for session in easy)
+    # Sessions with asteroids coming twice as often shoot down more of them
+    busy = run_batch(("game3", {"asteroid_spawn_rate": 15}, OPTIONS, seeds, 60.0))
+    assert sum(session["score"] for session in busy) > 1.5 * sum(session["score"] for session in easy)
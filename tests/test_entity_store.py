@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from entity_store import EntityStore, points_in_boxes
+
+
+def test_fixed_store_returns_none_when_full():
+    store = EntityStore(3, fixed=True, x=np.int32)
+    slots = [store.spawn(x=i) for i in range(3)]
+    assert sorted(slots) == [0, 1, 2]
+    assert store.spawn(x=3) is None
+    assert len(store) == 3
+    assert store["x"][store.active()].tolist() == [0, 1, 2]
+
+
+def test_store_grows_when_full():
+    store = EntityStore(2, x=np.int32)
+    slots = [store.spawn(x=i) for i in range(5)]
+    assert sorted(slots) == [0, 1, 2, 3, 4]
+    assert store.capacity == 8
+    assert len(store) == 5
+    assert store["x"][slots].tolist() == [0, 1, 2, 3, 4]
+
+
+def test_killed_slots_are_reused():
+    store = EntityStore(4, fixed=True, x=np.int32)
+    slots = [store.spawn(x=i) for i in range(4)]
+    # Killing the same slot twice only frees it once
+    store.kill([slots[1], slots[3], slots[1]])
+    assert len(store) == 2
+    assert store.active().tolist() == [slots[0], slots[2]]
+
+    reused = [store.spawn(x=10), store.spawn(x=11)]
+    assert sorted(reused) == sorted([slots[1], slots[3]])
+    assert store.spawn(x=12) is None
+    assert store["x"][reused].tolist() == [10, 11]
+
+
+# The rule points_in_boxes follows, one point and box at a time
+def scalar_points_in_boxes(point_x, point_y, box_x, box_y, box_size):
+    pairs = []
+    for box in range(len(box_x)):
+        for point in range(len(point_x)):
+            if (box_x[box] < point_x[point] < box_x[box] + box_size[box]
+                    and box_y[box] < point_y[point] < box_y[box] + box_size[box]):
+                pairs.append((point, box))
+    return pairs
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_points_in_boxes_matches_scalar_rule(seed):
+    rng = np.random.default_rng(seed)
+    # A small grid so many points fall exactly on box edges
+    box_x = rng.integers(0, 20, 30)
+    box_y = rng.integers(0, 20, 30)
+    box_size = rng.integers(1, 6, 30)
+    point_x = rng.integers(0, 25, 200)
+    point_y = rng.integers(0, 25, 200)
+
+    points, boxes = points_in_boxes(point_x, point_y, box_x, box_y, box_size)
+    assert list(zip(points.tolist(), boxes.tolist())) == scalar_points_in_boxes(point_x, point_y, box_x, box_y, box_size)
+
+
+def test_points_on_box_edges_are_outside():
+    box_x, box_y, box_size = np.array([10]), np.array([10]), np.array([4])
+    point_x = np.array([10, 14, 12, 12, 11, 13])
+    point_y = np.array([12, 12, 10, 14, 11, 13])
+    points, boxes = points_in_boxes(point_x, point_y, box_x, box_y, box_size)
+    assert points.tolist() == [4, 5]
+    assert boxes.tolist() == [0, 0]
+
+
+def test_points_in_boxes_with_nothing_to_check():
+    empty = np.zeros(0, dtype=np.int64)
+    one = np.array([1])
+    for args in [(empty, empty, one, one, one), (one, one, empty, empty, empty)]:
+        points, boxes = points_in_boxes(*args)
+        assert len(points) == 0 and len(boxes) == 0
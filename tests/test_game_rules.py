@@ -0,0 +1,77 @@
+import random
+
+import numpy as np
+import pytest
+
+from game_rules import (AsteroidBatch, AsteroidGame, AsteroidSettings, TacoBatch, TacoGame,
+                        TacoSettings)
+
+
+# Gives every session of a batch the same numbers a game of its own would get from random.Random(seed)
+class SessionRandoms:
+    def __init__(self, seeds):
+        self.randoms = [random.Random(seed) for seed in seeds]
+
+    def integers(self, low, high, size):
+        assert size == len(self.randoms)
+        return np.array([r.randint(low, high - 1) for r in self.randoms])
+
+
+# Held directions that change now and then, like a player walking after targets
+def directions(sessions, steps, seed, choices=(-1, 0, 1)):
+    rng = np.random.default_rng(seed)
+    held = rng.choice(choices, size=(steps // 20 + 1, sessions))
+    return np.repeat(held, 20, axis=0)[:steps]
+
+
+@pytest.mark.parametrize("overrides", [{}, {"spawn_steps": 7, "obstacle_speed": 9}])
+def test_taco_batch_plays_like_taco_game(overrides):
+    settings = TacoSettings(**overrides)
+    seeds = list(range(8))
+    batch = TacoBatch(settings, SessionRandoms(seeds), len(seeds))
+    games = [TacoGame(settings, random.Random(seed)) for seed in seeds]
+
+    for step_directions in directions(len(seeds), 1500, seed=1):
+        batch.step(step_directions)
+        for game, direction in zip(games, step_directions.tolist()):
+            game.step(direction)
+
+        for i, game in enumerate(games):
+            assert batch.player_x[i] == game.player_x
+            assert batch.score[i] == game.score
+            assert batch.tacos_eaten[i] == game.tacos_eaten
+            assert batch.tacos_missed[i] == game.tacos_missed
+            active = game.obstacles.active()
+            assert sorted(zip(game.obstacles["x"][active].tolist(), game.obstacles["y"][active].tolist())) == \
+                sorted(zip(batch.x[i][batch.alive[i]].tolist(), batch.y[i][batch.alive[i]].tolist()))
+    assert batch.tacos_eaten.sum() > 0
+
+
+@pytest.mark.parametrize("overrides", [{}, {"asteroid_spawn_rate": 12, "player_health": 2, "shoot_delay": 4}])
+def test_asteroid_batch_plays_like_asteroid_game(overrides):
+    settings = AsteroidSettings(**overrides)
+    seeds = list(range(8))
+    batch = AsteroidBatch(settings, SessionRandoms(seeds), len(seeds))
+    games = [AsteroidGame(settings, random.Random(seed)) for seed in seeds]
+    steps_played = [0] * len(games)
+
+    for step_directions in directions(len(seeds), 3000, seed=2):
+        batch.step(step_directions)
+        for i, (game, direction) in enumerate(zip(games, step_directions.tolist())):
+            if game.game_over:
+                continue
+            game.step(direction)
+            steps_played[i] += 1
+
+            assert batch.player_x[i] == game.player_pos[0]
+            assert batch.score[i] == game.score
+            assert batch.asteroids_taken[i] == game.asteroids_taken
+            assert batch.player_health[i] == game.player_health
+            active = game.asteroids.active()
+            assert sorted(zip(game.asteroids["x"][active].tolist(), game.asteroids["y"][active].tolist())) == \
+                sorted(zip(batch.asteroid_x[i][batch.asteroid_alive[i]].tolist(),
+                           batch.asteroid_y[i][batch.asteroid_alive[i]].tolist()))
+
+    assert batch.game_over.tolist() == [game.game_over for game in games]
+    assert batch.steps_played.tolist() == steps_played
+    assert batch.asteroids_destroyed.sum() > 0
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from mediapipe.framework.formats import landmark_pb2
+
+from gestures import FINGER_MCPS, FINGER_TIPS, NUM_LANDMARKS, WRIST, hands_to_array, standard_engine
+from hand_pipeline import NO_HANDS
+from landmark_replay import results_from_arrays
+
+FRAME_TIME = 1 / 30
+
+
+# Hands the way Mediapipe gives them, optionally with visibility and presence on every landmark
+def landmark_lists(hand_count, seed, visibility=False):
+    rng = np.random.default_rng(seed)
+    hands = []
+    for hand in rng.random((hand_count, NUM_LANDMARKS, 3), dtype=np.float32).tolist():
+        hand_landmarks = landmark_pb2.NormalizedLandmarkList()
+        for x, y, z in hand:
+            point = hand_landmarks.landmark.add(x=x, y=y, z=z)
+            if visibility:
+                point.visibility = 0.9
+                point.presence = 0.8
+        hands.append(hand_landmarks)
+    return hands
+
+
+# Same conversion through the landmark attributes only
+def attribute_array(hands):
+    return np.array([[[point.x, point.y, point.z] for point in hand.landmark] for hand in hands],
+                    dtype=np.float32).reshape(len(hands), NUM_LANDMARKS, 3)
+
+
+@pytest.mark.parametrize("hand_count", [1, 2])
+@pytest.mark.parametrize("visibility", [False, True])
+def test_hands_to_array_matches_attributes(hand_count, visibility):
+    hands = landmark_lists(hand_count, seed=hand_count, visibility=visibility)
+    np.testing.assert_array_equal(hands_to_array(hands), attribute_array(hands))
+
+
+# One landmark with an extra field and one with a field missing serialize to the usual total length
+def test_hands_to_array_checks_every_landmark():
+    hands = landmark_lists(2, seed=3)
+    hands[0].landmark[5].visibility = 0.9
+    hands[1].landmark[7].ClearField("x")
+    assert sum(len(hand.SerializeToString()) for hand in hands) == 2 * NUM_LANDMARKS * 17
+    np.testing.assert_array_equal(hands_to_array(hands), attribute_array(hands))
+
+
+# Result with one right hand whose fingertips are `reach` to the right of their knuckles
+def hand_result(reach):
+    hand = np.zeros((1, NUM_LANDMARKS, 3), dtype=np.float32)
+    hand[0, :, :2] = 0.5
+    hand[0, WRIST, 1] = 0.8
+    for i, mcp in enumerate(FINGER_MCPS):
+        hand[0, mcp, 0] = 0.4 + 0.05 * i
+        hand[0, FINGER_TIPS[i], 0] = hand[0, mcp, 0] + reach
+    return results_from_arrays(hand, np.array([1], dtype=np.uint8), np.array([0.9], dtype=np.float32))
+
+
+# Clenches the fist, then opens it to between the fist's threshold (0.15) and release (0.17),
+# where it only stays a fist because it was one
+def held_fist(engine):
+    t = 0.0
+    for reach in [0.1] * 10 + [0.16] * 20:
+        t += FRAME_TIME
+        assert engine.evaluate(hand_result(reach), t)["fist"][0]
+    return t
+
+
+def test_fist_is_held_through_a_dropped_frame():
+    engine = standard_engine()
+    t = held_fist(engine)
+
+    engine.evaluate(NO_HANDS, t + FRAME_TIME)
+    assert engine.evaluate(hand_result(0.16), t + 2 * FRAME_TIME)["fist"][0]
+
+
+def test_fist_is_not_held_for_a_hand_that_was_gone():
+    engine = standard_engine()
+    t = held_fist(engine)
+
+    engine.evaluate(NO_HANDS, t + FRAME_TIME)
+    # Longer than the history's forget_after, so it counts as a new hand
+    assert not engine.evaluate(hand_result(0.16), t + 1.0)["fist"][0]
@@ -0,0 +1,189 @@
+import os
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pygame
+import pytest
+
+import hand_pipeline
+from game_rules import LockGame, LockSettings
+from gestures import standard_engine
+from hand_pipeline import HandPipeline
+from landmark_replay import (RECORDED_EVENTS, LandmarkRecorder, LandmarkReplay, results_from_arrays,
+                             results_to_arrays)
+from synthetic_hands import hand_pose, write_recording
+
+FRAMES = 40
+
+# Input posted during the session: frame (-1 for the start screen) -> event call -> events
+INPUT = {
+    -1: {0: [pygame.event.Event(pygame.MOUSEBUTTONDOWN, button=1, pos=(400, 300))]},
+    3: {0: [pygame.event.Event(pygame.MOUSEBUTTONDOWN, button=3, pos=(12, 34))]},
+    7: {1: [pygame.event.Event(pygame.KEYDOWN, key=pygame.K_q)]},
+    20: {0: [pygame.event.Event(pygame.KEYDOWN, key=pygame.K_SPACE),
+             pygame.event.Event(pygame.MOUSEBUTTONDOWN, button=1, pos=(799, 0))],
+         1: [pygame.event.Event(pygame.MOUSEBUTTONDOWN, button=1, pos=(5, 6))]},
+}
+
+
+@pytest.fixture
+def events():
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.display.init()
+    pygame.display.set_mode((800, 600))
+    yield
+    pygame.display.quit()
+
+
+# Game time that only moves when the test says so, so the recorded times are known
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def perf_counter(self):
+        return self.now
+
+
+def describe(event):
+    return (event.type, getattr(event, "button", None), getattr(event, "key", None), getattr(event, "pos", None))
+
+
+# Function to play a session the way a game does: one latest() and two events() calls a frame,
+# with a start screen before the first frame. Returns what the game saw on every frame.
+def play(pipeline, clock, post_input):
+    pygame.event.clear()
+    seen = []
+
+    def game_events(frame_index, call):
+        if post_input:
+            for event in INPUT.get(frame_index, {}).get(call, []):
+                pygame.event.post(event)
+        return [describe(event) for event in pipeline.events() if event.type in RECORDED_EVENTS]
+
+    seen.append(("start", game_events(-1, 0)))
+    for frame_index in range(FRAMES):
+        clock.now += 1 / 30
+        frame = pipeline.latest()
+        landmarks, labels, scores = results_to_arrays(frame.results)
+        seen.append((frame.frame_id, pipeline.now(), landmarks, labels, scores,
+                     game_events(frame_index, 0), game_events(frame_index, 1)))
+    pipeline.stop()
+    return seen
+
+
+def test_replay_gives_the_game_what_it_saw_when_recorded(tmp_path, monkeypatch, events):
+    clock = FakeClock()
+    monkeypatch.setattr(hand_pipeline, "time", SimpleNamespace(perf_counter=clock.perf_counter))
+
+    # Hands from a synthetic session, with some frames without a hand
+    source_path = str(tmp_path / "source.nflm")
+    poses = [None if i % 9 == 4 else hand_pose(wrist_x=0.3 + i / 100, fist=(i % 10) / 10) for i in range(FRAMES)]
+    write_recording(source_path, poses)
+    source = LandmarkReplay(source_path)
+
+    path = str(tmp_path / "session.nflm")
+    recorder = LandmarkRecorder(path, 1234, (640, 480))
+    recorded = play(HandPipeline(source, source, threaded=False, recorder=recorder), clock, post_input=True)
+
+    replay = LandmarkReplay(path)
+    assert replay.seed == 1234
+    assert replay.frame_size == (640, 480)
+    assert len(replay) == FRAMES
+    # Nothing is posted this time, the input comes from the recording
+    replayed = play(HandPipeline(replay, replay, threaded=False, replay=replay), clock, post_input=False)
+
+    assert replayed[0] == recorded[0]
+    assert recorded[0][1] == [describe(event) for event in INPUT[-1][0]]
+    for was, now in zip(recorded[1:], replayed[1:]):
+        frame_id, time, landmarks, labels, scores, first_events, second_events = was
+        assert now[0] == frame_id
+        assert now[1] == time
+        np.testing.assert_array_equal(now[2], landmarks)
+        np.testing.assert_array_equal(now[3], labels)
+        np.testing.assert_array_equal(now[4], scores)
+        assert now[5] == first_events
+        assert now[6] == second_events
+
+    # The landmarks are the ones of the source session, one frame per game frame
+    for index, pose in enumerate(poses):
+        landmarks = recorded[index + 1][2]
+        if pose is None:
+            assert len(landmarks) == 0
+        else:
+            np.testing.assert_array_equal(landmarks[0], pose)
+    assert sum(len(frame[5]) + len(frame[6]) for frame in recorded[1:]) == 5
+
+
+# Camera whose frames were taken 50 ms before the game reads them and that hands every third
+# frame out twice, as a camera slower than the game does
+class LaggingCamera:
+    def __init__(self, clock, poses):
+        self.clock = clock
+        self.poses = poses
+        self.reads = 0
+        self.frame_id = None
+        self.capture_time = None
+
+    def read(self, image=None):
+        if self.reads % 3 != 2:
+            self.frame_id = 0 if self.frame_id is None else self.frame_id + 1
+            self.capture_time = self.clock.now - 0.05
+        self.reads += 1
+        return True, np.zeros((480, 640, 3), dtype=np.uint8)
+
+    def process(self, image):
+        pose = self.poses[self.frame_id % len(self.poses)]
+        return results_from_arrays(pose[None], np.array([1], dtype=np.uint8), np.array([0.9], dtype=np.float32))
+
+    def release(self):
+        pass
+
+
+# Function to play game1's fist judging the way game1.py does, returning per frame the frame id,
+# capture time, judgement and gesture values
+def play_lock(pipeline, clock):
+    engine = standard_engine()
+    lock = LockGame(LockSettings(), random.Random(7), 1 / 30)
+    judged_frame_id = None
+    seen = []
+    for _ in range(FRAMES):
+        clock.now += 1 / 30
+        frame = pipeline.latest()
+        values = engine.evaluate(frame.results, frame.capture_time)
+        judgement = None
+        if frame.frame_id != judged_frame_id and values["fist"].any():
+            # Every judged fist counts, a miss does not end the session here
+            judgement = lock.judge_fist(frame.capture_time, pipeline.now(), pipeline.now())
+        judged_frame_id = frame.frame_id
+        seen.append((frame.frame_id, frame.capture_time, judgement, values))
+    pipeline.stop()
+    return seen
+
+
+def test_replay_keeps_the_frame_ids_and_capture_times(tmp_path, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(hand_pipeline, "time", SimpleNamespace(perf_counter=clock.perf_counter))
+
+    # The fist closes and opens again while the hand moves, so the filters have something to do
+    poses = [hand_pose(wrist_x=0.3 + i / 50, fist=1.0 if i % 8 < 4 else 0.0) for i in range(16)]
+    camera = LaggingCamera(clock, poses)
+    path = str(tmp_path / "session.nflm")
+    recorder = LandmarkRecorder(path, 1, (640, 480))
+    recorded = play_lock(HandPipeline(camera, camera, threaded=False, recorder=recorder), clock)
+
+    replay = LandmarkReplay(path)
+    replayed = play_lock(HandPipeline(replay, replay, threaded=False, replay=replay), clock)
+
+    frame_ids = [frame[0] for frame in recorded]
+    assert len(set(frame_ids)) < len(frame_ids)
+    # Some fists were judged, never twice for the same camera frame
+    judged = [frame[0] for frame in recorded if frame[2] is not None]
+    assert judged and len(judged) == len(set(judged))
+    for was, now in zip(recorded, replayed):
+        assert now[0] == was[0]
+        assert now[1] == was[1]
+        assert now[2] == was[2]
+        assert now[3].keys() == was[3].keys()
+        for name, value in was[3].items():
+            np.testing.assert_array_equal(now[3][name], value)
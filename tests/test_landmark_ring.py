@@ -0,0 +1,171 @@
+import time
+from multiprocessing import resource_tracker
+
+import numpy as np
+import pytest
+
+from hand_pipeline import HandFrame
+from landmark_replay import LandmarkRecorder, LandmarkReplay, results_from_arrays, results_to_arrays
+from landmark_ring import THUMBNAIL_SIZE, LandmarkRing, open_shm_pipeline
+from synthetic_hands import hand_pose, write_recording
+
+
+# Frame whose landmarks, handedness, score and picture all come from its frame id
+def make_frame(frame_id, hand_count=1):
+    landmarks = np.full((hand_count, 21, 3), frame_id / 1000, dtype=np.float32)
+    labels = np.arange(hand_count, dtype=np.uint8) % 2
+    scores = np.full(hand_count, 0.5 + frame_id / 1000, dtype=np.float32)
+    image = np.full((240, 320, 3), frame_id % 256, dtype=np.uint8)
+    return HandFrame(frame_id, 100.0 + frame_id, image, results_from_arrays(landmarks, labels, scores))
+
+
+def check_entry(entry, frame_id, hand_count=1):
+    read_id, capture_time, thumbnail, landmarks, labels, scores = entry
+    assert read_id == frame_id
+    assert capture_time == 100.0 + frame_id
+    assert thumbnail.shape == (THUMBNAIL_SIZE[1], THUMBNAIL_SIZE[0], 3)
+    assert (thumbnail == frame_id % 256).all()
+    assert landmarks.shape == (hand_count, 21, 3)
+    assert np.allclose(landmarks, frame_id / 1000)
+    assert labels.tolist() == [i % 2 for i in range(hand_count)]
+    assert np.allclose(scores, 0.5 + frame_id / 1000)
+
+
+# Attaches a reader in this process. Attaching takes the segment off the resource tracker, which
+# here is also the tracker of the writer, so it goes back on for the writer to remove it later.
+def attach(name):
+    reader = LandmarkRing(name)
+    resource_tracker.register(reader.memory._name, "shared_memory")
+    return reader
+
+
+@pytest.fixture
+def ring():
+    rings = []
+
+    def create(slots=8):
+        writer = LandmarkRing.create(slots)
+        reader = attach(writer.name)
+        rings.append((writer, reader))
+        return writer, reader
+
+    yield create
+    for writer, reader in rings:
+        for end in (reader, writer):
+            if end.header is not None:
+                end.release()
+
+
+def test_reader_gets_what_the_writer_wrote(ring):
+    writer, reader = ring()
+    assert reader.read_latest() is None
+    for frame_id, hand_count in [(0, 1), (1, 2), (2, 0)]:
+        writer.write_frame(make_frame(frame_id, hand_count))
+        check_entry(reader.read_latest(), frame_id, hand_count)
+
+
+def test_wraparound_keeps_the_last_slots(ring):
+    writer, reader = ring(slots=4)
+    for frame_id in range(10):
+        writer.write_frame(make_frame(frame_id))
+    assert int(reader.header["written"]) == 10
+    check_entry(reader.read_latest(), 9)
+    # Frames 6 to 9 are left, frame 8 went to slot 8 % 4
+    assert sorted(reader.frame_id.tolist()) == [6, 7, 8, 9]
+    assert int(reader.frame_id[0]) == 8
+    # Every slot was written 2 or 3 times, two sequence steps each
+    assert reader.sequence.tolist() == [6, 6, 4, 4]
+
+
+def test_entry_being_written_is_not_read(ring):
+    writer, reader = ring()
+    writer.write_frame(make_frame(0))
+    writer.write_frame(make_frame(1))
+    # The writer is half way through changing the newest entry
+    writer.sequence[1] += 1
+    assert reader.read_latest() is None
+    writer.sequence[1] += 1
+    check_entry(reader.read_latest(), 1)
+
+
+# Sequence numbers of a reader that let the writer write a new frame right after the reader
+# first looked at a sequence number, so the reader copies the entry while it changes
+class WriteDuringRead:
+    def __init__(self, sequence, write):
+        self.sequence = sequence
+        self.write = write
+        self.reads = 0
+
+    def __getitem__(self, index):
+        self.reads += 1
+        value = self.sequence[index]
+        if self.reads == 1:
+            self.write()
+        return value
+
+
+def test_read_torn_by_a_write_is_retried(ring):
+    # With one slot every write goes to the entry the reader is reading
+    writer, reader = ring(slots=1)
+    writer.write_frame(make_frame(0))
+    reader.sequence = WriteDuringRead(reader.sequence, lambda: writer.write_frame(make_frame(1)))
+
+    check_entry(reader.read_latest(), 1)
+    # Two looks at the sequence number per attempt, the first attempt was thrown away
+    assert reader.sequence.reads == 4
+
+
+def test_release_removes_the_segment_once_the_writer_lets_go(ring):
+    writer, reader = ring()
+    writer.write_frame(make_frame(0))
+    writer.close()
+    assert reader.closed
+
+    name = writer.name
+    reader.release()
+    # Only the process that created it removes it
+    attach(name).release()
+    writer.release()
+    with pytest.raises(FileNotFoundError):
+        LandmarkRing(name)
+
+
+def test_shm_pipeline_removes_its_segment_on_stop(tmp_path):
+    path = str(tmp_path / "session.nflm")
+    write_recording(path, [hand_pose(fist=i / 300) for i in range(300)])
+    pipeline = open_shm_pipeline(path, {})
+    name = pipeline.ring.name
+    deadline = time.perf_counter() + 20
+    while pipeline.latest().frame_id < 0 and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    assert pipeline.latest().frame_id >= 0
+
+    pipeline.stop()
+    assert pipeline.process.poll() is not None
+    with pytest.raises(FileNotFoundError):
+        LandmarkRing(name)
+
+
+def test_shm_pipeline_records_what_the_game_got(tmp_path):
+    source = str(tmp_path / "source.nflm")
+    poses = [hand_pose(wrist_x=0.2 + i / 500, fist=i / 300) for i in range(300)]
+    write_recording(source, poses)
+    path = str(tmp_path / "session.nflm")
+    pipeline = open_shm_pipeline(source, {}, recorder=LandmarkRecorder(path, 5, THUMBNAIL_SIZE))
+    deadline = time.perf_counter() + 20
+    while pipeline.latest().frame_id < 0 and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    frames = [pipeline.latest()]
+    for _ in range(10):
+        time.sleep(0.05)
+        frames.append(pipeline.latest())
+    pipeline.stop()
+
+    replay = LandmarkReplay(path)
+    assert replay.seed == 5
+    assert replay.frame_size == THUMBNAIL_SIZE
+    # The frames from before the first result came are in the recording too
+    assert replay.frame_ids[-len(frames):] == [frame.frame_id for frame in frames]
+    assert replay.capture_times[-len(frames):] == [frame.capture_time for frame in frames]
+    for frame, results in zip(frames, replay.results[-len(frames):]):
+        np.testing.assert_array_equal(results_to_arrays(results)[0][0], poses[frame.frame_id])
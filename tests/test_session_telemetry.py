@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from hand_pipeline import NO_HANDS, HandFrame
+from landmark_replay import results_from_arrays
+from session_telemetry import BATCH, HEADER, RECORD, TelemetryRecorder, load_session, open_telemetry
+
+
+# Game frame i: a hand on every other frame, taken 20 ms before the game used it
+def record_frame(telemetry, i):
+    now = 10.0 + i / 30
+    if i % 2:
+        results = results_from_arrays(np.zeros((1, 21, 3), dtype=np.float32), np.array([1], dtype=np.uint8),
+                                      np.array([0.75], dtype=np.float32))
+    else:
+        results = NO_HANDS
+    frame = HandFrame(i, now - 0.02, None, results)
+    telemetry.frame(now, frame, playing=i > 2, score=i // 3, hits=i, misses=i // 2, gesture=i / 10, x=i * 5.0)
+
+
+def check_records(columns, frames):
+    i = np.array(frames)
+    assert np.allclose(columns["time"], 10.0 + i / 30)
+    assert columns["frame_id"].tolist() == frames
+    assert np.allclose(columns["frame_ms"][1:], np.diff(columns["time"]) * 1000)
+    assert np.allclose(columns["latency_ms"], 20.0, atol=1e-3)
+    assert columns["hands"].tolist() == [f % 2 for f in frames]
+    assert np.allclose(columns["confidence"], np.where(i % 2, 0.75, np.nan), equal_nan=True)
+    assert columns["playing"].tolist() == [int(f > 2) for f in frames]
+    assert columns["score"].tolist() == [f // 3 for f in frames]
+    assert columns["hits"].tolist() == frames
+    assert columns["misses"].tolist() == [f // 2 for f in frames]
+    assert np.allclose(columns["gesture"], i / 10)
+    assert np.allclose(columns["x"], i * 5.0)
+    assert np.isnan(columns["y"]).all()
+
+
+# Batches in a telemetry file, from its size: each adds its count and one record per row
+def batch_count(path, records):
+    with open(path, "rb") as file:
+        _, _, metadata_size = HEADER.unpack(file.read(HEADER.size))
+    return (os.path.getsize(path) - HEADER.size - metadata_size - records * RECORD.itemsize) // BATCH.size
+
+
+# File whose writes wait until go is set, like a disk that has stalled
+class StalledFile:
+    def __init__(self, file):
+        self.file = file
+        self.go = threading.Event()
+
+    def write(self, data):
+        self.go.wait()
+        return self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+
+def test_session_round_trip_with_a_batch_that_wraps(tmp_path):
+    path = str(tmp_path / "session.nftl")
+    # The writer only writes when asked to, so the batches are known
+    telemetry = TelemetryRecorder(path, "game2", capacity=8, batch_size=100, flush_every=60)
+    for i in range(5):
+        record_frame(telemetry, i)
+    telemetry.flush()
+    # Records 5 to 10 go round the end of the ring, they are written as two batches
+    for i in range(5, 11):
+        record_frame(telemetry, i)
+    telemetry.close()
+
+    metadata, columns = load_session(path)
+    assert metadata["game"] == "game2"
+    assert [name for name, _ in metadata["columns"]] == list(RECORD.names)
+    check_records(columns, list(range(11)))
+    assert batch_count(path, 11) == 3
+
+
+def test_records_are_dropped_while_the_writer_is_busy(tmp_path):
+    path = str(tmp_path / "session.nftl")
+    telemetry = TelemetryRecorder(path, "game1", capacity=4, batch_size=2, flush_every=60)
+    telemetry.file = StalledFile(telemetry.file)
+    # The writer is woken after two records but cannot get them out, so the ring fills up
+    for i in range(10):
+        record_frame(telemetry, i)
+    assert telemetry.dropped == 6
+
+    telemetry.file.go.set()
+    deadline = time.perf_counter() + 5
+    while telemetry.flushed < 4 and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    # Once the writer has caught up new records fit again
+    for i in range(10, 12):
+        record_frame(telemetry, i)
+    telemetry.close()
+    assert telemetry.dropped == 6
+
+    _, columns = load_session(path)
+    # The game kept going, only the records that did not fit are missing
+    check_records(columns, [0, 1, 2, 3, 10, 11])
+
+
+def test_empty_session(tmp_path):
+    path = str(tmp_path / "session.nftl")
+    TelemetryRecorder(path, "game3").close()
+    metadata, columns = load_session(path)
+    assert metadata["game"] == "game3"
+    assert all(len(column) == 0 for column in columns.values())
+
+
+def test_sessions_started_in_the_same_second_get_their_own_files(tmp_path, monkeypatch):
+    monkeypatch.setenv("NEROFLEX_TELEMETRY", str(tmp_path))
+    monkeypatch.setattr(time, "strftime", lambda format, *args: "20240101-120000")
+    sessions = [open_telemetry("game1") for _ in range(3)]
+    for i, telemetry in enumerate(sessions):
+        record_frame(telemetry, i)
+        telemetry.close()
+
+    assert [os.path.basename(telemetry.path) for telemetry in sessions] == [
+        "game1-20240101-120000.nftl", "game1-20240101-120000-2.nftl", "game1-20240101-120000-3.nftl"]
+    for i, telemetry in enumerate(sessions):
+        check_records(load_session(telemetry.path)[1], [i])